@@ -0,0 +1,381 @@
+"""Benchmark reproducible de la API.
+
+Genera un conjunto de datos sintético en un directorio temporal: pedidos con
+items que existen en el recetario de costos.json, gastos de varios años,
+árboles profundos de stock y precios, y miles de clientes. Después levanta
+main.py sobre esos datos, recorre las rutas principales con el test client de
+Flask y reporta latencias (p50/p95/p99) y throughput en JSON, para comparar
+corridas en el tiempo:
+
+    python benchmark.py --escala media --salida bench.json
+    python benchmark.py --escala media --comparar bench.json
+
+La misma semilla genera los mismos datos y la misma secuencia de peticiones.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+ESCALAS = {
+    'chica': {'pedidos': 1000, 'clientes': 300, 'anios': 2, 'nodos': 300, 'profundidad': 5, 'recetas': 10, 'ingredientes': 30},
+    'media': {'pedidos': 10000, 'clientes': 2000, 'anios': 5, 'nodos': 3000, 'profundidad': 8, 'recetas': 25, 'ingredientes': 60},
+    'grande': {'pedidos': 50000, 'clientes': 8000, 'anios': 10, 'nodos': 15000, 'profundidad': 12, 'recetas': 50, 'ingredientes': 120},
+}
+
+ESCENARIOS = ('get_all_data', 'add_pedido', 'update_pedido', 'update_gastos_by_month_year',
+              'delete_stock_subtree', 'delete_precios_subtree')
+
+# --- Generación de datos ---
+
+def nuevo_id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+def fecha_aleatoria(rng, anios):
+    fin = datetime.datetime(2025, 12, 31)
+    return fin - datetime.timedelta(seconds=rng.randrange(int(anios * 365 * 86400)))
+
+def generar_costos(rng, params):
+    ingredientes = []
+    for i in range(params['ingredientes']):
+        cantidad_base = rng.choice([1, 10, 100, 1000])
+        costo_base = round(rng.uniform(500, 50000), 2)
+        uso = rng.choice([1, 2, 20, 50, 150])
+        ingredientes.append({
+            'id': nuevo_id(rng),
+            'nombre': f'INGREDIENTE {i:03d}',
+            'costoBase': costo_base,
+            'cantidadBase': cantidad_base,
+            'usoPorHamburguesa': uso,
+            'costoPorUnidad': costo_base / cantidad_base,
+            'costoRealPorHamburguesa': costo_base / cantidad_base * uso,
+        })
+    hamburguesas = []
+    for i in range(params['recetas']):
+        elegidos = rng.sample(ingredientes, min(len(ingredientes), rng.randint(4, 8)))
+        refs = [{'id': ing['id'], 'nombre': ing['nombre'], 'cantidad': ing['usoPorHamburguesa']} for ing in elegidos]
+        hamburguesas.append({
+            'id': nuevo_id(rng),
+            'nombre': f'BURGER {i:02d}',
+            'ingredientes': refs,
+            # Misma fórmula que CostEngine.costo_receta
+            'costoTotal': sum(ing['costoPorUnidad'] * ref['cantidad'] for ing, ref in zip(elegidos, refs)),
+        })
+    return {'ingredientes': ingredientes, 'hamburguesas': hamburguesas}
+
+def generar_arbol(rng, params, hoja, prefijo):
+    """Árbol de `nodos` registros con `profundidad` niveles de títulos; cada
+    nodo cuelga de uno al azar del nivel anterior y las hojas son productos."""
+    niveles = params['profundidad']
+    por_nivel = max(1, params['nodos'] // niveles)
+    items, anterior = [], [None]
+    for nivel in range(niveles):
+        actual = []
+        for i in range(por_nivel):
+            padre = rng.choice(anterior)
+            if nivel == niveles - 1:
+                item = hoja(rng, f'{prefijo} {nivel}-{i}')
+            else:
+                item = {'tipo': 'titulo', 'descripcion': f'{prefijo} {nivel}-{i}'}
+            item['id'] = nuevo_id(rng)
+            item['padre_id'] = padre or ''
+            items.append(item)
+            actual.append(item['id'])
+        anterior = actual
+    return items
+
+def generar_stock(rng, params, costos):
+    # Los ingredientes del recetario están en el stock, así los pedidos descuentan
+    titulo = {'id': nuevo_id(rng), 'tipo': 'titulo', 'descripcion': 'INSUMOS', 'padre_id': ''}
+    insumos = [{'id': nuevo_id(rng), 'tipo': 'producto', 'descripcion': ing['nombre'], 'codigo': f'INS{i:03d}',
+                'padre_id': titulo['id'], 'cantidad': float(rng.randint(1000, 100000))}
+               for i, ing in enumerate(costos['ingredientes'])]
+    producto = lambda rng, nombre: {'tipo': 'producto', 'descripcion': nombre, 'codigo': '', 'cantidad': float(rng.randint(0, 500))}
+    return [titulo] + insumos + generar_arbol(rng, params, producto, 'STOCK')
+
+def generar_precios(rng, params):
+    def item(rng, nombre):
+        historial, precio = [], rng.randint(500, 5000)
+        for anio in range(2025 - params['anios'] + 1, 2026):
+            precio = round(precio * rng.uniform(1.05, 1.6))
+            historial.append({'date': f'{anio}-01-01', 'price': precio})
+        return {'tipo': 'item', 'descripcion': nombre, 'codigo': '', 'price_history': historial}
+    return generar_arbol(rng, params, item, 'PRECIO')
+
+def generar_pedidos_y_clientes(rng, params, costos, stock):
+    vendibles = [h['nombre'] for h in costos['hamburguesas']] * 3
+    vendibles += [s['descripcion'] for s in stock if s.get('tipo') == 'producto'][:50]
+    vendibles.append('Delivery')
+    direcciones = [f'Calle {i} {rng.randint(1, 9999)}' for i in range(params['clientes'])]
+    pedidos = []
+    for _ in range(params['pedidos']):
+        fecha = fecha_aleatoria(rng, params['anios']).isoformat()
+        items = [{'descripcion': rng.choice(vendibles), 'cantidad': rng.randint(1, 3), 'precio': rng.randint(3000, 15000)}
+                 for _ in range(rng.randint(1, 4))]
+        pedidos.append({
+            'id': nuevo_id(rng), 'direccion': rng.choice(direcciones), 'items': items,
+            'montoTotal': sum(i['precio'] * i['cantidad'] for i in items), 'observacion': '',
+            'estado': 'entregado', 'fecha_creacion': fecha, 'fecha_entrega': fecha,
+        })
+    pedidos.sort(key=lambda p: p['fecha_creacion'])
+    # Contadores coherentes con los pedidos (como los deja recalcular-clientes)
+    resumen = {}
+    for p in pedidos:
+        cantidad, ultima = resumen.get(p['direccion'], (0, None))
+        resumen[p['direccion']] = (cantidad + 1, max(ultima or '', p['fecha_entrega']))
+    clientes = []
+    for numero, direccion in enumerate(direcciones, start=1):
+        cantidad, ultima = resumen.get(direccion, (0, None))
+        clientes.append({'id': nuevo_id(rng), 'numero': numero, 'direccion': direccion,
+                         'cantidad_pedidos': cantidad, 'ultimo_pedido_fecha': ultima})
+    return pedidos, clientes
+
+def generar_gastos(rng, params):
+    conceptos = [f'CONCEPTO {i:02d}' for i in range(15)]
+    gastos = {}
+    for anio in range(2025 - params['anios'] + 1, 2026):
+        gastos[str(anio)] = {mes: [{'concepto': c, 'monto': f'{rng.uniform(1000, 90000):.2f}',
+                                    'fecha': f'{rng.randint(1, 28):02d}/{m:02d}/{anio}', 'pagado': rng.choice(['si', 'no'])}
+                                   for c in conceptos]
+                             for m, mes in enumerate(MESES, start=1)}
+    return gastos
+
+def generar_datos(directorio, params, semilla):
+    rng = random.Random(semilla)
+    costos = generar_costos(rng, params)
+    stock = generar_stock(rng, params, costos)
+    pedidos, clientes = generar_pedidos_y_clientes(rng, params, costos, stock)
+    colecciones = {
+        'users': [{'usuario': 'admin', 'contrasena': 'admin', 'rol': 'admin', 'frase_bienvenida': '¡Bienvenido, Admin!'}],
+        'costos': costos,
+        'stock': stock,
+        'precios': generar_precios(rng, params),
+        'pedidos': pedidos,
+        'clientes': clientes,
+        'gastos': generar_gastos(rng, params),
+        'ingresos': [],
+        'vencimientos': [],
+        'proveedores': [],
+        'rappi_banco': {'rappi': 0, 'banco': 0},
+        'gastos_recurrentes': [],
+        'precios_historial': [],
+    }
+    datos = os.path.join(directorio, 'datos')
+    os.makedirs(datos, exist_ok=True)
+    tamanos = {}
+    for nombre, contenido in colecciones.items():
+        ruta = os.path.join(datos, f'{nombre}.json')
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f, indent=4, ensure_ascii=False)
+        tamanos[nombre] = os.path.getsize(ruta)
+    return tamanos
+
+# --- Escenarios ---
+
+class Escenarios:
+    """Cada escenario arma y envía una petición; devuelve la respuesta."""
+
+    def __init__(self, main, client, rng):
+        self.main = main
+        self.client = client
+        self.rng = rng
+        costos = main.read_data(main.COSTOS_FILE)
+        self.vendibles = [h['nombre'] for h in costos['hamburguesas']] + ['Delivery']
+        self.pedidos = [p['id'] for p in main.read_data(main.PEDIDOS_FILE)]
+        self.ramas = {fp: self._ramas(fp) for fp in (main.STOCK_FILE, main.PRECIOS_FILE)}
+
+    def _ramas(self, filepath):
+        # Títulos del segundo nivel: cada borrado se lleva una rama mediana
+        raices = {item['id'] for item in self.main.read_data(filepath) if not item.get('padre_id')}
+        ramas = [item['id'] for item in self.main.read_data(filepath) if item.get('padre_id') in raices]
+        self.rng.shuffle(ramas)
+        return ramas
+
+    def _items(self):
+        return [{'descripcion': self.rng.choice(self.vendibles), 'cantidad': self.rng.randint(1, 3), 'precio': 5000}
+                for _ in range(self.rng.randint(1, 4))]
+
+    def get_all_data(self):
+        return self.client.get('/api/data')
+
+    def add_pedido(self):
+        r = self.client.post('/api/data/pedidos', json={'direccion': f'Calle {self.rng.randrange(100)} 1', 'items': self._items()})
+        if r.status_code == 201:
+            self.pedidos.append(r.get_json()['id'])
+        return r
+
+    def update_pedido(self):
+        return self.client.put(f'/api/data/pedidos/{self.rng.choice(self.pedidos)}', json={'items': self._items()})
+
+    def update_gastos_by_month_year(self):
+        anio = self.rng.randint(2022, 2025)
+        mes = self.rng.choice(MESES)
+        items = [{'concepto': f'CONCEPTO {i:02d}', 'monto': str(self.rng.randint(1, 9999)), 'fecha': '', 'pagado': 'no'}
+                 for i in range(15)]
+        return self.client.put(f'/api/data/gastos/month/{mes}/year/{anio}', json=items)
+
+    def _delete_subtree(self, filepath, coleccion):
+        ramas = self.ramas[filepath]
+        while ramas:
+            item_id = ramas.pop()
+            if self.main.store.get_item(filepath, item_id) is not None:
+                return self.client.delete(f'/api/data/{coleccion}/{item_id}')
+        return None  # no quedan ramas para borrar
+
+    def delete_stock_subtree(self):
+        return self._delete_subtree(self.main.STOCK_FILE, 'stock')
+
+    def delete_precios_subtree(self):
+        return self._delete_subtree(self.main.PRECIOS_FILE, 'precios')
+
+def percentil(ordenadas, p):
+    if not ordenadas:
+        return 0.0
+    return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))], 3)
+
+def medir(funcion, repeticiones):
+    tiempos, errores = [], 0
+    inicio_total = time.perf_counter()
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = funcion()
+        if respuesta is None:
+            break
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        if respuesta.status_code >= 400:
+            errores += 1
+    total = time.perf_counter() - inicio_total
+    ordenadas = sorted(tiempos)
+    return {
+        'n': len(tiempos),
+        'errores': errores,
+        'p50_ms': percentil(ordenadas, 0.50),
+        'p95_ms': percentil(ordenadas, 0.95),
+        'p99_ms': percentil(ordenadas, 0.99),
+        'media_ms': round(sum(tiempos) / len(tiempos), 3) if tiempos else 0.0,
+        'max_ms': round(ordenadas[-1], 3) if ordenadas else 0.0,
+        'throughput_rps': round(len(tiempos) / total, 1) if total > 0 else 0.0,
+    }
+
+def comparar(actual, anterior):
+    """Cociente actual/anterior de p50 y p95 por escenario (>1 = más lento)."""
+    comparacion = {}
+    for nombre, r in actual['resultados'].items():
+        previo = anterior.get('resultados', {}).get(nombre)
+        if not previo:
+            continue
+        comparacion[nombre] = {
+            campo: round(r[campo] / previo[campo], 2) if previo[campo] else None
+            for campo in ('p50_ms', 'p95_ms', 'p99_ms')
+        }
+    return comparacion
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escala', choices=sorted(ESCALAS), default='chica')
+    for campo in ESCALAS['chica']:
+        parser.add_argument(f'--{campo}', type=int, help='Reemplaza el valor de la escala elegida')
+    parser.add_argument('--repeticiones', type=int, default=200, help='Peticiones por escenario')
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS), help='Lista separada por comas')
+    parser.add_argument('--semilla', type=int, default=1234)
+    parser.add_argument('--flush-interval', default='2', help='STORE_FLUSH_INTERVAL de la corrida')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar)')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior')
+    parser.add_argument('--conservar', action='store_true', help='No borrar el directorio de datos generado')
+    parser.add_argument('--archivar', action='store_true',
+                        help='Pasar los meses cerrados al archivo mensual antes de medir (cuenta en el arranque)')
+    args = parser.parse_args()
+
+    params = dict(ESCALAS[args.escala])
+    for campo in params:
+        if getattr(args, campo) is not None:
+            params[campo] = getattr(args, campo)
+    escenarios = [e.strip() for e in args.escenarios.split(',') if e.strip()]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    directorio = tempfile.mkdtemp(prefix='milhover-bench-')
+    origen = os.getcwd()
+    inicio = time.perf_counter()
+    tamanos = generar_datos(directorio, params, args.semilla)
+    generacion_s = time.perf_counter() - inicio
+
+    # main.py usa 'datos/' relativo al directorio actual y lee la
+    # configuración del almacén al importarse
+    os.chdir(directorio)
+    os.environ['STORE_FLUSH_INTERVAL'] = args.flush_interval
+    # El archivado automático corre en segundo plano y metería ruido en la medición
+    os.environ['ARCHIVE_AUTO'] = '0'
+    sys.path.insert(0, RAIZ)
+    app_main = None
+    try:
+        inicio = time.perf_counter()
+        import main as app_main
+        client = app_main.app.test_client()
+        if args.archivar:
+            app_main.archivar_periodos_cerrados()
+        client.get('/api/data')  # carga inicial, fuera de la medición
+        arranque_s = time.perf_counter() - inicio
+        rng = random.Random(args.semilla)
+        casos = Escenarios(app_main, client, rng)
+        resultados = {}
+        for nombre in escenarios:
+            resultados[nombre] = medir(getattr(casos, nombre), args.repeticiones)
+            print(f"✅ {nombre}: p50 {resultados[nombre]['p50_ms']} ms, p95 {resultados[nombre]['p95_ms']} ms", file=sys.stderr)
+    finally:
+        # Volcar lo pendiente antes de salir del directorio: las rutas de
+        # datos son relativas
+        if app_main is not None:
+            app_main.store.shutdown()
+        os.chdir(origen)
+        if args.conservar:
+            print(f"Datos generados en {directorio}", file=sys.stderr)
+        else:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    informe = {
+        'fecha': datetime.datetime.now().isoformat(),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'escala': args.escala,
+        'parametros': params,
+        'semilla': args.semilla,
+        'repeticiones': args.repeticiones,
+        'flush_interval': args.flush_interval,
+        'archivado': args.archivar,
+        'datos_bytes': tamanos,
+        'generacion_s': round(generacion_s, 3),
+        'arranque_s': round(arranque_s, 3),
+        'resultados': resultados,
+    }
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            informe['comparacion'] = comparar(informe, json.load(f))
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,109 @@
+import time
+INICIO_ARRANQUE = time.perf_counter()  # para medir las fases del arranque (ver "Arranque")
 import json
 import os
+import gzip
 import datetime
 import uuid
-import pandas as pd
-from dateutil.relativedelta import relativedelta
-from flask import Flask, request, jsonify, send_from_directory
+import atexit
+import threading
+import tempfile
+import itertools
+import functools
+import heapq
+import base64
+import binascii
+import csv
+import io
+import unicodedata
+import zipfile
+import sqlite3
+import bisect
+import cProfile
+import hashlib
+import hmac
+import secrets
+import mimetypes
+from contextlib import contextmanager, ExitStack
+from collections import OrderedDict, deque
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+import importlib
+import click
+from flask import Flask, request, jsonify, send_from_directory, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from werkzeug.security import generate_password_hash, check_password_hash
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se usa el json de la biblioteca estándar
+    orjson = None
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se comprime con gzip
+    brotli = None
+FIN_IMPORTACIONES = time.perf_counter()
 
-app = Flask(__name__, static_folder="static")
-CORS(app)
+# --- Serialización JSON ---
+# Un solo punto para convertir a/desde JSON (archivos, diario, SQLite y
+# respuestas). Con orjson instalado es varias veces más rápido; el formato
+# indentado (4 espacios, el de siempre) sigue saliendo del json estándar para
+# que los archivos queden idénticos.
+def serializar(data, indentado=False):
+    """JSON de `data` en bytes UTF-8; compacto salvo que se pida indentado."""
+    if indentado:
+        return json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # tipos que orjson no acepta (ej. enteros de más de 64 bits)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
-@app.route("/")
-def serve_html():
-    return send_from_directory(app.static_folder, "milhover_pet.html")
+def serializar_texto(data):
+    return serializar(data).decode('utf-8')
 
-@app.route("/ping")
-def ping():
-    return jsonify({"status": "pong"}), 200
+def deserializar(contenido):
+    """Acepta str o bytes. Los errores son json.JSONDecodeError en ambos casos."""
+    if orjson is not None:
+        return orjson.loads(contenido)
+    return json.loads(contenido)
 
-# Inicialización protegida
-def ensure_data_dir():
-    print("✅ ensure_data_dir ejecutado")
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify con orjson. Mismo resultado que el proveedor por defecto:
+    claves ordenadas y fechas en formato HTTP (pasan por `default`)."""
 
-def initialize_data():
-    print("✅ initialize_data ejecutado")
+    def dumps(self, obj, **kwargs):
+        opciones = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if kwargs.get('sort_keys', self.sort_keys):
+            opciones |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            opciones |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=opciones).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj, **kwargs)
 
-try:
-    ensure_data_dir()
-    initialize_data()
-    print("✅ Inicialización completada")
-except Exception as e:
-    print(f"❌ Error en inicialización: {e}")
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    print(f"Servidor Flask iniciado en http://0.0.0.0:{port}")
-    app.run(host="0.0.0.0", port=port)
+app = Flask(__name__, static_folder="static")
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'Idempotent-Replayed'])
 
+@app.route("/")
+def serve_html():
+    return servir_estatico(os.path.join(app.static_folder, "milhover_pet.html"), max_age=0)
 
+@app.route("/ping")
+def ping():
+    # Responde desde el primer momento; 'precalentado' indica si las
+    # colecciones ya están en memoria
+    return jsonify({"status": "pong", "precalentado": precalentado.is_set(), "arranque_ms": tiempos_arranque}), 200
 
 # Define la carpeta donde se guardarán los datos
 DATA_DIR = 'datos'
@@ -52,236 +118,3132 @@ CLIENTES_FILE = os.path.join(DATA_DIR, 'clientes.json')
 RAPPI_BANCO_FILE = os.path.join(DATA_DIR, 'rappi_banco.json')
 VENCIMIENTOS_FILE = os.path.join(DATA_DIR, 'vencimientos.json')
 PROVEEDORES_FILE = os.path.join(DATA_DIR, 'proveedores.json')
+GASTOS_RECURRENTES_FILE = os.path.join(DATA_DIR, 'gastos_recurrentes.json')
+PRECIOS_HISTORIAL_FILE = os.path.join(DATA_DIR, 'precios_historial.json')
+SESIONES_FILE = os.path.join(DATA_DIR, 'sesiones.json')
+DATA_FILES = [USERS_FILE, INGRESOS_FILE, GASTOS_FILE, PRECIOS_FILE, COSTOS_FILE, STOCK_FILE,
+              PEDIDOS_FILE, CLIENTES_FILE, RAPPI_BANCO_FILE, VENCIMIENTOS_FILE, PROVEEDORES_FILE,
+              GASTOS_RECURRENTES_FILE, PRECIOS_HISTORIAL_FILE, SESIONES_FILE]
 
 # Función auxiliar para asegurar que la carpeta de datos existe
 def ensure_data_dir():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
+# --- Almacén de datos en memoria ---
+# Cada colección se carga una sola vez desde disco y se sirve desde memoria.
+# Las escrituras marcan la colección como "sucia" y un hilo en segundo plano
+# las vuelca a disco cada STORE_FLUSH_INTERVAL segundos (0 = escritura inmediata).
+# Al apagar el proceso se vuelca todo lo pendiente.
+#
+# Con varios workers de gunicorn (WEB_CONCURRENCY > 1 o STORE_MULTIPROCESS=1)
+# las escrituras pasan a ser inmediatas y cada colección se bloquea con fcntl
+# mientras una petición la modifica, para que los procesos no se pisen.
+STORE_FLUSH_INTERVAL = float(os.environ.get('STORE_FLUSH_INTERVAL', 2))
+STORE_MULTIPROCESS = os.environ.get('STORE_MULTIPROCESS') == '1' or int(os.environ.get('WEB_CONCURRENCY', 1)) > 1
+STORE_LOCK_TIMEOUT = float(os.environ.get('STORE_LOCK_TIMEOUT', 10))
+STORE_READ_RETRIES = 5
+LOCKS_DIR = os.path.join(DATA_DIR, '.locks')
+REVISION_FILE = os.path.join(DATA_DIR, '.revision')
+
+# Motor de almacenamiento: 'json' (un archivo por colección) o 'sqlite'.
+# Para pasar a SQLite: `flask --app main migrar-sqlite` y luego STORE_BACKEND=sqlite.
+STORE_BACKEND = os.environ.get('STORE_BACKEND', 'json')
+SQLITE_FILE = os.environ.get('STORE_SQLITE_PATH', os.path.join(DATA_DIR, 'milhover.db'))
+
+# Formato de los archivos JSON nuevos: 'indentado' (el original, cómodo para
+# editar a mano) o 'compacto' (sin espacios: cerca de la mitad de tamaño y más
+# rápido de leer y escribir). Los existentes conservan el formato en que están;
+# `flask --app main convertir-datos` los pasa a compacto y comprime con gzip
+# las colecciones grandes (<coleccion>.json.gz).
+STORE_JSON_FORMAT = os.environ.get('STORE_JSON_FORMAT', 'indentado')
+STORE_GZIP_LEVEL = 6
+
+# Diario de operaciones (solo con archivos JSON) para las colecciones que solo
+# crecen: cada alta/cambio/baja se agrega al final en lugar de reescribir todo
+STORE_JOURNAL = os.environ.get('STORE_JOURNAL', '1') == '1'
+JOURNAL_DIR = os.path.join(DATA_DIR, 'diario')
+JOURNAL_COMPACT_BYTES = int(os.environ.get('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+JOURNALED_FILES = [PEDIDOS_FILE, INGRESOS_FILE, PRECIOS_HISTORIAL_FILE, SESIONES_FILE]
+
+# Cantidad de cambios recordados para la sincronización incremental de /api/data
+CHANGELOG_SIZE = int(os.environ.get('STORE_CHANGELOG_SIZE', 10000))
+
+# Clave de cada registro en las colecciones tipo lista ('id' si no figura aquí;
+# None = sin clave, solo se guardan completas) e índices secundarios en memoria
+COLLECTION_KEYS = {USERS_FILE: 'usuario', PROVEEDORES_FILE: None}
+COLLECTION_INDEXES = {
+    CLIENTES_FILE: {'direccion': lambda c: normalizar_direccion(c.get('direccion'))},
+    PEDIDOS_FILE: {'direccion': lambda p: normalizar_direccion(p.get('direccion'))},
+    # Jerarquías: hijos de cada padre (los registros raíz quedan bajo None)
+    STOCK_FILE: {'padre_id': lambda x: x.get('padre_id') or None},
+    PRECIOS_FILE: {'padre_id': lambda x: x.get('padre_id') or None},
+    VENCIMIENTOS_FILE: {'padre_id': lambda x: x.get('padre_id') or None},
+    PRECIOS_HISTORIAL_FILE: {'item': lambda h: h.get('item')},
+    SESIONES_FILE: {'usuario': lambda s: s.get('usuario')},
+}
+# Vista que devuelve la API de cada registro, si no es el registro tal cual
+COLLECTION_VIEWS = {}
+# Fecha de cada colección: ordena las páginas de las consultas (por fecha y
+# clave; las que no figuran, solo por clave) y es la del filtro desde/hasta
+COLLECTION_ORDERS = {
+    INGRESOS_FILE: 'fecha',
+    PEDIDOS_FILE: 'fecha_entrega',
+    CLIENTES_FILE: 'ultimo_pedido_fecha',
+    VENCIMIENTOS_FILE: 'vencimiento',
+}
+
+class LatencyStats:
+    """Acumula latencias (en milisegundos) de una operación del almacén."""
+
+    def __init__(self, max_samples=1024):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def observe(self, inicio):
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self.samples.append(ms)
+
+    def summary(self):
+        with self._lock:
+            ordenadas = sorted(self.samples)
+            count, total_ms, max_ms = self.count, self.total_ms, self.max_ms
+        def percentil(p):
+            if not ordenadas:
+                return 0.0
+            return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))], 3)
+        return {
+            "count": count,
+            "avg_ms": round(total_ms / count, 3) if count else 0.0,
+            "p50_ms": percentil(0.50),
+            "p95_ms": percentil(0.95),
+            "max_ms": round(max_ms, 3),
+        }
+
+# --- Métricas ---
+# Contadores, medidores e histogramas en memoria, exportados en /metrics con
+# el formato de texto de Prometheus. Son por proceso: con varios workers cada
+# uno informa los suyos.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, valor):
+        posicion = bisect.bisect_left(self.buckets, valor)
+        if posicion < len(self.buckets):
+            self.counts[posicion] += 1
+        self.sum += valor
+        self.count += 1
+
+class Metrics:
+    """Registro de métricas del proceso. Cada métrica se declara una vez
+    (counter/gauge/histogram) y sus series se crean al usarla con etiquetas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definiciones = {}  # nombre → (tipo, ayuda, buckets)
+        self._series = {}  # nombre → {etiquetas: valor | Histogram}
+
+    def _declarar(self, nombre, tipo, ayuda, buckets=None):
+        self._definiciones[nombre] = (tipo, ayuda, buckets)
+        self._series[nombre] = {}
+
+    def counter(self, nombre, ayuda):
+        self._declarar(nombre, 'counter', ayuda)
+
+    def gauge(self, nombre, ayuda):
+        self._declarar(nombre, 'gauge', ayuda)
+
+    def histogram(self, nombre, ayuda, buckets):
+        self._declarar(nombre, 'histogram', ayuda, buckets)
+
+    def inc(self, nombre, valor=1, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            series = self._series[nombre]
+            series[clave] = series.get(clave, 0) + valor
+
+    def set(self, nombre, valor, **etiquetas):
+        with self._lock:
+            self._series[nombre][tuple(sorted(etiquetas.items()))] = valor
+
+    def observe(self, nombre, valor, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            series = self._series[nombre]
+            if clave not in series:
+                series[clave] = Histogram(self._definiciones[nombre][2])
+            series[clave].observe(valor)
+
+    def render(self):
+        lineas = []
+        with self._lock:
+            for nombre, (tipo, ayuda, buckets) in self._definiciones.items():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for clave, valor in self._series[nombre].items():
+                    if tipo != 'histogram':
+                        lineas.append(f"{nombre}{formato_etiquetas(clave)} {valor}")
+                        continue
+                    acumulado = 0
+                    for limite, cantidad in zip(buckets, valor.counts):
+                        acumulado += cantidad
+                        lineas.append(f"{nombre}_bucket{formato_etiquetas(clave + (('le', limite),))} {acumulado}")
+                    lineas.append(f"{nombre}_bucket{formato_etiquetas(clave + (('le', '+Inf'),))} {valor.count}")
+                    lineas.append(f"{nombre}_sum{formato_etiquetas(clave)} {valor.sum}")
+                    lineas.append(f"{nombre}_count{formato_etiquetas(clave)} {valor.count}")
+        return '\n'.join(lineas) + '\n'
+
+def formato_etiquetas(clave):
+    if not clave:
+        return ''
+    partes = []
+    for nombre, valor in clave:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+metrics = Metrics()
+metrics.counter('http_requests_total', 'Peticiones atendidas por método, ruta y código de respuesta.')
+metrics.histogram('http_request_duration_seconds', 'Duración de las peticiones por ruta (incluye la espera del lock del almacén).', METRICS_LATENCY_BUCKETS)
+metrics.histogram('http_request_size_bytes', 'Tamaño del cuerpo de las peticiones por ruta.', METRICS_SIZE_BUCKETS)
+metrics.histogram('http_response_size_bytes', 'Tamaño del cuerpo de las respuestas por ruta (sin contar flujos).', METRICS_SIZE_BUCKETS)
+metrics.counter('store_loads_total', 'Lecturas de una colección desde disco (carga inicial o recarga).')
+metrics.counter('store_mutations_total', 'Cambios en memoria por colección y operación.')
+metrics.counter('store_writes_total', 'Escrituras a disco por colección.')
+metrics.counter('store_serialized_bytes_total', 'Bytes serializados para escribir cada colección.')
+metrics.gauge('store_dirty_collections', 'Colecciones con cambios todavía sin escribir.')
+metrics.counter('stock_plan_compilations_total', 'Compilaciones del plan de descuento de stock.')
+metrics.gauge('stock_plan_missing_ingredients', 'Ingredientes de recetas que el último plan de stock no pudo resolver, por motivo.')
+metrics.counter('stock_deduction_skipped_total', 'Movimientos de stock de pedidos que no se aplicaron, por motivo.')
+metrics.gauge('events_subscribers', 'Conexiones abiertas en /api/events.')
+
+def tamano_serializado(payload):
+    """Bytes de texto que contiene lo que devolvió backend.snapshot."""
+    if isinstance(payload, bytes):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode('utf-8'))
+    if isinstance(payload, (tuple, list)):
+        return sum(tamano_serializado(parte) for parte in payload)
+    return 0
+
+class StorageError(Exception):
+    """No se pudo leer o bloquear una colección de forma segura."""
+
+class ReadWriteLock:
+    """Muchas lecturas a la vez o una sola escritura.
+
+    Una escritura pendiente frena las lecturas nuevas, así no espera para
+    siempre. El hilo que escribe puede volver a tomarlo (para leer o escribir)
+    sin bloquearse.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._lectores = 0
+        self._escritor = None
+        self._profundidad = 0
+        self._esperando = 0
+
+    def acquire_read(self):
+        with self._cond:
+            if self._escritor == threading.get_ident():
+                self._profundidad += 1
+                return
+            while self._escritor is not None or self._esperando:
+                self._cond.wait()
+            self._lectores += 1
+
+    def release_read(self):
+        with self._cond:
+            if self._escritor == threading.get_ident():
+                self._profundidad -= 1
+                return
+            self._lectores -= 1
+            if not self._lectores:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            if self._escritor == threading.get_ident():
+                self._profundidad += 1
+                return
+            self._esperando += 1
+            try:
+                while self._escritor is not None or self._lectores:
+                    self._cond.wait()
+            finally:
+                self._esperando -= 1
+            self._escritor = threading.get_ident()
+            self._profundidad = 1
+
+    def release_write(self):
+        with self._cond:
+            self._profundidad -= 1
+            if not self._profundidad:
+                self._escritor = None
+                self._cond.notify_all()
+
+class CollectionLock:
+    """Bloqueo exclusivo de una colección entre hilos y entre procesos (fcntl).
+
+    Es reentrante para el hilo que lo tiene. El bloqueo se toma sobre un
+    archivo auxiliar en datos/.locks, porque el archivo de datos se reemplaza
+    con rename en cada escritura.
+    """
+
+    def __init__(self, filepath):
+        self.path = os.path.join(LOCKS_DIR, os.path.basename(filepath) + '.lock')
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, timeout=None):
+        timeout = STORE_LOCK_TIMEOUT if timeout is None else timeout
+        if not self._rlock.acquire(timeout=timeout):
+            raise StorageError(f"Tiempo de espera agotado bloqueando {self.path}")
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._lock_file(timeout)
+            except BaseException:
+                self._rlock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def _lock_file(self, timeout):
+        # Espera con backoff acotado en lugar de bloquear indefinidamente:
+        # dos procesos que toman colecciones en distinto orden no se quedan
+        # colgados, uno de ellos recibe un 503 y libera lo suyo.
+        os.makedirs(LOCKS_DIR, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        limite = time.monotonic() + timeout
+        espera = 0.005
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._fd = fd
+                return
+            except BlockingIOError:
+                if time.monotonic() >= limite:
+                    os.close(fd)
+                    raise StorageError(f"Tiempo de espera agotado bloqueando {self.path}")
+                time.sleep(espera)
+                espera = min(espera * 2, 0.1)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class ContadorRevisiones:
+    """Época y revisión compartidas por todos los procesos (datos/.revision).
+
+    El archivo guarda "<época> <revisión>" y se lee y avanza con fcntl. Si
+    falta o está dañado se empieza una época nueva: los tokens anteriores
+    dejan de valer y los clientes reciben las colecciones completas.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def leer(self):
+        return self._operar(0)
+
+    def avanzar(self):
+        return self._operar(1)
+
+    def _operar(self, incremento):
+        ensure_data_dir()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            partes = os.read(fd, 64).decode('ascii', 'replace').split()
+            if len(partes) == 2 and partes[1].isdigit():
+                epoch, revision = partes[0], int(partes[1])
+            else:
+                epoch, revision, incremento = uuid.uuid4().hex[:8], 0, max(incremento, 1)
+            if incremento:
+                revision += incremento
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, f"{epoch} {revision}".encode('ascii'))
+            return epoch, revision
+        finally:
+            os.close(fd)  # cerrar el descriptor libera el flock
+
+def atomic_write_text(filepath, contenido):
+    atomic_write_bytes(filepath, contenido.encode('utf-8'))
+
+def atomic_write_bytes(filepath, contenido):
+    # Escribe en un temporal del mismo directorio y lo renombra encima del
+    # original: un lector ve el archivo viejo o el nuevo, nunca uno a medias.
+    directorio = os.path.dirname(filepath) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, prefix='.' + os.path.basename(filepath) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def file_signature(filepath):
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def normalizar_direccion(direccion):
+    return str(direccion or '').strip().lower()
+
+def collection_name(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def collection_key(filepath):
+    # Campo que identifica a cada registro de una colección tipo lista
+    return COLLECTION_KEYS.get(filepath, 'id')
+
+def entrada_de_orden(filepath, item):
+    # Posición del registro en las consultas paginadas: (fecha, clave)
+    campo = COLLECTION_ORDERS.get(filepath)
+    return (str(item.get(campo) or '') if campo else '', str(item.get(collection_key(filepath))))
+
+class CollectionIndex:
+    """Índices en memoria de una colección tipo lista: clave y secundarios.
+
+    Cada valor de un índice secundario agrupa sus registros en orden de
+    llegada (dict por id del objeto), así quitar uno no recorre el grupo.
+    Con `orden` (registro → entrada comparable) mantiene además la lista
+    ordenada de entradas que usan las consultas paginadas.
+    """
+
+    def __init__(self, items, key_field, secondary, orden=None):
+        self.key_field = key_field
+        self.secondary = secondary
+        self.orden = orden
+        self.by_key = {}
+        self.by = {name: {} for name in secondary}
+        self._ordenados = None  # se arma la primera vez que se pide
+        self._entradas = {}     # id(item) → su entrada en _ordenados
+        self.por_entrada = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if self.key_field:
+            key = item.get(self.key_field)
+            if key is not None:
+                self.by_key.setdefault(key, item)
+                if self._ordenados is not None and self.by_key[key] is item:
+                    self._insertar(item)
+        for name, fn in self.secondary.items():
+            self.by[name].setdefault(fn(item), {})[id(item)] = item
+
+    def remove(self, item):
+        if self.key_field and self.by_key.get(item.get(self.key_field)) is item:
+            del self.by_key[item.get(self.key_field)]
+            self._quitar(item)
+        for name, fn in self.secondary.items():
+            self._discard(name, fn(item), item)
+
+    def ordenados(self):
+        """Entradas de los registros con clave, ordenadas. Después de armarla
+        se mantiene con bisect en cada alta, baja o modificación."""
+        if self._ordenados is None:
+            self._entradas = {id(item): self.orden(item) for item in self.by_key.values()}
+            self.por_entrada = {self._entradas[id(item)]: item for item in self.by_key.values()}
+            self._ordenados = sorted(self.por_entrada)
+        return self._ordenados
+
+    def _insertar(self, item):
+        entrada = self.orden(item)
+        self._entradas[id(item)] = entrada
+        self.por_entrada[entrada] = item
+        bisect.insort(self._ordenados, entrada)
+
+    def _quitar(self, item):
+        entrada = self._entradas.pop(id(item), None)
+        if entrada is not None:
+            del self.por_entrada[entrada]
+            del self._ordenados[bisect.bisect_left(self._ordenados, entrada)]
+
+    def values_of(self, item):
+        return item.get(self.key_field) if self.key_field else None, {name: fn(item) for name, fn in self.secondary.items()}
+
+    def move(self, item, antes):
+        """Reubica `item` después de modificarlo; `antes` es values_of() previo.
+        Solo cambia de grupo en los índices cuyo valor cambió (conserva el orden)."""
+        key, secundarios = antes
+        if self.key_field and item.get(self.key_field) != key:
+            if self.by_key.get(key) is item:
+                del self.by_key[key]
+            if item.get(self.key_field) is not None:
+                self.by_key.setdefault(item.get(self.key_field), item)
+        if self._ordenados is not None and self._entradas.get(id(item)) != self.orden(item):
+            self._quitar(item)
+            if self.by_key.get(item.get(self.key_field)) is item:
+                self._insertar(item)
+        for name, fn in self.secondary.items():
+            valor = fn(item)
+            if valor != secundarios[name]:
+                self._discard(name, secundarios[name], item)
+                self.by[name].setdefault(valor, {})[id(item)] = item
+
+    def _discard(self, name, valor, item):
+        grupo = self.by[name].get(valor)
+        if grupo is not None and grupo.pop(id(item), None) is not None and not grupo:
+            del self.by[name][valor]
+
+class JsonFileBackend:
+    """Persistencia en un archivo JSON por colección.
+
+    Cada archivo conserva el formato en que se lo encontró: indentado,
+    compacto o comprimido con gzip (<archivo>.gz). Los nuevos siguen
+    STORE_JSON_FORMAT; set_formato cambia el de uno (ver convertir-datos).
+    """
+
+    name = 'json'
+    row_level = False
+
+    def __init__(self):
+        self._formatos = {}  # filepath → (indentado, gzip)
+
+    def archivo(self, filepath):
+        """Ruta real de la colección: la versión .gz si existe y es la más nueva."""
+        comprimido, plano = file_signature(filepath + '.gz'), file_signature(filepath)
+        if comprimido and (not plano or comprimido[1] >= plano[1]):
+            return filepath + '.gz'
+        return filepath
+
+    def formato(self, filepath):
+        return self._formatos.get(filepath, (STORE_JSON_FORMAT != 'compacto', False))
+
+    def set_formato(self, filepath, indentado, comprimido):
+        self._formatos[filepath] = (indentado, comprimido)
+
+    def signature(self, filepath):
+        return file_signature(self.archivo(filepath))
+
+    def create(self, filepath, default_value):
+        ensure_data_dir()
+        if not self.exists(filepath):
+            self.persist(filepath, self.snapshot(filepath, default_value, None))
+
+    def exists(self, filepath):
+        return os.path.exists(filepath) or os.path.exists(filepath + '.gz')
+
+    def load(self, filepath, default_value):
+        # Con escrituras atómicas un JSON inválido no debería verse nunca; si
+        # aparece reintentamos con backoff y, si persiste, fallamos en lugar de
+        # devolver el valor por defecto (la siguiente escritura borraría todo).
+        espera = 0.01
+        for intento in range(STORE_READ_RETRIES + 1):
+            ruta = self.archivo(filepath)
+            signature = file_signature(ruta)
+            try:
+                with open(ruta, 'rb') as f:
+                    contenido = f.read()
+                comprimido = ruta.endswith('.gz')
+                if comprimido:
+                    contenido = gzip.decompress(contenido)
+                contenido = contenido.strip()
+                data = deserializar(contenido) if contenido else default_value
+                self._formatos.setdefault(filepath, (contenido[1:2] == b'\n', comprimido))
+                return data, signature
+            except (json.JSONDecodeError, FileNotFoundError, EOFError, gzip.BadGzipFile) as e:
+                if intento == STORE_READ_RETRIES:
+                    raise StorageError(f"No se pudo leer {filepath}: {e}") from e
+                time.sleep(espera)
+                espera *= 2
+
+    def snapshot(self, filepath, data, ops):
+        indentado, comprimido = self.formato(filepath)
+        contenido = serializar(data, indentado)
+        if comprimido:
+            contenido = gzip.compress(contenido, compresslevel=STORE_GZIP_LEVEL, mtime=0)
+        return (contenido, comprimido)
+
+    def persist(self, filepath, payload):
+        contenido, comprimido = payload
+        ensure_data_dir()
+        destino, otro = (filepath + '.gz', filepath) if comprimido else (filepath, filepath + '.gz')
+        atomic_write_bytes(destino, contenido)
+        if os.path.exists(otro):
+            os.remove(otro)  # quedó del formato anterior
+        return file_signature(destino)
+
+class SQLiteBackend:
+    """Persistencia en SQLite: un registro por fila, con índices por clave,
+    padre_id, dirección normalizada, estado/fecha_entrega y (año, mes) de gastos.
+
+    Las altas, cambios y bajas de un registro se aplican como operaciones
+    sueltas (O(log n)) en lugar de reescribir la colección completa.
+    """
+
+    name = 'sqlite'
+    row_level = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS colecciones (
+            coleccion TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            revision INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS registros (
+            coleccion TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            clave TEXT,
+            padre_id TEXT,
+            direccion_norm TEXT,
+            estado TEXT,
+            fecha_entrega TEXT,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (coleccion, pos)
+        );
+        CREATE INDEX IF NOT EXISTS idx_registros_clave ON registros (coleccion, clave);
+        CREATE INDEX IF NOT EXISTS idx_registros_padre ON registros (coleccion, padre_id);
+        CREATE INDEX IF NOT EXISTS idx_registros_direccion ON registros (coleccion, direccion_norm);
+        CREATE INDEX IF NOT EXISTS idx_registros_estado ON registros (coleccion, estado, fecha_entrega);
+        CREATE TABLE IF NOT EXISTS gastos (
+            year TEXT NOT NULL,
+            month TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (year, month)
+        );
+        CREATE TABLE IF NOT EXISTS documentos (
+            coleccion TEXT PRIMARY KEY,
+            doc TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Una conexión por proceso (no se comparte a través de un fork)
+        if self._conn is None or self._pid != os.getpid():
+            ensure_data_dir()
+            self._conn = sqlite3.connect(self.db_path, timeout=STORE_LOCK_TIMEOUT, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def signature(self, filepath):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT revision FROM colecciones WHERE coleccion = ?", (collection_name(filepath),)).fetchone()
+        return row[0] if row else None
+
+    def exists(self, filepath):
+        return self.signature(filepath) is not None
+
+    def create(self, filepath, default_value):
+        if not self.exists(filepath):
+            self.persist(filepath, self.snapshot(filepath, default_value, None))
+
+    def load(self, filepath, default_value):
+        nombre = collection_name(filepath)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT tipo, revision FROM colecciones WHERE coleccion = ?", (nombre,)).fetchone()
+            if row is None:
+                return default_value, None
+            tipo, revision = row
+            if tipo == 'lista':
+                data = [deserializar(doc) for (doc,) in conn.execute(
+                    "SELECT doc FROM registros WHERE coleccion = ? ORDER BY pos", (nombre,))]
+            elif tipo == 'gastos':
+                data = {}
+                for year, month, doc in conn.execute("SELECT year, month, doc FROM gastos ORDER BY pos"):
+                    data.setdefault(year, {})[month] = deserializar(doc)
+            else:
+                doc = conn.execute("SELECT doc FROM documentos WHERE coleccion = ?", (nombre,)).fetchone()
+                data = deserializar(doc[0]) if doc else default_value
+        return data, revision
+
+    def _row(self, filepath, item):
+        key_field = collection_key(filepath)
+        clave = item.get(key_field) if key_field else None
+        padre_id = item.get('padre_id')
+        return (
+            None if clave is None else str(clave),
+            str(padre_id) if padre_id else None,
+            normalizar_direccion(item.get('direccion')) if item.get('direccion') else None,
+            item.get('estado'),
+            item.get('fecha_entrega'),
+            serializar_texto(item),
+        )
+
+    def snapshot(self, filepath, data, ops):
+        # Se llama bajo el lock del almacén: aquí se serializa todo lo necesario
+        if ops is None or any(op == 'replace' for op, _, _, _ in ops):
+            if filepath == GASTOS_FILE:
+                filas = [(year, month, serializar_texto(items))
+                         for year, meses in data.items() for month, items in meses.items()]
+                return ('full', 'gastos', filas)
+            if isinstance(data, list):
+                return ('full', 'lista', [self._row(filepath, item) for item in data])
+            return ('full', 'documento', serializar_texto(data))
+        filas = []
+        for op, clave, valor, _ in ops:
+            if op == 'set':
+                filas.append((op, clave, serializar_texto(valor)))
+            elif op == 'delete':
+                filas.append((op, str(clave), None))
+            else:
+                filas.append((op, None if clave is None else str(clave), self._row(filepath, valor)))
+        return ('ops', None, filas)
+
+    def persist(self, filepath, payload):
+        nombre = collection_name(filepath)
+        modo, tipo, filas = payload
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if modo == 'full':
+                    self._replace(conn, nombre, tipo, filas)
+                else:
+                    self._apply_ops(conn, nombre, filas)
+                conn.execute("UPDATE colecciones SET revision = revision + 1 WHERE coleccion = ?", (nombre,))
+                revision = conn.execute("SELECT revision FROM colecciones WHERE coleccion = ?", (nombre,)).fetchone()[0]
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return revision
+
+    def _replace(self, conn, nombre, tipo, filas):
+        conn.execute("INSERT OR IGNORE INTO colecciones (coleccion, tipo) VALUES (?, ?)", (nombre, tipo))
+        conn.execute("UPDATE colecciones SET tipo = ? WHERE coleccion = ?", (tipo, nombre))
+        if tipo == 'lista':
+            conn.execute("DELETE FROM registros WHERE coleccion = ?", (nombre,))
+            conn.executemany(
+                "INSERT INTO registros (coleccion, pos, clave, padre_id, direccion_norm, estado, fecha_entrega, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(nombre, pos) + fila for pos, fila in enumerate(filas, start=1)])
+        elif tipo == 'gastos':
+            conn.execute("DELETE FROM gastos")
+            conn.executemany("INSERT INTO gastos (year, month, pos, doc) VALUES (?, ?, ?, ?)",
+                             [(year, month, pos, doc) for pos, (year, month, doc) in enumerate(filas, start=1)])
+        else:
+            conn.execute("INSERT OR REPLACE INTO documentos (coleccion, doc) VALUES (?, ?)", (nombre, filas))
+
+    def _apply_ops(self, conn, nombre, filas):
+        for op, clave, valor in filas:
+            if op == 'insert':
+                pos = conn.execute("SELECT COALESCE(MAX(pos), 0) + 1 FROM registros WHERE coleccion = ?", (nombre,)).fetchone()[0]
+                conn.execute(
+                    "INSERT INTO registros (coleccion, pos, clave, padre_id, direccion_norm, estado, fecha_entrega, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (nombre, pos) + valor)
+            elif op == 'update':
+                conn.execute(
+                    "UPDATE registros SET clave = ?, padre_id = ?, direccion_norm = ?, estado = ?, fecha_entrega = ?, doc = ? WHERE coleccion = ? AND clave = ?",
+                    valor + (nombre, clave))
+            elif op == 'delete':
+                conn.execute("DELETE FROM registros WHERE coleccion = ? AND clave = ?", (nombre, clave))
+            elif op == 'set':
+                year, month = clave
+                pos = conn.execute("SELECT COALESCE(MAX(pos), 0) + 1 FROM gastos").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO gastos (year, month, pos, doc) VALUES (?, ?, ?, ?) ON CONFLICT (year, month) DO UPDATE SET doc = excluded.doc",
+                    (year, month, pos, valor))
+
+def replay_journal(items, key_field, ops):
+    """Aplica sobre `items` (en el lugar) operaciones del diario.
+
+    Cada operación lleva el documento completo, así que re-aplicar una parte
+    del diario que ya estaba incluida en la instantánea deja el mismo estado.
+    """
+    por_clave = {item.get(key_field): item for item in items} if key_field else {}
+    for op in ops:
+        tipo, doc = op.get('op'), op.get('doc')
+        if tipo == 'replace':
+            items[:] = doc
+            por_clave = {item.get(key_field): item for item in items} if key_field else {}
+        elif tipo in ('insert', 'update'):
+            clave_nueva = doc.get(key_field) if key_field else None
+            existente = por_clave.get(op.get('key', clave_nueva)) or por_clave.get(clave_nueva)
+            if existente is None:
+                items.append(doc)
+            else:
+                por_clave.pop(existente.get(key_field), None)
+                existente.clear()
+                existente.update(doc)
+            if clave_nueva is not None:
+                por_clave[clave_nueva] = existente if existente is not None else doc
+        elif tipo == 'delete':
+            existente = por_clave.pop(op.get('key'), None)
+            if existente is not None:
+                items.remove(existente)
+
+class JournalBackend:
+    """Instantánea JSON compactada + diario de operaciones solo-anexar (JSONL).
+
+    Las altas, cambios y bajas se agregan como una línea al final de
+    datos/diario/<coleccion>.jsonl (O(1) por escritura). Al cargar se lee la
+    instantánea y se re-aplica el diario. Cuando el diario supera
+    JOURNAL_COMPACT_BYTES se reescribe la instantánea y el diario se archiva
+    con fecha, de modo que el historial de operaciones queda disponible.
+    """
+
+    name = 'journal'
+    row_level = True
+
+    def __init__(self, compact_bytes):
+        self.snapshots = JsonFileBackend()
+        self.compact_bytes = compact_bytes
+
+    def journal_path(self, filepath):
+        return os.path.join(JOURNAL_DIR, collection_name(filepath) + '.jsonl')
+
+    def signature(self, filepath):
+        journal = file_signature(self.journal_path(filepath))
+        return (self.snapshots.signature(filepath), journal[:1] + journal[2:] if journal else None)
+
+    def exists(self, filepath):
+        return self.snapshots.exists(filepath)
+
+    def create(self, filepath, default_value):
+        self.snapshots.create(filepath, default_value)
+
+    def load(self, filepath, default_value):
+        data, snapshot_sig = self.snapshots.load(filepath, default_value)
+        ops, journal_sig = self._read_journal(filepath, 0)
+        replay_journal(data, collection_key(filepath), ops)
+        return data, (snapshot_sig, journal_sig)
+
+    def refresh(self, filepath, data, signature):
+        # Otro proceso solo agregó líneas al diario: aplicamos únicamente la cola
+        snapshot_sig, journal_sig = signature or (None, None)
+        actual_snapshot, actual_journal = self.signature(filepath)
+        if actual_snapshot != snapshot_sig or not journal_sig or not actual_journal or actual_journal[0] != journal_sig[0]:
+            return None
+        ops, nueva = self._read_journal(filepath, journal_sig[1])
+        replay_journal(data, collection_key(filepath), ops)
+        return (snapshot_sig, nueva)
+
+    def needs_compaction(self, filepath):
+        journal = file_signature(self.journal_path(filepath))
+        return journal is not None and journal[2] > self.compact_bytes
+
+    def snapshot(self, filepath, data, ops):
+        if ops is None or any(op == 'replace' for op, _, _, _ in ops):
+            return ('full', self.snapshots.snapshot(filepath, data, None))
+        lineas = []
+        for op, clave, valor, ts in ops:
+            entrada = {'ts': ts, 'op': op}
+            if clave is not None:
+                entrada['key'] = clave
+            if valor is not None:
+                entrada['doc'] = valor
+            lineas.append(serializar(entrada) + b'\n')
+        return ('ops', b''.join(lineas))
+
+    def persist(self, filepath, payload):
+        modo, contenido = payload
+        journal_path = self.journal_path(filepath)
+        if modo == 'full':
+            snapshot_sig = self.snapshots.persist(filepath, contenido)
+            if os.path.exists(journal_path):
+                # La instantánea ya incluye todo el diario: se archiva
+                sello = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+                os.replace(journal_path, os.path.join(JOURNAL_DIR, f"{collection_name(filepath)}.{sello}.jsonl"))
+            return (snapshot_sig, None)
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        with open(journal_path, 'ab') as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        return self.signature(filepath)
+
+    def _read_journal(self, filepath, offset):
+        journal_path = self.journal_path(filepath)
+        try:
+            with open(journal_path, 'rb') as f:
+                ino = os.fstat(f.fileno()).st_ino
+                f.seek(offset)
+                contenido = f.read()
+        except FileNotFoundError:
+            return [], None
+        # Una última línea sin salto es una escritura interrumpida: se ignora
+        completo = contenido[:contenido.rfind(b'\n') + 1]
+        ops = []
+        for linea in completo.split(b'\n'):
+            if linea.strip():
+                ops.append(deserializar(linea))
+        return ops, (ino, offset + len(completo))
+
+class DataStore:
+    """Caché de colecciones a nivel de proceso con persistencia diferida.
+
+    Cada cambio incrementa la versión en memoria de la colección; el volcado
+    solo escribe si la versión es más nueva que la que ya está persistida, así
+    dos volcados concurrentes nunca pisan datos nuevos con una foto vieja.
+
+    Además de leer/escribir colecciones completas, las colecciones tipo lista
+    admiten altas, cambios y bajas de un registro por su clave, resueltas con
+    un índice en memoria. Los backends que lo soportan (SQLite, diario)
+    persisten solo esas operaciones. `backends` permite usar un backend
+    distinto para algunas colecciones.
+
+    Con varios procesos (STORE_MULTIPROCESS) cada petición que modifica datos
+    abre una transacción: las colecciones que lee quedan bloqueadas en
+    exclusiva, se recargan si otro proceso las cambió y se persisten antes de
+    liberar el bloqueo.
+
+    Cada cambio avanza además `revision` y queda anotado en un registro de
+    cambios acotado (ver changes_since).
+
+    Dentro de un bloque `atomic()` los cambios se persisten juntos al salir
+    (una escritura por colección) y, si el bloque falla, las colecciones
+    tocadas vuelven al estado que tenían al entrar.
+    """
+
+    def __init__(self, backend, flush_interval, multiprocess=False, default_factory=None, backends=None):
+        self.backend = backend
+        self.backends = backends or {}
+        self.flush_interval = flush_interval
+        self.multiprocess = multiprocess
+        self.default_factory = default_factory
+        self.lock = threading.RLock()
+        # Acceso de las peticiones: las lecturas van en paralelo y cada
+        # escritura espera a que terminen (ver shared/exclusive)
+        self.access = ReadWriteLock()
+        self._data = {}
+        self._version = {}
+        self._persisted = {}
+        self._signature = {}
+        self._ops = {}
+        self._indexes = {}
+        self._generation = {}
+        self._file_locks = {}
+        self._tx = threading.local()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+        self._compacting = set()
+        self._atomic = None
+        # Revisión global del proceso y registro acotado de cambios, para que
+        # los clientes pidan solo lo modificado desde su última revisión. La
+        # época distingue revisiones de distintos procesos/arranques.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.revision = 0
+        self._changes = deque(maxlen=CHANGELOG_SIZE)
+        self._changes_floor = 0
+        # Con varios procesos, además, cada colección lleva la revisión
+        # compartida (ContadorRevisiones) en que este proceso la persistió o
+        # la cargó por última vez: así un token emitido por otro worker dice
+        # qué colecciones pueden haber cambiado desde entonces.
+        self._revisiones = ContadorRevisiones(REVISION_FILE) if multiprocess else None
+        self._sellos = {}
+        self.stats = {op: LatencyStats() for op in ('load', 'read', 'write', 'flush', 'compaction', 'api_lectura', 'api_mutacion')}
+
+    def file_lock(self, filepath):
+        with self.lock:
+            if filepath not in self._file_locks:
+                self._file_locks[filepath] = CollectionLock(filepath)
+            return self._file_locks[filepath]
+
+    def read(self, filepath, default_value=None):
+        inicio = time.perf_counter()
+        with self.lock:
+            tx = self._current_tx()
+            if tx is not None and filepath not in tx:
+                self.file_lock(filepath).acquire()
+                tx.append(filepath)
+            if filepath not in self._data:
+                self._set_loaded(filepath, self._load(filepath, default_value))
+            elif self.multiprocess and not self._is_dirty(filepath) and self._backend(filepath).signature(filepath) != self._signature.get(filepath):
+                # Otro proceso modificó la colección desde que la cargamos
+                self._reload(filepath, default_value)
+            data = self._data[filepath]
+        self.stats['read'].observe(inicio)
+        return data
+
+    def write(self, filepath, data):
+        with self.lock:
+            self._savepoint(filepath)
+            self._data[filepath] = data
+            self._indexes.pop(filepath, None)
+            self._generation[filepath] = self._generation.get(filepath, 0) + 1
+            self._record(filepath, 'replace', None, None)
+
+    # --- Operaciones por registro (colecciones tipo lista) ---
+
+    def get_item(self, filepath, key):
+        with self.lock:
+            self.read(filepath)
+            return self._index(filepath).by_key.get(key)
+
+    def find_items(self, filepath, index_name, value):
+        with self.lock:
+            self.read(filepath)
+            return list(self._index(filepath).by[index_name].get(value, {}).values())
+
+    def iter_ordered(self, filepath, inicio=(), despues=False):
+        """Recorre (entrada, registro) en el orden de entrada_de_orden a partir
+        de `inicio` (o justo después, con `despues`). Se usa dentro de
+        store.shared(): mientras dura, nadie modifica la colección."""
+        with self.lock:
+            self.read(filepath)
+            index = self._index(filepath)
+            orden = index.ordenados()
+            posicion = (bisect.bisect_right if despues else bisect.bisect_left)(orden, inicio)
+        for i in range(posicion, len(orden)):
+            yield orden[i], index.por_entrada[orden[i]]
+
+    def insert_item(self, filepath, item):
+        with self.lock:
+            data = self.read(filepath)
+            self._savepoint(filepath)
+            data.append(item)
+            if filepath in self._indexes:
+                self._indexes[filepath].add(item)
+            self._record(filepath, 'insert', None, item)
+            return item
+
+    def update_item(self, filepath, key, changes, preserve_key=False, remove=()):
+        """Combina `changes` sobre el registro con clave `key` (y le quita los
+        campos de `remove`); devuelve el registro actualizado, o None si no existe."""
+        with self.lock:
+            data = self.read(filepath)
+            index = self._index(filepath)
+            item = index.by_key.get(key)
+            if item is None:
+                return None
+            self._savepoint(filepath, item)
+            antes = index.values_of(item)
+            item.update(changes)
+            for campo in remove:
+                item.pop(campo, None)
+            if preserve_key:
+                item[index.key_field] = key
+            index.move(item, antes)
+            self._record(filepath, 'update', key, item)
+            return item
+
+    def touch_item(self, filepath, key):
+        """Marca el registro `key` como modificado sin cambiar sus campos, para
+        los que dependen de otra colección (el precio vigente sale del
+        historial): la sincronización incremental y los demás workers lo ven
+        como una actualización. Devuelve el registro, o None si no existe."""
+        with self.lock:
+            self.read(filepath)
+            item = self._index(filepath).by_key.get(key)
+            if item is None:
+                return None
+            self._savepoint(filepath)
+            self._record(filepath, 'update', key, item)
+            return item
+
+    def savepoint(self, filepath, *items):
+        """Dentro de atomic(), antes de modificar en el lugar objetos de la
+        colección que no pasan por update_item: si el bloque falla, la
+        colección y esos objetos vuelven a como estaban en este momento."""
+        with self.lock:
+            self.read(filepath)
+            self._savepoint(filepath)
+            for item in items:
+                self._savepoint(filepath, item)
+
+    def delete_items(self, filepath, keys):
+        """Elimina los registros cuyas claves estén en `keys`; devuelve cuántos."""
+        keys = set(keys)
+        with self.lock:
+            data = self.read(filepath)
+            index = self._index(filepath)
+            eliminados = [index.by_key[k] for k in keys if k in index.by_key]
+            if not eliminados:
+                return 0
+            self._savepoint(filepath)
+            if len(eliminados) == 1:
+                data.remove(eliminados[0])
+            else:
+                ids = {id(item) for item in eliminados}
+                data[:] = [item for item in data if id(item) not in ids]
+            for item in eliminados:
+                index.remove(item)
+                self._record(filepath, 'delete', item.get(index.key_field), None)
+            return len(eliminados)
+
+    def set_entry(self, filepath, path, value):
+        """Asigna data[path[0]][path[1]] en una colección tipo diccionario
+        (gastos: año → mes → conceptos)."""
+        with self.lock:
+            data = self.read(filepath)
+            self._savepoint(filepath)
+            year, month = path
+            data.setdefault(year, {})[month] = value
+            self._record(filepath, 'set', (year, month), value)
+
+    @contextmanager
+    def atomic(self):
+        """Agrupa varios cambios en una unidad: todos o ninguno.
+
+        Se persisten al salir del bloque, una sola vez por colección (dentro de
+        una transacción multiproceso, al cerrarla). Si el bloque lanza una
+        excepción, las colecciones modificadas se restauran y la excepción
+        sigue su curso. Un bloque anidado forma parte del exterior.
+        """
+        with self.lock:
+            if self._atomic is not None:
+                yield
+                return
+            self._atomic = {}
+            try:
+                yield
+            except BaseException:
+                puntos, self._atomic = self._atomic, None
+                self._rollback(puntos)
+                raise
+            puntos, self._atomic = self._atomic, None
+            if puntos and self._current_tx() is None:
+                if self.flush_interval <= 0 or self.multiprocess:
+                    self.flush(list(puntos))
+                else:
+                    self._ensure_flusher()
+
+    def version(self, filepath):
+        """Avanza con cada cambio de la colección en este proceso."""
+        with self.lock:
+            return self._version.get(filepath, 0)
+
+    def generation(self, filepath):
+        """Cambia cada vez que la colección se reemplaza entera (escritura
+        completa o recarga): sirve para invalidar cachés derivadas."""
+        with self.lock:
+            return self._generation.get(filepath, 0)
+
+    # --- Revisiones y cambios ---
+
+    def revision_token(self):
+        """"<época>.<revisión>" de este proceso; con varios procesos le sigue
+        "_<época>.<revisión>" compartida, que vale en cualquier worker. Hay
+        que pedirlo antes de leer los datos que acompaña."""
+        token = f"{self.epoch}.{self.revision}"
+        if self._revisiones is not None:
+            token += "_%s.%d" % self._revisiones.leer()
+        return token
+
+    def parse_revision_token(self, token):
+        """Devuelve la revisión de `token` si pertenece a este proceso, o None."""
+        epoch, _, rev = str(token or '').partition('_')[0].partition('.')
+        if epoch != self.epoch or not rev.isdigit() or int(rev) > self.revision:
+            return None
+        return int(rev)
+
+    def changes_since_token(self, token, paths):
+        """changes_since a partir de un token de revision_token().
+
+        Un token de este proceso da el detalle del registro de cambios. Uno de
+        otro worker solo permite saber qué colecciones persistió o recargó este
+        proceso después de emitido, y esas vienen como completas. None si el
+        token no sirve (otra época, otro arranque o demasiado viejo).
+        """
+        since = self.parse_revision_token(token)
+        if since is not None:
+            return self.changes_since(since, paths)
+        if self._revisiones is None:
+            return None
+        epoch, _, rev = str(token or '').partition('_')[2].partition('.')
+        actual_epoch, actual = self._revisiones.leer()
+        if epoch != actual_epoch or not rev.isdigit() or int(rev) > actual:
+            return None
+        with self.lock:
+            return {fp: {'completa': True, 'upserts': set(), 'eliminados': set(), 'entradas': set()}
+                    for fp in paths if self._sellos.get(fp, actual + 1) > int(rev)}
+
+    def changes_since(self, since, paths):
+        """Resume los cambios posteriores a la revisión `since` en `paths`.
+
+        Devuelve {filepath: {'completa': bool, 'upserts': set, 'eliminados':
+        set, 'entradas': set}} solo con las colecciones que cambiaron, o None
+        si el registro de cambios ya no alcanza tan atrás.
+        """
+        with self.lock:
+            if since < self._changes_floor:
+                return None
+            cambios = {}
+            for rev, filepath, tipo, key in reversed(self._changes):
+                if rev <= since:
+                    break
+                if filepath not in paths:
+                    continue
+                c = cambios.setdefault(filepath, {'completa': False, 'upserts': set(), 'eliminados': set(), 'entradas': set()})
+                if tipo == 'replace':
+                    c['completa'] = True
+                elif tipo == 'set':
+                    c['entradas'].add(key)
+                elif tipo == 'delete':
+                    c['eliminados'].add(key)
+                else:
+                    c['upserts'].add(key)
+            return cambios
+
+    def _log_change(self, filepath, tipo, key=None):
+        self.revision += 1
+        if len(self._changes) == self._changes.maxlen:
+            self._changes_floor = self._changes[0][0]
+        self._changes.append((self.revision, filepath, tipo, key))
+
+    @contextmanager
+    def shared(self):
+        """Lectura consistente: mientras dure, nadie modifica el almacén, pero
+        otras lecturas pueden correr a la vez. Los objetos leídos no deben
+        modificarse."""
+        self.access.acquire_read()
+        try:
+            yield
+        finally:
+            self.access.release_read()
+
+    @contextmanager
+    def exclusive(self):
+        """Unidad de cambios: espera a que terminen las lecturas en curso, toma
+        el almacén y (con varios workers) abre una transacción entre procesos
+        que se persiste al salir."""
+        self.access.acquire_write()
+        try:
+            with self.lock:
+                propia = self._current_tx() is None  # anidada: es parte de la exterior
+                if propia:
+                    self.begin()
+                try:
+                    yield
+                finally:
+                    if propia:
+                        self.end()
+        finally:
+            self.access.release_write()
+
+    def begin(self):
+        if self.multiprocess:
+            self._tx.paths = []
+
+    def end(self):
+        paths = getattr(self._tx, 'paths', None)
+        if paths is None:
+            return
+        self._tx.paths = None
+        try:
+            self.flush(paths)
+        finally:
+            for filepath in reversed(paths):
+                self._file_locks[filepath].release()
+
+    def flush(self, paths=None):
+        inicio = time.perf_counter()
+        with self.lock:
+            candidatos = [fp for fp in (self._data if paths is None else paths) if self._is_dirty(fp)]
+        if not candidatos:
+            return
+        for filepath in candidatos:
+            try:
+                self._flush_one(filepath)
+            except (OSError, StorageError, sqlite3.Error) as e:
+                print(f"❌ Error al guardar {filepath}: {e}")
+                with self.lock:
+                    # Las operaciones sueltas se perdieron: la próxima vez se
+                    # persiste la colección completa
+                    self._ops[filepath] = [('replace', None, None, None)]
+                continue
+            backend = self._backend(filepath)
+            if hasattr(backend, 'needs_compaction') and backend.needs_compaction(filepath):
+                self._schedule_compaction(filepath)
+        self.stats['flush'].observe(inicio)
+
+    def compact(self, filepath):
+        """Persiste la colección completa (en el diario: nueva instantánea)."""
+        inicio = time.perf_counter()
+        try:
+            self._flush_one(filepath, full=True)
+        except (OSError, StorageError, sqlite3.Error) as e:
+            print(f"❌ Error al compactar {filepath}: {e}")
+        finally:
+            with self.lock:
+                self._compacting.discard(filepath)
+        self.stats['compaction'].observe(inicio)
+
+    def _flush_one(self, filepath, full=False):
+        # Orden de bloqueos: primero el del almacén y después el de la
+        # colección (igual que una petición). La foto se serializa con ambos
+        # tomados y se persiste ya liberado el del almacén; el de la colección
+        # garantiza que las operaciones llegan al backend en orden.
+        backend = self._backend(filepath)
+        file_lock = self.file_lock(filepath)
+        with self.lock:
+            file_lock.acquire()
+            try:
+                if not full and not self._is_dirty(filepath):
+                    file_lock.release()
+                    return
+                if full and self.multiprocess and not self._is_dirty(filepath) \
+                        and backend.signature(filepath) != self._signature.get(filepath):
+                    # Otro proceso agregó cambios desde nuestra última lectura:
+                    # la foto completa tiene que incluirlos
+                    self._reload(filepath, None)
+                version = self._version[filepath]
+                ops = self._ops.pop(filepath, None)
+                if full or not backend.row_level:
+                    ops = None
+                payload = backend.snapshot(filepath, self._data[filepath], ops)
+            except BaseException:
+                file_lock.release()
+                raise
+        try:
+            self._signature[filepath] = backend.persist(filepath, payload)
+            self._persisted[filepath] = version
+            self._sellar(filepath)
+        finally:
+            file_lock.release()
+        metrics.inc('store_writes_total', collection=collection_name(filepath))
+        metrics.inc('store_serialized_bytes_total', tamano_serializado(payload), collection=collection_name(filepath))
+
+    def _schedule_compaction(self, filepath):
+        with self.lock:
+            if filepath in self._compacting:
+                return
+            self._compacting.add(filepath)
+        threading.Thread(target=self.compact, args=(filepath,), name='datastore-compaction', daemon=True).start()
+
+    def dirty_collections(self):
+        with self.lock:
+            return sorted(fp for fp in self._data if self._is_dirty(fp))
+
+    def loaded_collections(self):
+        with self.lock:
+            return sorted(self._data)
+
+    def _record(self, filepath, op, key, value):
+        inicio = time.perf_counter()
+        self._version[filepath] = self._version.get(filepath, 0) + 1
+        metrics.inc('store_mutations_total', collection=collection_name(filepath), op=op)
+        key_field = collection_key(filepath)
+        if op in ('insert', 'update') and key_field and value.get(key_field) is not None:
+            if op == 'update' and key != value.get(key_field):
+                self._log_change(filepath, 'delete', key)
+            self._log_change(filepath, 'upsert', value.get(key_field))
+        elif op == 'delete' or op == 'set':
+            self._log_change(filepath, op, key)
+        else:
+            self._log_change(filepath, 'replace')
+        if self._backend(filepath).row_level:
+            # Copia del registro tal como quedó en este momento (el diario
+            # funciona también como historial de cambios)
+            if isinstance(value, dict):
+                value = dict(value)
+            self._ops.setdefault(filepath, []).append((op, key, value, datetime.datetime.now().isoformat()))
+        self.stats['write'].observe(inicio)
+        if self._current_tx() is not None or self._atomic is not None:
+            return  # se persiste al cerrar la transacción o el bloque atomic()
+        if self.flush_interval <= 0 or self.multiprocess:
+            self.flush([filepath])
+        else:
+            self._ensure_flusher()
+
+    def _savepoint(self, filepath, item=None):
+        # Dentro de atomic(): guarda cómo estaba la colección antes de su
+        # primer cambio (y cada registro antes de modificarlo en el lugar)
+        if self._atomic is None:
+            return
+        punto = self._atomic.get(filepath)
+        if punto is None:
+            data = self._data.get(filepath)
+            if isinstance(data, list):
+                contenido = list(data)
+            elif isinstance(data, dict):
+                contenido = {k: dict(v) if isinstance(v, dict) else v for k, v in data.items()}
+            else:
+                contenido = data
+            punto = self._atomic[filepath] = {
+                'data': data,
+                'contenido': contenido,
+                'registros': {},
+                'ops': len(self._ops.get(filepath, [])),
+                'version': self._version.get(filepath, 0),
+            }
+        if item is not None and id(item) not in punto['registros']:
+            punto['registros'][id(item)] = (item, dict(item))
+
+    def _rollback(self, puntos):
+        for filepath, punto in puntos.items():
+            data = punto['data']
+            if isinstance(data, list):
+                data[:] = punto['contenido']
+            elif isinstance(data, dict):
+                data.clear()
+                data.update(punto['contenido'])
+            for item, antes in punto['registros'].values():
+                item.clear()
+                item.update(antes)
+            if data is None:
+                self._data.pop(filepath, None)  # no estaba cargada
+            else:
+                self._data[filepath] = data
+            self._indexes.pop(filepath, None)
+            self._generation[filepath] = self._generation.get(filepath, 0) + 1
+            ops = self._ops.get(filepath)
+            if ops is not None:
+                del ops[punto['ops']:]
+                if not ops:
+                    self._ops.pop(filepath)
+            self._version[filepath] = punto['version']
+            self._log_change(filepath, 'replace')
+
+    def _index(self, filepath):
+        index = self._indexes.get(filepath)
+        if index is None:
+            index = CollectionIndex(self._data[filepath], collection_key(filepath), COLLECTION_INDEXES.get(filepath, {}),
+                                    orden=functools.partial(entrada_de_orden, filepath))
+            self._indexes[filepath] = index
+        return index
+
+    def _backend(self, filepath):
+        return self.backends.get(filepath, self.backend)
+
+    def _current_tx(self):
+        return getattr(self._tx, 'paths', None)
+
+    def _sellar(self, filepath):
+        # Después de persistir o cargar: cualquier token leído antes de este
+        # momento puede no incluir el estado actual de la colección
+        if self._revisiones is not None:
+            self._sellos[filepath] = self._revisiones.avanzar()[1]
+
+    def _is_dirty(self, filepath):
+        return self._version.get(filepath, 0) > self._persisted.get(filepath, 0)
+
+    def _set_loaded(self, filepath, loaded):
+        data, signature = loaded
+        if filepath in self._data:
+            self._log_change(filepath, 'replace')  # recarga: cambió desde otro proceso
+        self._sellar(filepath)
+        self._data[filepath] = data
+        self._signature[filepath] = signature
+        self._indexes.pop(filepath, None)
+        self._generation[filepath] = self._generation.get(filepath, 0) + 1
+        self._ops.pop(filepath, None)
+        self._version[filepath] = self._version.get(filepath, 0) + 1
+        self._persisted[filepath] = self._version[filepath]
+
+    def ensure(self, filepath, default_value=None):
+        """Crea la colección con su valor por defecto si no existe, sin leerla
+        (solo un stat en los archivos JSON). `default_value` puede ser una
+        función: se llama solo si hay que crearla."""
+        backend = self._backend(filepath)
+        if not backend.exists(filepath):
+            if callable(default_value):
+                default_value = default_value()
+            if default_value is None and self.default_factory is not None:
+                default_value = self.default_factory(filepath)
+            with self.file_lock(filepath):
+                backend.create(filepath, default_value)
+
+    def _load(self, filepath, default_value):
+        inicio = time.perf_counter()
+        backend = self._backend(filepath)
+        if default_value is None and self.default_factory is not None:
+            default_value = self.default_factory(filepath)
+        self.ensure(filepath, default_value)
+        loaded = backend.load(filepath, default_value)
+        metrics.inc('store_loads_total', collection=collection_name(filepath))
+        self.stats['load'].observe(inicio)
+        return loaded
+
+    def _reload(self, filepath, default_value):
+        backend = self._backend(filepath)
+        if hasattr(backend, 'refresh'):
+            # La cola se aplica sobre una copia: puede haber lecturas en curso
+            # recorriendo los registros actuales
+            data = [dict(item) for item in self._data[filepath]]
+            signature = backend.refresh(filepath, data, self._signature.get(filepath))
+            if signature is not None:
+                self._set_loaded(filepath, (data, signature))
+                return
+        self._set_loaded(filepath, self._load(filepath, default_value))
+
+    def _ensure_flusher(self):
+        # El hilo no sobrevive a un fork (gunicorn --preload), así que se
+        # arranca de forma perezosa en cada proceso.
+        if self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name='datastore-flusher', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            if self.dirty_collections():
+                self.flush()
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+def default_for(filepath):
+    if filepath == GASTOS_FILE:
+        return {}
+    elif filepath == COSTOS_FILE:
+        return {"ingredientes": [], "hamburguesas": []}
+    elif filepath == RAPPI_BANCO_FILE:
+        return {"rappi": 0, "banco": 0}
+    return []
+
+def make_backend(name):
+    if name == 'sqlite':
+        return SQLiteBackend(SQLITE_FILE)
+    return JsonFileBackend()
+
+def make_backend_overrides(name):
+    # Con archivos JSON, pedidos e ingresos (que solo crecen) usan el diario
+    if name == 'sqlite' or not STORE_JOURNAL:
+        return {}
+    journal = JournalBackend(JOURNAL_COMPACT_BYTES)
+    return {filepath: journal for filepath in JOURNALED_FILES}
+
+store = DataStore(make_backend(STORE_BACKEND), STORE_FLUSH_INTERVAL, multiprocess=STORE_MULTIPROCESS,
+                  default_factory=default_for, backends=make_backend_overrides(STORE_BACKEND))
+atexit.register(store.shutdown)
+
 # Función auxiliar para leer datos de un archivo JSON
 def read_data(filepath, default_value=None):
     if default_value is None:
-        if filepath == GASTOS_FILE:
-            default_value = {}
-        elif filepath == COSTOS_FILE:
-            default_value = {"ingredientes": [], "hamburguesas": []}
-        elif filepath == STOCK_FILE:
-            default_value = []
-        else:
-            default_value = []
-
-    ensure_data_dir()
-    if not os.path.exists(filepath):
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(default_value, f, indent=4, ensure_ascii=False)
-        return default_value
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return default_value
+        default_value = default_for(filepath)
+    return store.read(filepath, default_value)
 
 # Función auxiliar para escribir datos en un archivo JSON
 def write_data(filepath, data):
-    ensure_data_dir()
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    store.write(filepath, data)
+
+def responder(resultado):
+    """Respuesta HTTP para el (cuerpo, status) de una operación."""
+    cuerpo, status = resultado
+    return jsonify(cuerpo), status
+
+# --- Consultas paginadas sobre colecciones tipo lista ---
+# Sin parámetros las rutas GET devuelven la colección completa, como siempre.
+# Con parámetros admiten:
+#   limit=N, after=<cursor> paginación por cursor, en orden de fecha y clave
+#                           (COLLECTION_ORDERS); el siguiente cursor viaja en
+#                           la cabecera X-Next-Cursor; si no está, no hay más
+#   desde=AAAA-MM-DD, hasta=AAAA-MM-DD   rango sobre la fecha de la colección
+#   estado=, tipo=, padre_id=            filtros por igualdad
+#   fields=a,b,c            devuelve solo esos campos de cada registro
+# Sin limit ni after la respuesta trae todos los que coinciden, en el orden
+# de la colección.
+QUERY_PARAMS = ('limit', 'after', 'desde', 'hasta', 'estado', 'tipo', 'padre_id', 'fields')
+QUERY_FILTERS = ('estado', 'tipo', 'padre_id')
+MAX_PAGE_LIMIT = 1000
+
+def cursor_de(entrada):
+    return base64.urlsafe_b64encode(serializar(list(entrada))).decode('ascii')
+
+def entrada_del_cursor(filepath, after):
+    """Entrada de orden que codifica el cursor `after`. También acepta la clave
+    de un registro (los cursores de antes); None si no es ninguna de las dos."""
+    try:
+        fecha, clave = deserializar(base64.urlsafe_b64decode(after))
+        return (str(fecha), str(clave))
+    except (ValueError, TypeError, binascii.Error):
+        item = store.get_item(filepath, after)
+        return entrada_de_orden(filepath, item) if item is not None else None
+
+def query_collection(filepath):
+    args = request.args
+    vista = COLLECTION_VIEWS.get(filepath, lambda item: item)
+    if not any(p in args for p in QUERY_PARAMS):
+        items = read_data(filepath)
+        return jsonify([vista(item) for item in items] if filepath in COLLECTION_VIEWS else items), 200
+
+    paginada = 'limit' in args or 'after' in args
+    try:
+        limit = int(args.get('limit', MAX_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'limit' debe ser un número."}), 400
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+
+    filtros = {campo: args[campo] for campo in QUERY_FILTERS if campo in args}
+    date_field = COLLECTION_ORDERS.get(filepath)
+    desde, hasta = args.get('desde'), args.get('hasta')
+    por_fecha = bool(date_field and (desde or hasta))
+    fields = [f for f in args.get('fields', '').split(',') if f]
+
+    # Un rango de fechas puede llegar a meses que ya están en el archivo
+    archivados = []
+    if por_fecha and filepath in ARCHIVE_COLLECTIONS:
+        archivados = archivo_mensual.registros_rango(filepath, desde and desde[:7], hasta and hasta[:7])
+
+    if not paginada:
+        candidatos = ((None, item) for item in itertools.chain(archivados, read_data(filepath)))
+    else:
+        after = args.get('after')
+        if after:
+            inicio = entrada_del_cursor(filepath, after)
+            if inicio is None:
+                return jsonify({"error": "Cursor 'after' inválido."}), 400
+        else:
+            inicio = (desde,) if date_field and desde else ()
+        # La página arranca con bisect sobre el índice ordenado del almacén
+        candidatos = store.iter_ordered(filepath, inicio, despues=bool(after))
+        if archivados:
+            previos = sorted(((entrada_de_orden(filepath, item), item) for item in archivados), key=lambda e: e[0])
+            previos = [e for e in previos if (e[0] > inicio if after else e[0] >= inicio)]
+            candidatos = heapq.merge(previos, candidatos, key=lambda e: e[0])
+
+    pagina = []
+    ultima = siguiente = None
+    for entrada, item in candidatos:
+        if any(str(item.get(campo) or '') != valor for campo, valor in filtros.items()):
+            continue
+        if por_fecha:
+            fecha = str(item.get(date_field) or '')[:10]
+            if paginada and hasta and fecha > hasta:
+                break  # en orden de fecha: ya no quedan registros del rango
+            if not fecha or (desde and fecha < desde) or (hasta and fecha > hasta):
+                continue
+        if paginada and len(pagina) == limit:
+            siguiente = ultima
+            break
+        visto = vista(item)
+        pagina.append({k: visto[k] for k in fields if k in visto} if fields else visto)
+        ultima = entrada
+
+    response = jsonify(pagina)
+    if siguiente is not None:
+        response.headers['X-Next-Cursor'] = cursor_de(siguiente)
+    return response, 200
+
+# --- Jerarquías (stock, precios, vencimientos) ---
+# Los registros se cuelgan unos de otros por 'padre_id'. El almacén mantiene
+# un índice padre → hijos, así que recorrer una rama cuesta lo que mide la
+# rama y no lo que mide la colección.
+def subarbol(filepath, item_id):
+    """El registro `item_id` y todos sus descendientes, en preorden."""
+    raiz = store.get_item(filepath, item_id)
+    if raiz is None:
+        return []
+    resultado, vistos, pendientes = [], set(), [raiz]
+    while pendientes:
+        item = pendientes.pop()
+        if id(item) in vistos:
+            continue
+        vistos.add(id(item))
+        resultado.append(item)
+        if item.get('id') is not None:
+            pendientes.extend(reversed(store.find_items(filepath, 'padre_id', item['id'])))
+    return resultado
+
+def armar_arbol(items):
+    """Copia anidada de `items`: cada nodo lleva sus hijos en 'children'.
+    Un registro cuyo padre no está en `items` queda como raíz."""
+    nodos = [dict(item, children=[]) for item in items]
+    por_id = {}
+    for nodo in nodos:
+        if nodo.get('id') is not None:
+            por_id.setdefault(nodo['id'], nodo)
+    hijos, raices = {}, []
+    for nodo in nodos:
+        padre = por_id.get(nodo.get('padre_id') or None)
+        if padre is not None and padre is not nodo:
+            hijos.setdefault(id(padre), []).append(nodo)
+        else:
+            raices.append(nodo)
+    # Sin recursión; un ciclo de padres se corta en el primer nodo que aparece
+    colgados = set()
+    def colgar(raiz):
+        colgados.add(id(raiz))
+        pendientes = [raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            for hijo in hijos.get(id(nodo), []):
+                if id(hijo) not in colgados:
+                    colgados.add(id(hijo))
+                    nodo['children'].append(hijo)
+                    pendientes.append(hijo)
+    for raiz in raices:
+        colgar(raiz)
+    for nodo in nodos:
+        if id(nodo) not in colgados:
+            raices.append(nodo)
+            colgar(nodo)
+    return raices
+
+def get_arbol(filepath, item_id=None, error=None):
+    vista = COLLECTION_VIEWS.get(filepath, lambda item: item)
+    items = read_data(filepath) if item_id is None else subarbol(filepath, item_id)
+    if item_id is not None and not items:
+        return jsonify({"error": error}), 404
+    arbol = armar_arbol([vista(item) for item in items])
+    return jsonify(arbol if item_id is None else arbol[0]), 200
 
-# Inicializa los archivos de datos si no existen
+def borrar_subarbol(filepath, item_id):
+    """Elimina el registro y sus descendientes; devuelve cuántos, 0 si no existe."""
+    return store.delete_items(filepath, [item.get('id') for item in subarbol(filepath, item_id)])
+
+def mover_item(filepath, item_id, error):
+    """Cuelga el registro (con toda su rama) de otro padre. Body: {"padre_id": id | null}."""
+    datos = request.json or {}
+    if 'padre_id' not in datos:
+        return jsonify({"error": "Falta padre_id."}), 400
+    if store.get_item(filepath, item_id) is None:
+        return jsonify({"error": error}), 404
+    nuevo_padre = datos['padre_id'] or ''
+    if nuevo_padre:
+        if store.get_item(filepath, nuevo_padre) is None:
+            return jsonify({"error": "El nuevo padre no existe."}), 400
+        if any(item.get('id') == nuevo_padre for item in subarbol(filepath, item_id)):
+            return jsonify({"error": "No se puede mover un ítem dentro de sí mismo o de uno de sus hijos."}), 400
+    item = store.update_item(filepath, item_id, {'padre_id': nuevo_padre})
+    return jsonify(item), 200
+
+# Inicializa los archivos de datos si no existen (sin leerlos: la carga en
+# memoria la hace el precalentamiento, ver "Arranque")
 def initialize_data():
-    read_data(USERS_FILE, default_value=[{"usuario": "admin", "contrasena": "admin", "rol": "admin", "frase_bienvenida": "¡Bienvenido, Admin!"}])
-    read_data(INGRESOS_FILE)
-    read_data(GASTOS_FILE)
-    read_data(PRECIOS_FILE)
-    read_data(COSTOS_FILE)
-    read_data(STOCK_FILE)
-    read_data(PEDIDOS_FILE)
-    read_data(CLIENTES_FILE)
-    read_data(VENCIMIENTOS_FILE)
-    read_data(PROVEEDORES_FILE)
+    ensure_data_dir()
+    # El hash de la contraseña inicial se calcula solo si hay que crear users.json
+    store.ensure(USERS_FILE, lambda: [{"usuario": "admin", "contrasena_hash": generate_password_hash("admin"),
+                                       "rol": "admin", "frase_bienvenida": "¡Bienvenido, Admin!"}])
+    for filepath in DATA_FILES:
+        store.ensure(filepath)
+
+@app.cli.command('migrar-sqlite')
+def migrar_sqlite_command():
+    """Importa los archivos datos/*.json a la base SQLite (STORE_SQLITE_PATH)."""
+    origenes = make_backend_overrides('json')
+    destino = SQLiteBackend(SQLITE_FILE)
+    for filepath in DATA_FILES:
+        origen = origenes.get(filepath, JsonFileBackend())
+        if not origen.exists(filepath):
+            continue
+        data, _ = origen.load(filepath, default_for(filepath))
+        destino.persist(filepath, destino.snapshot(filepath, data, None))
+        print(f"✅ {collection_name(filepath)}: {len(data)} registros importados")
+    print(f"Migración completada en {SQLITE_FILE}. Inicie el servidor con STORE_BACKEND=sqlite.")
+
+@app.cli.command('convertir-datos')
+@click.option('--formato', type=click.Choice(['compacto', 'indentado']), default='compacto',
+              help='Formato JSON de los archivos.')
+@click.option('--gzip', 'comprimidas', default='gastos,pedidos',
+              help='Colecciones a guardar comprimidas, separadas por comas ("" = ninguna).')
+def convertir_datos_command(formato, comprimidas):
+    """Reescribe los archivos de datos/ en el formato indicado."""
+    if STORE_BACKEND != 'json':
+        print("❌ convertir-datos solo aplica a los archivos JSON (STORE_BACKEND=json).")
+        return
+    comprimidas = {nombre.strip() for nombre in comprimidas.split(',') if nombre.strip()}
+    with store.lock:
+        store.begin()
+        try:
+            for filepath in DATA_FILES:
+                backend = store.backends.get(filepath, store.backend)
+                archivos = getattr(backend, 'snapshots', backend)  # diario: su instantánea
+                antes = file_signature(archivos.archivo(filepath)) if archivos.exists(filepath) else None
+                read_data(filepath)
+                archivos.set_formato(filepath, formato == 'indentado', collection_name(filepath) in comprimidas)
+                # Instantánea completa (en el diario, además, archiva las líneas ya incluidas)
+                store.compact(filepath)
+                despues = file_signature(archivos.archivo(filepath))
+                print(f"✅ {os.path.basename(archivos.archivo(filepath))}: {antes[2] if antes else 0} → {despues[2]} bytes")
+        finally:
+            store.end()
+
+# --- Métricas de peticiones ---
+# Se registran antes que el bloqueo del almacén, así la duración incluye la
+# espera del lock. Con depuración activa (o METRICS_PROFILING=1) una petición
+# con el encabezado "X-Profile: 1" se perfila con cProfile; el volcado queda
+# en datos/perfiles y su ruta vuelve en el encabezado X-Profile-File.
+METRICS_PROFILING = os.environ.get('METRICS_PROFILING') == '1'
+PROFILES_DIR = os.path.join(DATA_DIR, 'perfiles')
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_inicio = time.perf_counter()
+    if request.headers.get('X-Profile') and (app.debug or METRICS_PROFILING):
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            return  # ya hay otra petición perfilándose
+        g.perfil = perfil
+
+@app.after_request
+def record_request_metrics(response):
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil.disable()
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        sello = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        destino = os.path.join(PROFILES_DIR, f"{sello}-{request.endpoint}.prof")
+        perfil.dump_stats(destino)
+        response.headers['X-Profile-File'] = destino
+    inicio = g.pop('metrics_inicio', None)
+    if inicio is None:
+        return response
+    # La plantilla de la ruta y no la URL, para no abrir una serie por id
+    ruta = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+    metrics.inc('http_requests_total', method=request.method, route=ruta, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - inicio, method=request.method, route=ruta)
+    metrics.observe('http_request_size_bytes', request.content_length or 0, method=request.method, route=ruta)
+    if not response.is_streamed and response.content_length is not None:
+        metrics.observe('http_response_size_bytes', response.content_length, method=request.method, route=ruta)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    metrics.set('store_dirty_collections', len(store.dirty_collections()))
+    metrics.set('events_subscribers', event_bus.subscribers)
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Compresión y caché HTTP ---
+# Las respuestas se comprimen según Accept-Encoding (brotli si está instalado,
+# si no gzip). Los archivos estáticos se comprimen una sola vez por contenido
+# y quedan en memoria; la página se revalida siempre (ETag + 304) y las
+# imágenes se cachean por IMAGES_MAX_AGE. Las respuestas GET de la API llevan
+# un ETag fuerte con el hash del cuerpo: si el cliente ya lo tiene, 304.
+# Los ETag que pone la propia ruta (revisiones de /api/data) no se tocan.
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/javascript', 'image/svg+xml'}
+IMAGES_MAX_AGE = int(os.environ.get('IMAGES_MAX_AGE', 30 * 24 * 3600))
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp'}
+
+def es_comprimible(mimetype):
+    return mimetype is not None and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES) and mimetype != 'text/event-stream'
+
+def comprimir(data, codificacion, maximo=False):
+    if codificacion == 'br':
+        return brotli.compress(data, quality=11 if maximo else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if maximo else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+def codificaciones_disponibles():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def elegir_codificacion(disponibles):
+    """La codificación que acepta el cliente entre `disponibles`, o None."""
+    for codificacion in disponibles:
+        if request.accept_encodings[codificacion] > 0:
+            return codificacion
+    return None
+
+def etag_coincide(etag):
+    """If-None-Match incluye `etag` (en cualquiera de sus codificaciones)."""
+    pedidos = request.if_none_match
+    if pedidos.star_tag:
+        return True
+    return any(e == etag or e.rsplit('-', 1)[0] == etag for e in pedidos.as_set())
+
+def no_modificado(etag, cache_control):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+class StaticAsset:
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.variantes = {}  # codificación → bytes
+
+class StaticAssets:
+    """Archivos estáticos en memoria con sus versiones comprimidas.
+
+    Se vuelven a leer si cambia el archivo en disco; la compresión (al máximo
+    nivel) se hace una vez por contenido distinto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_ruta = {}  # ruta → (firma, StaticAsset)
+        self._por_hash = {}  # etag → StaticAsset
+
+    def get(self, ruta):
+        firma = file_signature(ruta)
+        if firma is None:
+            return None
+        with self._lock:
+            cacheado = self._por_ruta.get(ruta)
+            if cacheado is not None and cacheado[0] == firma:
+                return cacheado[1]
+        with open(ruta, 'rb') as f:
+            data = f.read()
+        asset = StaticAsset(data, mimetypes.guess_type(ruta)[0] or 'application/octet-stream')
+        with self._lock:
+            asset = self._por_hash.setdefault(asset.etag, asset)
+        if es_comprimible(asset.mimetype) and not asset.variantes:
+            for codificacion in codificaciones_disponibles():
+                comprimido = comprimir(data, codificacion, maximo=True)
+                if len(comprimido) < len(data):
+                    asset.variantes[codificacion] = comprimido
+        with self._lock:
+            self._por_ruta[ruta] = (firma, asset)
+        return asset
+
+    def precargar(self, carpeta):
+        for nombre in sorted(os.listdir(carpeta)):
+            ruta = os.path.join(carpeta, nombre)
+            if os.path.isfile(ruta):
+                self.get(ruta)
+
+static_assets = StaticAssets()
+
+def servir_estatico(ruta, max_age):
+    asset = static_assets.get(ruta)
+    if asset is None:
+        return jsonify({"error": "Archivo no encontrado"}), 404
+    cache_control = f'public, max-age={max_age}' if max_age else 'no-cache'
+    if etag_coincide(asset.etag):
+        return no_modificado(asset.etag, cache_control)
+    codificacion = elegir_codificacion([c for c in codificaciones_disponibles() if c in asset.variantes])
+    response = app.response_class(asset.variantes[codificacion] if codificacion else asset.data, mimetype=asset.mimetype)
+    response.set_etag(f'{asset.etag}-{codificacion}' if codificacion else asset.etag)
+    response.headers['Cache-Control'] = cache_control
+    if asset.variantes:
+        response.vary.add('Accept-Encoding')
+    if codificacion:
+        response.headers['Content-Encoding'] = codificacion
+    return response
+
+@app.route('/<archivo>')
+def serve_imagen(archivo):
+    # Imágenes de static/ y los íconos de datos/ (nunca sus .json)
+    if os.path.splitext(archivo)[1].lower() in IMAGE_EXTENSIONS:
+        for carpeta in (app.static_folder, DATA_DIR):
+            ruta = os.path.join(carpeta, archivo)
+            if os.path.isfile(ruta):
+                return servir_estatico(ruta, IMAGES_MAX_AGE)
+    return jsonify({"error": "Archivo no encontrado"}), 404
+
+@app.after_request
+def compress_response(response):
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if not 200 <= response.status_code < 300 or response.status_code == 204:
+        return response
+    etag_propio = False
+    if request.method == 'GET' and request.path.startswith('/api/'):
+        response.headers.setdefault('Cache-Control', 'no-cache')
+        if response.get_etag()[0] is None:
+            etag = hashlib.blake2b(response.get_data(), digest_size=16).hexdigest()
+            if etag_coincide(etag):
+                return no_modificado(etag, response.headers['Cache-Control'])
+            response.set_etag(etag)
+            etag_propio = True
+    if not es_comprimible(response.mimetype) or (response.content_length or 0) < COMPRESSION_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    codificacion = elegir_codificacion(codificaciones_disponibles())
+    if codificacion is None:
+        return response
+    response.set_data(comprimir(response.get_data(), codificacion))
+    response.headers['Content-Encoding'] = codificacion
+    if etag_propio:
+        response.set_etag(f'{response.get_etag()[0]}-{codificacion}')
+    return response
+
+# Rutas que no usan el almacén y no deben retenerlo (flujo de eventos)
+RUTAS_SIN_BLOQUEO = {'/api/events'}
+VISTAS_BLOQUEO_PROPIO = set()
+
+def bloqueo_propio(vista):
+    """Marca una ruta con trabajo pesado aparte de los datos (pandas, archivos
+    subidos, hash de contraseñas): la petición no toma el almacén y la vista
+    usa store.shared() / store.exclusive() solo donde lee o modifica."""
+    VISTAS_BLOQUEO_PROPIO.add(vista.__name__)
+    return vista
+
+# Las rutas de la API trabajan sobre objetos compartidos del almacén. Las
+# lecturas (GET) toman store.shared() y corren en paralelo entre sí; las que
+# modifican toman store.exclusive(), que espera a que terminen las lecturas
+# en curso y no deja volcar a disco a mitad de un cambio.
+
+@app.before_request
+def lock_store_for_request():
+    if not request.path.startswith('/api/') or request.path in RUTAS_SIN_BLOQUEO \
+            or request.endpoint in VISTAS_BLOQUEO_PROPIO:
+        return
+    lectura = request.method in ('GET', 'HEAD', 'OPTIONS')
+    g.store_acceso = ExitStack()
+    g.store_acceso.enter_context(store.shared() if lectura else store.exclusive())
+    g.store_inicio = time.perf_counter()
+
+@app.teardown_request
+def unlock_store_for_request(exc):
+    acceso = g.pop('store_acceso', None)
+    if acceso is not None:
+        try:
+            acceso.close()
+        finally:
+            op = 'api_lectura' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'api_mutacion'
+            store.stats[op].observe(g.pop('store_inicio'))
+
+@app.errorhandler(StorageError)
+def handle_storage_error(e):
+    print(f"❌ Error de almacenamiento: {e}")
+    return jsonify({"error": "Los datos están ocupados o no se pudieron leer. Intente nuevamente."}), 503
+
+# --- Claves de idempotencia ---
+# Un POST a /api/... con la cabecera Idempotency-Key se ejecuta una sola vez:
+# los reintentos con la misma clave en la misma ruta reciben la respuesta
+# guardada (con Idempotent-Replayed: true) sin volver a tocar stock, clientes
+# ni disco. Reusar la clave con otro cuerpo da 422. Las respuestas 5xx no se
+# guardan, así el reintento vuelve a ejecutarse. Las rutas de sesión
+# (RUTAS_SIN_IDEMPOTENCIA) ignoran la cabecera: su respuesta lleva un token
+# que no debe quedar en el caché.
+#
+# Las claves duran IDEMPOTENCY_TTL segundos en un caché de hasta
+# IDEMPOTENCY_CACHE_SIZE entradas. El caché es por proceso. Como las
+# peticiones que modifican datos se atienden de a una por proceso
+# (store.exclusive), un reintento que llega mientras el original sigue en
+# curso espera y recibe la respuesta guardada; en las rutas con bloqueo
+# propio (importaciones) recibe 409 hasta que el original termine.
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_KEY_MAX = 255
+RUTAS_SIN_IDEMPOTENCIA = {'/api/data/users/authenticate', '/api/data/users/logout'}
+
+class TTLCache:
+    """Caché acotado cuyas entradas vencen `ttl` segundos después de guardarse.
+
+    Todas duran lo mismo, así que el orden de inserción es el de vencimiento:
+    las vencidas se descartan desde el principio al guardar.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # clave → (vence, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entrada = self._items.get(key)
+            if entrada is None:
+                return None
+            if entrada[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            return entrada[1]
+
+    def put(self, key, value):
+        ahora = time.monotonic()
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (ahora + self.ttl, value)
+            while self._items and (len(self._items) > self.maxsize or next(iter(self._items.values()))[0] <= ahora):
+                self._items.popitem(last=False)
+
+idempotency_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+idempotencia_en_curso = set()
+idempotencia_lock = threading.Lock()
+metrics.counter('idempotent_replays_total', 'POST repetidos con la misma Idempotency-Key que se respondieron desde el caché.')
+
+@app.before_request
+def replay_idempotent_request():
+    # Se registra después de lock_store_for_request: salvo en las rutas con
+    # bloqueo propio, corre con el almacén tomado
+    clave = request.headers.get('Idempotency-Key')
+    if request.method != 'POST' or not clave or not request.path.startswith('/api/') \
+            or request.path in RUTAS_SIN_IDEMPOTENCIA:
+        return None
+    if len(clave) > IDEMPOTENCY_KEY_MAX:
+        return jsonify({"error": f"Idempotency-Key no puede superar {IDEMPOTENCY_KEY_MAX} caracteres."}), 400
+    huella = hashlib.blake2b(request.get_data(), digest_size=16).hexdigest()
+    guardada = idempotency_cache.get((request.path, clave))
+    if guardada is None:
+        with idempotencia_lock:
+            if (request.path, clave) in idempotencia_en_curso:
+                return jsonify({"error": "Hay una petición con esta Idempotency-Key en curso."}), 409
+            idempotencia_en_curso.add((request.path, clave))
+        g.idempotencia = ((request.path, clave), huella)
+        g.idempotencia_en_curso = (request.path, clave)
+        return None
+    if guardada['huella'] != huella:
+        return jsonify({"error": "Esta Idempotency-Key ya se usó con otro contenido."}), 422
+    metrics.inc('idempotent_replays_total', ruta=request.url_rule.rule if request.url_rule else 'otra')
+    response = app.response_class(guardada['cuerpo'], status=guardada['status'], mimetype=guardada['mimetype'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.after_request
+def store_idempotent_response(response):
+    idempotencia = g.pop('idempotencia', None)
+    if idempotencia is not None and response.status_code < 500 and not response.is_streamed:
+        clave, huella = idempotencia
+        idempotency_cache.put(clave, {'huella': huella, 'status': response.status_code,
+                                      'cuerpo': response.get_data(), 'mimetype': response.mimetype})
+    return response
+
+@app.teardown_request
+def release_idempotency_key(exc):
+    clave = g.pop('idempotencia_en_curso', None)
+    if clave is not None:
+        with idempotencia_lock:
+            idempotencia_en_curso.discard(clave)
 
 # --- Rutas de la API ---
 
+@app.route('/api/store/stats', methods=['GET'])
+def get_store_stats():
+    return jsonify({
+        "flush_interval": store.flush_interval,
+        "colecciones_cargadas": [os.path.basename(fp) for fp in store.loaded_collections()],
+        "colecciones_pendientes": [os.path.basename(fp) for fp in store.dirty_collections()],
+        "latencias": {op: s.summary() for op, s in store.stats.items()},
+    }), 200
+
+BOOTSTRAP_COLLECTIONS = {
+    'users': USERS_FILE,
+    'ingresos': INGRESOS_FILE,
+    'gastos': GASTOS_FILE,
+    'precios': PRECIOS_FILE,
+    'costos': COSTOS_FILE,
+    'stock': STOCK_FILE,
+    'pedidos': PEDIDOS_FILE,
+    'clientes': CLIENTES_FILE,
+    'vencimientos': VENCIMIENTOS_FILE,
+    'proveedores': PROVEEDORES_FILE,
+    'gastos_recurrentes': GASTOS_RECURRENTES_FILE,
+}
+
 @app.route('/api/data', methods=['GET'])
 def get_all_data():
-    data = {
-        'users': read_data(USERS_FILE),
-        'ingresos': read_data(INGRESOS_FILE),
-        'gastos': read_data(GASTOS_FILE),
-        'precios': read_data(PRECIOS_FILE),
-        'costos': read_data(COSTOS_FILE),
-        'stock': read_data(STOCK_FILE),
-        'pedidos': read_data(PEDIDOS_FILE),
-        'clientes': read_data(CLIENTES_FILE),
-        'vencimientos': read_data(VENCIMIENTOS_FILE),
-        'proveedores': read_data(PROVEEDORES_FILE)
+    # Sin parámetros devuelve todas las colecciones. Con ?since=<revisión>
+    # (el ETag de una respuesta anterior) devuelve solo lo que cambió:
+    #   {"revision": "...", "colecciones": {
+    #       "pedidos": {"cambios": [registros nuevos o modificados], "eliminados": [ids]},
+    #       "gastos": {"meses": {"2025": {"Marzo": [...]}}},
+    #       "costos": {"completa": {...}}}}
+    # Con varios workers la revisión de otro worker sirve igual, pero las
+    # colecciones que cambiaron vienen como "completa". Si es de otra época o
+    # demasiado vieja, vienen todas así. Con If-None-Match y nada nuevo
+    # responde 304.
+    etag = store.revision_token()
+    data = {nombre: read_data(filepath) for nombre, filepath in BOOTSTRAP_COLLECTIONS.items()}
+    for nombre, filepath in BOOTSTRAP_COLLECTIONS.items():
+        if filepath in COLLECTION_VIEWS:
+            data[nombre] = [COLLECTION_VIEWS[filepath](item) for item in data[nombre]]
+    paths = set(BOOTSTRAP_COLLECTIONS.values())
+    previos = request.if_none_match
+    if previos.star_tag or any(store.changes_since_token(e.rsplit('-', 1)[0], paths) == {} for e in previos.as_set()):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    since = request.args.get('since')
+    response = jsonify(data if since is None else build_data_delta(data, since, etag))
+    response.set_etag(etag)
+    return response, 200
+
+def build_data_delta(data, since_token, revision):
+    cambios = store.changes_since_token(since_token, set(BOOTSTRAP_COLLECTIONS.values()))
+    colecciones = {}
+    for nombre, filepath in BOOTSTRAP_COLLECTIONS.items():
+        if cambios is None:
+            colecciones[nombre] = {'completa': data[nombre]}
+            continue
+        c = cambios.get(filepath)
+        if not c:
+            continue
+        if filepath == GASTOS_FILE and not c['completa']:
+            meses = {}
+            for year, month in c['entradas']:
+                meses.setdefault(year, {})[month] = data[nombre].get(year, {}).get(month, [])
+            colecciones[nombre] = {'meses': meses}
+        elif c['completa'] or not isinstance(data[nombre], list):
+            colecciones[nombre] = {'completa': data[nombre]}
+        else:
+            colecciones[nombre] = delta_coleccion(filepath, c)
+    return {'revision': revision, 'colecciones': colecciones}
+
+def delta_coleccion(filepath, c):
+    """Registros nuevos o modificados y claves eliminadas de una colección
+    tipo lista, según el resumen que devuelve store.changes_since."""
+    vista = COLLECTION_VIEWS.get(filepath, lambda item: item)
+    if c['completa']:
+        return {'completa': [vista(item) for item in read_data(filepath)]}
+    actuales = {key: store.get_item(filepath, key) for key in c['upserts'] | c['eliminados']}
+    return {
+        'cambios': [vista(actuales[key]) for key in c['upserts'] if actuales[key] is not None],
+        'eliminados': [key for key, item in actuales.items() if item is None],
     }
-    return jsonify(data), 200
+
+# --- Eventos en vivo (SSE) ---
+# GET /api/events mantiene abierta una conexión text/event-stream por la que
+# llegan los cambios de pedidos apenas ocurren, con el stock y los clientes
+# que esos cambios tocaron:
+#   id: <revisión>
+#   event: pedido
+#   data: {"accion": "crear" | "actualizar" | "eliminar", "pedido": {...},
+#          "stock": {"cambios": [...], "eliminados": [...]}, "clientes": {...}}
+# El id de cada evento es una revisión del almacén (la del ETag de /api/data;
+# con varios workers, su parte local). Al reconectar, EventSource manda Last-Event-ID y se reenvía lo
+# que faltó. También se puede pasar ?since=<ETag> en la primera conexión.
+# Si esa revisión ya no está en el búfer o es de otro proceso llega un evento
+# "resync": hay que pedir /api/data?since=... para ponerse al día.
+#
+# Los eventos son por proceso. Cada conexión abierta ocupa un hilo, por eso
+# gunicorn corre con workers gthread (ver procfile) y las conexiones se cortan
+# cada EVENTS_STREAM_SECONDS (el navegador reconecta solo). Por worker se
+# admiten hasta EVENTS_MAX_SUBSCRIBERS conexiones; la siguiente recibe 503 y
+# EventSource reintenta a los EVENTS_RETRY_MS. El procfile usa --threads 48:
+# 16 hilos para los suscriptores y 32 libres para el resto de las peticiones.
+# Si se cambia uno de los dos números, hay que cambiar el otro.
+EVENTS_BUFFER_SIZE = int(os.environ.get('EVENTS_BUFFER_SIZE', 1000))
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+EVENTS_STREAM_SECONDS = float(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 16))
+EVENTS_RETRY_MS = 3000
+
+def evento_sse(nombre, datos, evento_id=None):
+    """Texto SSE de un evento; los datos van en JSON compacto (serializar)."""
+    cabecera = f"id: {evento_id}\n" if evento_id is not None else ""
+    return f"{cabecera}event: {nombre}\ndata: {serializar_texto(datos)}\n\n"
+
+class EventBus:
+    """Difusión de eventos a los suscriptores de /api/events.
+
+    Cada evento se serializa una sola vez y queda en un búfer circular
+    compartido; los suscriptores recuerdan la última revisión que leyeron y
+    esperan en la misma condición, así publicar cuesta lo mismo con uno que
+    con muchos suscriptores.
+    """
+
+    def __init__(self, size):
+        self._events = deque(maxlen=size)  # (revisión, texto SSE)
+        self._floor = 0  # revisión del último evento descartado del búfer
+        self._cond = threading.Condition()
+        self.subscribers = 0
+
+    def publish(self, revision, nombre, datos):
+        texto = evento_sse(nombre, datos, f"{store.epoch}.{revision}")
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self._floor = self._events[0][0]
+            self._events.append((revision, texto))
+            self._cond.notify_all()
+
+    def last(self):
+        with self._cond:
+            return self._events[-1][0] if self._events else self._floor
+
+    def wait(self, desde, timeout):
+        """Eventos posteriores a la revisión `desde`, esperando hasta `timeout`
+        segundos si no hay ninguno. None si el búfer ya no llega tan atrás."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events and self._events[-1][0] > desde, timeout)
+            if desde < self._floor:
+                return None
+            return [e for e in self._events if e[0] > desde]
+
+    def subscribe(self):
+        with self._cond:
+            if self.subscribers >= EVENTS_MAX_SUBSCRIBERS:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+event_bus = EventBus(EVENTS_BUFFER_SIZE)
+
+def publicar_pedido(accion, pedido, desde):
+    """Publica el cambio de un pedido junto con lo que cambió en stock y
+    clientes desde la revisión `desde` (la del comienzo de la petición)."""
+    datos = {'accion': accion, 'pedido': pedido}
+    cambios = store.changes_since(desde, {STOCK_FILE, CLIENTES_FILE})
+    for nombre, filepath in (('stock', STOCK_FILE), ('clientes', CLIENTES_FILE)):
+        c = {'completa': True} if cambios is None else cambios.get(filepath)
+        if c:
+            datos[nombre] = delta_coleccion(filepath, c)
+    event_bus.publish(store.revision, 'pedido', datos)
+
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    ultimo = request.headers.get('Last-Event-ID') or request.args.get('since')
+    desde = store.parse_revision_token(ultimo) if ultimo else None
+    if not event_bus.subscribe():
+        return jsonify({"error": "Demasiadas conexiones de eventos abiertas."}), 503
+
+    def generar(desde):
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        if desde is None:
+            if ultimo:
+                yield evento_sse('resync', {'revision': store.revision_token()})
+            desde = event_bus.last()
+        fin = time.monotonic() + EVENTS_STREAM_SECONDS
+        while time.monotonic() < fin:
+            eventos = event_bus.wait(desde, min(EVENTS_HEARTBEAT, max(0, fin - time.monotonic())))
+            if eventos is None:
+                # Se quedó atrás: lo que falta ya salió del búfer
+                yield evento_sse('resync', {'revision': store.revision_token()})
+                desde = event_bus.last()
+            elif not eventos:
+                yield ": ping\n\n"
+            else:
+                for revision, texto in eventos:
+                    yield texto
+                desde = eventos[-1][0]
+
+    response = app.response_class(generar(desde), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Al cerrar la respuesta y no en un finally del generador: si la conexión
+    # se corta antes del primer envío, el generador nunca arranca
+    response.call_on_close(event_bus.unsubscribe)
+    return response
 
 # --- Rutas para Usuarios ---
+# Las contraseñas se guardan como hash con sal (contrasena_hash, formato de
+# werkzeug). Los usuarios que todavía tienen la contraseña en texto plano
+# (contrasena) pasan al hash en su próximo inicio de sesión, o todos juntos
+# con `flask --app main migrar-contrasenas`.
+#
+# Al iniciar sesión se crea una sesión en sesiones.json y se devuelve un token
+# firmado que la identifica. Las rutas que quieran saber quién llama usan
+# usuario_actual(), que lee la cabecera "Authorization: Bearer <token>":
+# verifica la firma y el vencimiento y busca la sesión y el usuario por clave
+# en memoria, sin leer archivos. Una sesión se revoca con
+# POST /api/data/users/logout; cambiar la contraseña o eliminar al usuario
+# revoca todas las suyas.
+#
+# El token se firma con SESSION_SECRET o, si no está definida, con una clave
+# aleatoria que se genera una vez en datos/.session_secret (compartida por
+# todos los workers).
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 12 * 3600))
+SESSION_SECRET_FILE = os.path.join(DATA_DIR, '.session_secret')
+CAMPOS_CONTRASENA = ('contrasena', 'contrasena_hash')
+
+# Verificar un hash cuesta ~100 ms a propósito. Las verificaciones correctas se
+# recuerdan unos minutos como HMAC con una clave del proceso, así los
+# reintentos y los inicios de sesión seguidos no repiten el cálculo.
+CREDENTIALS_CACHE_TTL = float(os.environ.get('CREDENTIALS_CACHE_TTL', 900))
+credenciales_verificadas = TTLCache(1000, CREDENTIALS_CACHE_TTL)
+_clave_credenciales = secrets.token_bytes(32)
+_firmador = None
+
+def firmador_sesiones():
+    global _firmador
+    if _firmador is None:
+        secreto = os.environ.get('SESSION_SECRET')
+        if not secreto:
+            ensure_data_dir()
+            try:
+                fd = os.open(SESSION_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(secrets.token_hex(32))
+            except FileExistsError:
+                pass
+            with open(SESSION_SECRET_FILE) as f:
+                secreto = f.read().strip()
+        _firmador = URLSafeTimedSerializer(secreto, salt='sesion')
+    return _firmador
+
+def usuario_publico(user):
+    """El usuario sin sus campos de contraseña, tal como lo devuelve la API."""
+    return {k: v for k, v in user.items() if k not in CAMPOS_CONTRASENA}
+
+COLLECTION_VIEWS[USERS_FILE] = usuario_publico
+
+def huella_credencial(hash_guardado, password):
+    return hmac.new(_clave_credenciales, f"{hash_guardado}\0{password}".encode(), hashlib.sha256).digest()
+
+def verificar_contrasena(usuario, credencial, password):
+    """Compara `password` con la credencial de `usuario` (sus campos de
+    CAMPOS_CONTRASENA, copiados del almacén). No toca el almacén, así el hash
+    se verifica sin retenerlo. Devuelve (válida, hash nuevo): el hash nuevo es
+    para guardar si el usuario todavía tenía la contraseña en texto plano."""
+    if not isinstance(password, str) or not password:
+        return False, None
+    hash_guardado = credencial.get('contrasena_hash')
+    hash_nuevo = None
+    if hash_guardado is None:
+        plano = credencial.get('contrasena')
+        if plano is None or not hmac.compare_digest(str(plano).encode(), password.encode()):
+            return False, None
+        hash_guardado = hash_nuevo = generate_password_hash(password)
+    elif credenciales_verificadas.get(usuario) == huella_credencial(hash_guardado, password):
+        return True, None
+    elif not check_password_hash(hash_guardado, password):
+        return False, None
+    credenciales_verificadas.put(usuario, huella_credencial(hash_guardado, password))
+    return True, hash_nuevo
+
+def con_contrasena_hasheada(datos):
+    """Copia de `datos` con la contraseña en texto plano reemplazada por su hash."""
+    contrasena = datos.get('contrasena')
+    datos = {k: v for k, v in datos.items() if k not in CAMPOS_CONTRASENA}
+    if contrasena:
+        datos['contrasena_hash'] = generate_password_hash(str(contrasena))
+    return datos
+
+class VencimientoSesiones:
+    """Heap (vence, id) de las sesiones, para limpiar las vencidas sin recorrer
+    sesiones.json en cada inicio de sesión.
+
+    Se rearma cuando la colección se recarga entera (cambios de otro proceso)
+    y cuando las sesiones revocadas antes de vencer (que quedan en el heap;
+    borrarlas al vencer no hace nada) llegan a la mitad. Se usa con
+    store.exclusive().
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._generacion = None
+        self._revocadas = 0
+
+    def _sincronizar(self):
+        generacion = store.generation(SESIONES_FILE)
+        if generacion != self._generacion:
+            self._rearmar()
+            self._generacion = generacion
+
+    def _rearmar(self):
+        self._heap = [(s.get('vence', 0), s['id']) for s in read_data(SESIONES_FILE) if s.get('id')]
+        heapq.heapify(self._heap)
+        self._revocadas = 0
+
+    def revocadas(self, cantidad):
+        """Avisa que se borraron `cantidad` sesiones antes de que vencieran."""
+        self._sincronizar()
+        self._revocadas += cantidad
+        if self._revocadas * 2 > len(self._heap):
+            self._rearmar()
+
+    def agregar(self, sesion):
+        self._sincronizar()
+        heapq.heappush(self._heap, (sesion['vence'], sesion['id']))
+
+    def vencidas(self, ahora):
+        """Ids de las sesiones vencidas a `ahora`; salen del heap."""
+        self._sincronizar()
+        ids = []
+        while self._heap and self._heap[0][0] <= ahora:
+            ids.append(heapq.heappop(self._heap)[1])
+        return ids
+
+vencimiento_sesiones = VencimientoSesiones()
+
+def crear_sesion(user):
+    """Registra una sesión nueva para `user` y devuelve (token, vence)."""
+    ahora = time.time()
+    # Las sesiones vencidas se limpian al crear una nueva
+    vencidas = vencimiento_sesiones.vencidas(ahora)
+    if vencidas:
+        store.delete_items(SESIONES_FILE, vencidas)
+    sesion = {'id': secrets.token_urlsafe(16), 'usuario': user['usuario'], 'creada': ahora, 'vence': ahora + SESSION_TTL}
+    store.insert_item(SESIONES_FILE, sesion)
+    vencimiento_sesiones.agregar(sesion)
+    return firmador_sesiones().dumps({'sid': sesion['id'], 'u': user['usuario']}), sesion['vence']
+
+def sesion_del_token(token):
+    """La sesión vigente que identifica `token`, o None."""
+    try:
+        datos = firmador_sesiones().loads(token, max_age=SESSION_TTL)
+    except (BadSignature, SignatureExpired):
+        return None
+    sesion = store.get_item(SESIONES_FILE, datos.get('sid'))
+    if sesion is None or sesion['usuario'] != datos.get('u') or sesion['vence'] <= time.time():
+        return None
+    return sesion
+
+def token_de_peticion():
+    encabezado = request.headers.get('Authorization', '')
+    return encabezado[7:].strip() if encabezado.startswith('Bearer ') else None
+
+def usuario_actual():
+    """El usuario (registro de users.json) de la sesión con que llegó la
+    petición, o None si no trae un token válido. Se calcula una vez por petición."""
+    if 'usuario_actual' not in g:
+        token = token_de_peticion()
+        sesion = sesion_del_token(token) if token else None
+        g.usuario_actual = store.get_item(USERS_FILE, sesion['usuario']) if sesion else None
+    return g.usuario_actual
+
+def revocar_sesiones(username):
+    """Cierra todas las sesiones de `username`; devuelve cuántas había."""
+    cerradas = store.delete_items(SESIONES_FILE, [s['id'] for s in store.find_items(SESIONES_FILE, 'usuario', username)])
+    if cerradas:
+        vencimiento_sesiones.revocadas(cerradas)
+    return cerradas
+
 @app.route('/api/data/users/authenticate', methods=['POST'])
+@bloqueo_propio
 def authenticate_user():
-    credentials = request.json
+    credentials = request.json if isinstance(request.json, dict) else {}
     username = credentials.get('username')
     password = credentials.get('password')
-    users = read_data(USERS_FILE)
-    user = next((u for u in users if u['usuario'] == username and u['contrasena'] == password), None)
-    if user:
-        return jsonify({"user": {"usuario": user['usuario'], "rol": user['rol'], "frase_bienvenida": user.get('frase_bienvenida', f"¡Bienvenido, {user['usuario']}!")}}), 200
-    else:
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({"error": "username y password deben ser texto."}), 400
+    # El hash se verifica sobre una copia de la credencial, sin retener el
+    # almacén; solo la sesión se crea con el almacén tomado
+    with store.shared():
+        user = store.get_item(USERS_FILE, username)
+        credencial = {campo: user.get(campo) for campo in CAMPOS_CONTRASENA} if user else None
+    valida, hash_nuevo = verificar_contrasena(username, credencial, password) if credencial else (False, None)
+    if not valida:
         return jsonify({"error": "Credenciales inválidas"}), 401
+    with store.exclusive():
+        user = store.get_item(USERS_FILE, username)
+        # Si la contraseña cambió mientras se verificaba, vale la nueva
+        if user is None or any(user.get(campo) != credencial[campo] for campo in CAMPOS_CONTRASENA):
+            return jsonify({"error": "Credenciales inválidas"}), 401
+        if hash_nuevo is not None:
+            user = store.update_item(USERS_FILE, username, {'contrasena_hash': hash_nuevo}, remove=('contrasena',))
+        token, vence = crear_sesion(user)
+        usuario = {"usuario": user['usuario'], "rol": user['rol'], "frase_bienvenida": user.get('frase_bienvenida', f"¡Bienvenido, {user['usuario']}!")}
+    return jsonify({"user": usuario, "token": token,
+                    "vence": datetime.datetime.fromtimestamp(vence).isoformat(timespec='seconds')}), 200
+
+@app.route('/api/data/users/session', methods=['GET'])
+def get_session_user():
+    user = usuario_actual()
+    if user is None:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
+    return jsonify({"user": usuario_publico(user)}), 200
+
+@app.route('/api/data/users/logout', methods=['POST'])
+def logout_user():
+    token = token_de_peticion()
+    sesion = sesion_del_token(token) if token else None
+    if sesion is None:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
+    store.delete_items(SESIONES_FILE, [sesion['id']])
+    vencimiento_sesiones.revocadas(1)
+    return jsonify({"message": "Sesión cerrada."}), 200
+
+@app.route('/api/data/users', methods=['GET'])
+def get_users():
+    return query_collection(USERS_FILE)
 
 @app.route('/api/data/users', methods=['POST'])
 def create_user():
     new_user_data = request.json
     if not new_user_data.get('usuario') or not new_user_data.get('contrasena'):
         return jsonify({"error": "Usuario y contraseña son obligatorios."}), 400
-    users = read_data(USERS_FILE)
-    if any(u['usuario'] == new_user_data['usuario'] for u in users):
+    if store.get_item(USERS_FILE, new_user_data['usuario']):
         return jsonify({"error": "El nombre de usuario ya existe."}), 409
-    users.append(new_user_data)
-    write_data(USERS_FILE, users)
+    store.insert_item(USERS_FILE, con_contrasena_hasheada(new_user_data))
     return jsonify({"message": "Usuario creado exitosamente."}), 201
 
 @app.route('/api/data/users/<username>', methods=['PUT'])
 def update_user(username):
-    updated_data = request.json
-    users = read_data(USERS_FILE)
-    user_found = False
-    for i, user in enumerate(users):
-        if user['usuario'] == username:
-            users[i].update(updated_data)
-            user_found = True
-            break
-    if not user_found:
+    updated_data = con_contrasena_hasheada(request.json)
+    cambia_contrasena = 'contrasena_hash' in updated_data
+    renombra = updated_data.get('usuario', username) != username
+    if store.update_item(USERS_FILE, username, updated_data, remove=('contrasena',) if cambia_contrasena else ()) is None:
         return jsonify({"error": "Usuario no encontrado"}), 404
-    write_data(USERS_FILE, users)
+    # Las sesiones abiertas son del nombre y la contraseña de antes
+    if cambia_contrasena or renombra:
+        revocar_sesiones(username)
     return jsonify({"message": f"Usuario '{username}' actualizado exitosamente."}), 200
 
 @app.route('/api/data/users/<username>', methods=['DELETE'])
 def delete_user(username):
-    users = read_data(USERS_FILE)
-    initial_len = len(users)
-    users = [u for u in users if u['usuario'] != username]
-    if len(users) == initial_len:
+    if not store.delete_items(USERS_FILE, [username]):
         return jsonify({"error": "Usuario no encontrado"}), 404
-    write_data(USERS_FILE, users)
+    revocar_sesiones(username)
     return jsonify({"message": "Usuario eliminado exitosamente."}), 200
 
+@app.cli.command('migrar-contrasenas')
+def migrar_contrasenas_command():
+    """Reemplaza las contraseñas en texto plano de users.json por su hash."""
+    with store.lock:
+        store.begin()
+        try:
+            migrados = 0
+            for user in list(read_data(USERS_FILE)):
+                if 'contrasena' in user:
+                    cambios = {} if 'contrasena_hash' in user else {'contrasena_hash': generate_password_hash(str(user['contrasena']))}
+                    store.update_item(USERS_FILE, user['usuario'], cambios, remove=('contrasena',))
+                    migrados += 1
+        finally:
+            store.end()
+    store.flush()
+    print(f"✅ {migrados} contraseñas migradas a hash en {USERS_FILE}")
+
 # --- Rutas para Movimientos (Ingresos/Egresos) ---
 @app.route('/api/data/ingresos', methods=['GET'])
 def get_movimientos():
-    return jsonify(read_data(INGRESOS_FILE)), 200
+    return query_collection(INGRESOS_FILE)
+
+def crear_movimiento(new_movimiento):
+    new_movimiento['id'] = str(uuid.uuid4())
+    store.insert_item(INGRESOS_FILE, new_movimiento)
+    return new_movimiento, 201
+
+def eliminar_movimiento(movimiento_id):
+    if not store.delete_items(INGRESOS_FILE, [movimiento_id]):
+        return {"error": "Movimiento no encontrado"}, 404
+    return {"message": "Movimiento eliminado exitosamente"}, 200
 
 @app.route('/api/data/ingresos', methods=['POST'])
 def add_movimiento():
-    new_movimiento = request.json
-    new_movimiento['id'] = str(uuid.uuid4())
-    movimientos = read_data(INGRESOS_FILE)
-    movimientos.append(new_movimiento)
-    write_data(INGRESOS_FILE, movimientos)
-    return jsonify(new_movimiento), 201
+    return responder(crear_movimiento(request.json))
 
 @app.route('/api/data/ingresos/<movimiento_id>', methods=['DELETE'])
 def delete_movimiento(movimiento_id):
-    movimientos = read_data(INGRESOS_FILE)
-    initial_len = len(movimientos)
-    movimientos = [m for m in movimientos if m.get('id') != movimiento_id]
-    if len(movimientos) == initial_len:
-        return jsonify({"error": "Movimiento no encontrado"}), 404
-    write_data(INGRESOS_FILE, movimientos)
-    return jsonify({"message": "Movimiento eliminado exitosamente"}), 200
+    return responder(eliminar_movimiento(movimiento_id))
 
 
 # --- Rutas para Gastos ---
+# Los conceptos recurrentes se guardan como reglas en gastos_recurrentes.json
+# ({"id", "concepto", "desde": "AAAA-MM", "hasta": "AAAA-MM" | None, "plantilla"}).
+# En gastos.json solo quedan los meses que alguien editó; un mes que no figura
+# se arma al vuelo con las plantillas de las reglas vigentes en ese mes.
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+def year_month(year, month):
+    """Clave 'AAAA-MM' de un mes de gastos, o None si el año o el mes no son válidos."""
+    if month not in MESES or not str(year).isdigit():
+        return None
+    return f"{int(year):04d}-{MESES.index(month) + 1:02d}"
+
+def siguiente_mes(ym):
+    year, month = int(ym[:4]), int(ym[5:])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+def meses_entre(desde, hasta):
+    return (int(hasta[:4]) - int(desde[:4])) * 12 + int(hasta[5:]) - int(desde[5:])
+
+def plantilla_gasto(concepto):
+    return {"concepto": concepto, "monto": "", "fecha": "", "pagado": "no"}
+
+def regla_vigente(regla, ym):
+    return regla['desde'] <= ym and (not regla.get('hasta') or ym <= regla['hasta'])
+
+def proyectar_gastos(year, month):
+    ym = year_month(year, month)
+    if ym is None:
+        return []
+    return [dict(regla['plantilla']) for regla in read_data(GASTOS_RECURRENTES_FILE) if regla_vigente(regla, ym)]
+
+def gastos_del_mes(year, month):
+    guardado = read_data(GASTOS_FILE).get(year, {}).get(month)
+    if guardado is not None:
+        return guardado
+    return proyectar_gastos(year, month)
+
+def registrar_gastos_recurrentes(conceptos, desde):
+    """Crea (o adelanta) la regla de cada concepto nuevo a partir del mes `desde`."""
+    reglas = {regla['concepto'].lower(): regla for regla in read_data(GASTOS_RECURRENTES_FILE)}
+    for concepto in conceptos:
+        regla = reglas.get(concepto.lower())
+        if regla is None:
+            regla = {"id": str(uuid.uuid4()), "concepto": concepto, "desde": desde, "hasta": None,
+                     "plantilla": plantilla_gasto(concepto)}
+            store.insert_item(GASTOS_RECURRENTES_FILE, regla)
+            reglas[concepto.lower()] = regla
+        elif regla['desde'] > desde or (regla.get('hasta') and regla['hasta'] < desde):
+            store.update_item(GASTOS_RECURRENTES_FILE, regla['id'],
+                              {"desde": min(regla['desde'], desde), "hasta": None})
+    # Los meses posteriores que ya están guardados no se proyectan: se les
+    # agrega el concepto como antes
+    for year, meses in read_data(GASTOS_FILE).items():
+        for month, items in meses.items():
+            ym = year_month(year, month)
+            if ym is None or ym < desde:
+                continue
+            existentes = {g['concepto'].lower() for g in items}
+            faltantes = [c for c in conceptos if c.lower() not in existentes]
+            if faltantes:
+                store.set_entry(GASTOS_FILE, (year, month), items + [plantilla_gasto(c) for c in faltantes])
+                agenda_vencimientos.mes_cambiado(year, month)
+
+def guardar_gastos_mes(year, month, items):
+    """Guarda los conceptos de un mes; los que son nuevos pasan a ser
+    recurrentes a partir del mes siguiente."""
+    current_concepts = {g['concepto'].lower() for g in gastos_del_mes(year, month)}
+    new_concepts = []
+    for item in items:
+        if item['concepto'].lower() not in current_concepts and item['concepto'] not in new_concepts:
+            new_concepts.append(item['concepto'])
+    store.set_entry(GASTOS_FILE, (year, month), items)
+    agenda_vencimientos.mes_cambiado(year, month)
+    if new_concepts:
+        registrar_gastos_recurrentes(new_concepts, siguiente_mes(year_month(year, month)))
+
 @app.route('/api/data/gastos/month/<month>/year/<year>', methods=['GET'])
 def get_gastos_by_month_year(month, year):
-    all_gastos = read_data(GASTOS_FILE)
-    gastos_del_mes = all_gastos.get(year, {}).get(month, [])
-    return jsonify(gastos_del_mes), 200
+    return jsonify(gastos_del_mes(year, month)), 200
 
 @app.route('/api/data/gastos/month/<month>/year/<year>', methods=['PUT'])
 def update_gastos_by_month_year(month, year):
-    updated_gastos_for_month = request.json
-    all_gastos = read_data(GASTOS_FILE)
-    if not isinstance(all_gastos, dict):
-        all_gastos = {}
-    current_gastos_for_month = all_gastos.get(year, {}).get(month, [])
-    new_concepts = [item for item in updated_gastos_for_month if item['concepto'].lower() not in {g['concepto'].lower() for g in current_gastos_for_month}]
-    if year not in all_gastos:
-        all_gastos[year] = {}
-    all_gastos[year][month] = updated_gastos_for_month
-    if new_concepts:
-        month_names = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
-        month_index = month_names.index(month)
-        current_date = datetime.date(int(year), month_index + 1, 1)
-        for _ in range(120):
-            current_date += datetime.timedelta(days=32)
-            current_date = current_date.replace(day=1)
-            future_year, future_month_name = str(current_date.year), month_names[current_date.month - 1]
-            if future_year not in all_gastos: all_gastos[future_year] = {}
-            if future_month_name not in all_gastos[future_year]: all_gastos[future_year][future_month_name] = []
-            future_month_gastos = all_gastos[future_year][future_month_name]
-            future_concept_names = {g['concepto'].lower() for g in future_month_gastos}
-            for new_concept in new_concepts:
-                if new_concept['concepto'].lower() not in future_concept_names:
-                    future_month_gastos.append({"concepto": new_concept['concepto'], "monto": "", "fecha": "", "pagado": "no"})
-            all_gastos[future_year][future_month_name] = future_month_gastos
-    write_data(GASTOS_FILE, all_gastos)
+    ym = year_month(year, month)
+    if ym is None:
+        return jsonify({"error": "Mes o año inválido"}), 400
+    guardar_gastos_mes(year, month, request.json)
     return jsonify({'message': f'Gastos para {month} {year} actualizados'}), 200
 
+@app.route('/api/data/gastos/recurrentes', methods=['GET'])
+def get_gastos_recurrentes():
+    return query_collection(GASTOS_RECURRENTES_FILE)
+
+@app.cli.command('compactar-gastos')
+def compactar_gastos_command():
+    """Pasa los conceptos de gastos.json a reglas recurrentes y borra los meses que solo las repiten."""
+    with store.lock:
+        store.begin()
+        try:
+            compactar_gastos()
+        finally:
+            store.end()
+    store.flush()
+
+def compactar_gastos():
+    gastos = read_data(GASTOS_FILE)
+    meses = []
+    for year, por_mes in gastos.items():
+        for month in por_mes:
+            ym = year_month(year, month)
+            if ym is not None:
+                meses.append((ym, year, month))
+    if not meses:
+        print("No hay meses de gastos para compactar.")
+        return
+    meses.sort()
+    ultimo = meses[-1][0]
+    # Primera y última aparición de cada concepto (en orden de aparición)
+    apariciones = {}
+    for ym, year, month in meses:
+        for item in gastos[year][month]:
+            clave = item['concepto'].lower()
+            if clave not in apariciones:
+                apariciones[clave] = {"concepto": item['concepto'], "desde": ym}
+            apariciones[clave]['hasta'] = ym
+    reglas = read_data(GASTOS_RECURRENTES_FILE)
+    existentes = {regla['concepto'].lower() for regla in reglas}
+    reglas = list(reglas)
+    # Las reglas nuevas siguen el orden del mes con más conceptos (el más
+    # reciente si hay empate) y después el de primera aparición
+    _, year, month = max(meses, key=lambda m: (len(gastos[m[1]][m[2]]), m[0]))
+    orden = {item['concepto'].lower(): i for i, item in enumerate(gastos[year][month])}
+    for clave, a in sorted(apariciones.items(), key=lambda par: orden.get(par[0], len(orden))):
+        if clave in existentes:
+            continue
+        # Antes cada concepto nuevo se copiaba 120 meses hacia adelante: si llega
+        # a ese límite (o al último mes guardado) la regla no tiene fin
+        abierta = a['hasta'] == ultimo or meses_entre(a['desde'], a['hasta']) >= 120
+        reglas.append({"id": str(uuid.uuid4()), "concepto": a['concepto'], "desde": a['desde'],
+                       "hasta": None if abierta else a['hasta'],
+                       "plantilla": plantilla_gasto(a['concepto'])})
+
+    compactado = {}
+    borrados = 0
+    for year, por_mes in gastos.items():
+        for month, items in por_mes.items():
+            ym = year_month(year, month)
+            if ym is not None:
+                proyectado = [r['plantilla'] for r in reglas if regla_vigente(r, ym)]
+                if items == proyectado:
+                    borrados += 1
+                    continue
+            compactado.setdefault(year, {})[month] = items
+    antes = len(json.dumps(gastos, ensure_ascii=False))
+    despues = len(json.dumps(compactado, ensure_ascii=False)) + len(json.dumps(reglas, ensure_ascii=False))
+    write_data(GASTOS_RECURRENTES_FILE, reglas)
+    write_data(GASTOS_FILE, compactado)
+    print(f"✅ {len(reglas)} conceptos recurrentes, {borrados} meses sin cambios eliminados "
+          f"({antes // 1024} KB -> {despues // 1024} KB)")
+
+# --- Historial de precios ---
+# El historial de cada precio vive aparte, en precios_historial.json (con
+# archivos JSON es un diario de solo agregado): una entrada compacta por cambio
+# {"id", "item", "fecha", "precio"}. Para un mismo ítem y fecha vale la última
+# entrada; precio null borra esa fecha. precios.json queda liviano y la API
+# sigue devolviendo 'price_history' armado al vuelo, con la misma forma.
+def historial_de(item_id):
+    """fecha → precio vigente del historial aparte de un ítem."""
+    por_fecha = {}
+    for entrada in store.find_items(PRECIOS_HISTORIAL_FILE, 'item', item_id):
+        por_fecha[entrada['fecha']] = entrada['precio']
+    return por_fecha
+
+def precio_con_historial(item):
+    # Lo que todavía esté en línea (datos anteriores) más el historial aparte
+    por_fecha = {h.get('date'): h.get('price') for h in item.get('price_history') or [] if h.get('date')}
+    if item.get('id') is not None:
+        por_fecha.update(historial_de(item['id']))
+    if not por_fecha and 'price_history' not in item:
+        return item
+    return dict(item, price_history=[{'date': fecha, 'price': precio} for fecha, precio in sorted(por_fecha.items()) if precio is not None])
+
+COLLECTION_VIEWS[PRECIOS_FILE] = precio_con_historial
+
+def registrar_precio(item_id, fecha, precio):
+    store.insert_item(PRECIOS_HISTORIAL_FILE, {'id': uuid.uuid4().hex, 'item': item_id, 'fecha': fecha, 'precio': precio})
+
+def sincronizar_historial(item_id, price_history):
+    """Pasa al historial aparte lo que cambió en el price_history que mandó el
+    cliente (incluye lo que todavía estaba en línea en precios.json)."""
+    guardado = historial_de(item_id)
+    nuevo = {h.get('date'): h.get('price') for h in price_history or [] if h.get('date') and h.get('price') is not None}
+    for fecha, precio in nuevo.items():
+        if guardado.get(fecha) != precio:
+            registrar_precio(item_id, fecha, precio)
+    for fecha, precio in guardado.items():
+        if precio is not None and fecha not in nuevo:
+            registrar_precio(item_id, fecha, None)
+
+def precio_vigente(item, hasta):
+    """(fecha, precio) de la última entrada con fecha <= `hasta`, o (None, None)."""
+    vigentes = [(h['date'], h['price']) for h in precio_con_historial(item).get('price_history', []) if h['date'][:10] <= hasta]
+    return max(vigentes) if vigentes else (None, None)
+
+@app.cli.command('migrar-historial-precios')
+def migrar_historial_precios_command():
+    """Mueve el price_history en línea de precios.json al historial aparte."""
+    with store.lock:
+        store.begin()
+        try:
+            movidos = 0
+            for item in list(read_data(PRECIOS_FILE)):
+                if item.get('price_history') and item.get('id') is not None:
+                    sincronizar_historial(item['id'], item['price_history'])
+                    store.update_item(PRECIOS_FILE, item['id'], {'price_history': []})
+                    movidos += 1
+        finally:
+            store.end()
+    store.flush()
+    print(f"✅ Historial de {movidos} precios movido a {PRECIOS_HISTORIAL_FILE}")
+
 # --- Rutas para Lista de Precios ---
 @app.route('/api/data/precios', methods=['GET'])
 def get_precios():
-    return jsonify(read_data(PRECIOS_FILE)), 200
+    return query_collection(PRECIOS_FILE)
+
+@app.route('/api/data/precios/historial', methods=['GET'])
+def get_precios_historial():
+    # ?item=<id> (opcional), desde=AAAA-MM-DD, hasta=AAAA-MM-DD
+    item_id, desde, hasta = request.args.get('item'), request.args.get('desde'), request.args.get('hasta')
+    if item_id:
+        item = store.get_item(PRECIOS_FILE, item_id)
+        if item is None:
+            return jsonify({"error": "Ítem de precio no encontrado"}), 404
+        entradas = [{'item': item_id, 'fecha': h['date'], 'precio': h['price']} for h in precio_con_historial(item).get('price_history', [])]
+    else:
+        vigentes = {}
+        for entrada in read_data(PRECIOS_HISTORIAL_FILE):
+            vigentes[(entrada['item'], entrada['fecha'])] = entrada['precio']
+        entradas = [{'item': i, 'fecha': f, 'precio': p} for (i, f), p in sorted(vigentes.items(), key=lambda par: (par[0][1], par[0][0])) if p is not None]
+    entradas = [e for e in entradas if (not desde or e['fecha'][:10] >= desde) and (not hasta or e['fecha'][:10] <= hasta)]
+    return jsonify(entradas), 200
+
+@app.route('/api/data/precios/ajuste', methods=['POST'])
+def ajustar_precios():
+    # Reajuste masivo: {"padre_id": id} o {"ids": [...]}, con {"porcentaje": n}
+    # o {"monto": n}, y "fecha" (AAAA-MM-DD, por defecto el 1° del mes actual).
+    # Como en la pantalla, si el ítem ya tiene precio ese mes se reemplaza.
+    datos = request.json or {}
+    if ('padre_id' in datos) == ('ids' in datos):
+        return jsonify({"error": "Indique 'padre_id' o 'ids'."}), 400
+    if ('porcentaje' in datos) == ('monto' in datos):
+        return jsonify({"error": "Indique 'porcentaje' o 'monto'."}), 400
+    try:
+        valor = float(datos.get('porcentaje', datos.get('monto')))
+    except (ValueError, TypeError):
+        return jsonify({"error": "El porcentaje o monto debe ser un número."}), 400
+    fecha = datos.get('fecha') or datetime.date.today().replace(day=1).isoformat()
+    try:
+        dia = datetime.date.fromisoformat(fecha)
+    except ValueError:
+        return jsonify({"error": "Fecha inválida, use AAAA-MM-DD."}), 400
+    fin_de_mes = ((dia.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)).isoformat()
+
+    if 'padre_id' in datos:
+        if store.get_item(PRECIOS_FILE, datos['padre_id']) is None:
+            return jsonify({"error": "Ítem de precio no encontrado"}), 404
+        candidatos = subarbol(PRECIOS_FILE, datos['padre_id'])
+        omitidos = []
+    else:
+        ids = datos['ids']
+        if not isinstance(ids, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in ids):
+            return jsonify({"error": "'ids' debe ser una lista de ids."}), 400
+        candidatos, omitidos = [], []
+        for item_id in ids:
+            item = store.get_item(PRECIOS_FILE, item_id)
+            if item is None:
+                omitidos.append({'id': item_id, 'motivo': 'no existe'})
+            else:
+                candidatos.append(item)
+
+    actualizados = []
+    for item in candidatos:
+        if item.get('tipo') != 'item':
+            continue
+        fecha_actual, actual = precio_vigente(item, fin_de_mes)
+        try:
+            actual = float(actual)
+        except (ValueError, TypeError):
+            omitidos.append({'id': item.get('id'), 'motivo': 'sin precio'})
+            continue
+        nuevo = round(actual * (1 + valor / 100) if 'porcentaje' in datos else actual + valor, 2)
+        # Mismo mes: se pisa esa entrada; si no, se agrega con la fecha pedida
+        fecha_entrada = fecha_actual if fecha_actual and fecha_actual[:7] == fecha[:7] else fecha
+        actualizados.append((item, fecha_entrada, actual, nuevo))
+
+    # Todo el reajuste es una unidad: una sola escritura por colección y, si
+    # algo falla a mitad, no queda ningún precio cambiado
+    with store.atomic():
+        for item, fecha_entrada, actual, nuevo in actualizados:
+            registrar_precio(item['id'], fecha_entrada, nuevo)
+            store.touch_item(PRECIOS_FILE, item['id'])
+    return jsonify({
+        "actualizados": [{'id': item['id'], 'descripcion': item.get('descripcion'), 'fecha': f, 'anterior': a, 'nuevo': n}
+                         for item, f, a, n in actualizados],
+        "omitidos": omitidos,
+    }), 200
+
+@app.route('/api/data/precios/arbol', methods=['GET'])
+def get_precios_arbol():
+    return get_arbol(PRECIOS_FILE)
+
+@app.route('/api/data/precios/<item_id>/arbol', methods=['GET'])
+def get_precio_subarbol(item_id):
+    return get_arbol(PRECIOS_FILE, item_id, "Ítem de precio no encontrado")
+
+@app.route('/api/data/precios/<item_id>/mover', methods=['PUT'])
+def mover_precio_item(item_id):
+    return mover_item(PRECIOS_FILE, item_id, "Ítem de precio no encontrado")
+
+def crear_precio(new_item):
+    if 'id' not in new_item or not new_item['id']:
+        new_item['id'] = str(uuid.uuid4())
+    if 'price_history' in new_item:
+        sincronizar_historial(new_item['id'], new_item['price_history'])
+        new_item['price_history'] = []
+    store.insert_item(PRECIOS_FILE, new_item)
+    return precio_con_historial(new_item), 201
+
+def actualizar_precio(item_id, updated_data):
+    if store.get_item(PRECIOS_FILE, item_id) is None:
+        return {"error": "Ítem de precio no encontrado"}, 404
+    if 'price_history' in updated_data:
+        sincronizar_historial(item_id, updated_data['price_history'])
+        updated_data['price_history'] = []
+    item = store.update_item(PRECIOS_FILE, item_id, updated_data)
+    return precio_con_historial(item), 200
+
+def eliminar_precio(item_id):
+    if not borrar_subarbol(PRECIOS_FILE, item_id):
+        return {"error": "Ítem de precio no encontrado"}, 404
+    return {"message": "Ítem(s) de precio eliminado(s) exitosamente"}, 200
 
 @app.route('/api/data/precios', methods=['POST'])
 def add_precio_item():
-    new_item = request.json
-    if 'id' not in new_item or not new_item['id']:
-        new_item['id'] = str(uuid.uuid4())
-    precios = read_data(PRECIOS_FILE)
-    precios.append(new_item)
-    write_data(PRECIOS_FILE, precios)
-    return jsonify(new_item), 201
+    return responder(crear_precio(request.json))
 
 @app.route('/api/data/precios/<item_id>', methods=['PUT'])
 def update_precio_item(item_id):
-    updated_data = request.json
-    precios = read_data(PRECIOS_FILE)
-    item_found = False
-    for i, item in enumerate(precios):
-        if item.get('id') == item_id:
-            precios[i] = {**item, **updated_data}
-            item_found = True
-            break
-    if not item_found:
-        return jsonify({"error": "Ítem de precio no encontrado"}), 404
-    write_data(PRECIOS_FILE, precios)
-    return jsonify(precios[i]), 200
+    return responder(actualizar_precio(item_id, request.json))
 
 @app.route('/api/data/precios', methods=['PUT'])
 def update_all_precios():
     updated_list = request.json
+    for item in updated_list:
+        if item.get('price_history') is not None and item.get('id') is not None:
+            sincronizar_historial(item['id'], item['price_history'])
+            item['price_history'] = []
     write_data(PRECIOS_FILE, updated_list)
     return jsonify({"message": "Lista de precios actualizada exitosamente."}), 200
 
 @app.route('/api/data/precios/<item_id>', methods=['DELETE'])
 def delete_precio_item(item_id):
-    precios = read_data(PRECIOS_FILE)
-    ids_to_delete = set()
-    def collect_children_ids(parent_id):
-        ids_to_delete.add(parent_id)
-        for item in precios:
-            if item.get('padre_id') == parent_id and item.get('id') not in ids_to_delete:
-                collect_children_ids(item.get('id'))
-    item_found = any(item.get('id') == item_id for item in precios)
-    if not item_found:
-        return jsonify({"error": "Ítem de precio no encontrado"}), 404
-    collect_children_ids(item_id)
-    precios = [item for item in precios if item.get('id') not in ids_to_delete]
-    write_data(PRECIOS_FILE, precios)
-    return jsonify({"message": "Ítem(s) de precio eliminado(s) exitosamente"}), 200
+    return responder(eliminar_precio(item_id))
+
+# --- Motor de costos ---
+# Los costos derivados los calcula el servidor:
+#   ingrediente: costoPorUnidad = costoBase / cantidadBase
+#                costoRealPorHamburguesa = costoPorUnidad * usoPorHamburguesa
+#   hamburguesa: costoTotal = Σ costoPorUnidad del ingrediente * cantidad
+# Un índice inverso ingrediente → hamburguesas permite recalcular solo las
+# recetas afectadas cuando cambia un ingrediente.
+INGREDIENTE_CAMPOS_NUMERICOS = ('costoBase', 'cantidadBase', 'usoPorHamburguesa')
+
+def numero(valor):
+    try:
+        return float(valor or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+def calcular_ingrediente(ingrediente):
+    cantidad_base = numero(ingrediente.get('cantidadBase'))
+    costo_por_unidad = numero(ingrediente.get('costoBase')) / cantidad_base if cantidad_base else 0.0
+    ingrediente['costoPorUnidad'] = costo_por_unidad
+    ingrediente['costoRealPorHamburguesa'] = costo_por_unidad * numero(ingrediente.get('usoPorHamburguesa'))
+
+class CostEngine:
+    def __init__(self):
+        self._token = None
+        self._indexado = None
+        self._ingredientes = {}
+        self._por_nombre = {}
+        self._recetas = {}
+        self._recetas_por_ingrediente = {}
+
+    def _resolver(self, ref):
+        """Ingrediente base de una línea de receta: por id y, si no, por nombre."""
+        ingrediente = self._ingredientes.get(ref.get('id'))
+        if ingrediente is None:
+            ingrediente = self._por_nombre.get(str(ref.get('nombre', '')).lower())
+        return ingrediente
+
+    def _indexar(self, costos):
+        # Solo se reconstruye si la colección se reemplazó por fuera del motor
+        # o si se trata de otros costos
+        if self._indexado is not costos or self._token != store.generation(COSTOS_FILE):
+            self._reindexar(costos)
+
+    def _reindexar(self, costos):
+        self._indexado = costos
+        self._token = store.generation(COSTOS_FILE)
+        self._ingredientes = {i.get('id'): i for i in costos.get('ingredientes', []) if i.get('id') is not None}
+        self._por_nombre = {}
+        for ingrediente in costos.get('ingredientes', []):
+            # Con nombres repetidos vale el primero, como en una búsqueda lineal
+            self._por_nombre.setdefault(str(ingrediente.get('nombre', '')).lower(), ingrediente)
+        self._recetas = {h.get('id'): h for h in costos.get('hamburguesas', []) if h.get('id') is not None}
+        self._recetas_por_ingrediente = {}
+        for receta in costos.get('hamburguesas', []):
+            self._enlazar(receta)
+
+    def _enlazar(self, receta):
+        for ref in receta.get('ingredientes', []):
+            ingrediente = self._resolver(ref)
+            if ingrediente is not None:
+                self._recetas_por_ingrediente.setdefault(id(ingrediente), {})[id(receta)] = receta
+
+    def _desenlazar(self, receta):
+        for recetas in self._recetas_por_ingrediente.values():
+            recetas.pop(id(receta), None)
+
+    def costo_receta(self, costos, receta):
+        self._indexar(costos)
+        total = 0.0
+        for ref in receta.get('ingredientes', []):
+            ingrediente = self._resolver(ref)
+            if ingrediente is not None:
+                total += numero(ingrediente.get('costoPorUnidad')) * numero(ref.get('cantidad', 1))
+        return total
+
+    def _guardar(self, costos):
+        write_data(COSTOS_FILE, costos)
+        # La escritura es nuestra: el índice sigue valiendo
+        self._token = store.generation(COSTOS_FILE)
+
+    def guardar_todo(self, costos):
+        """Recalcula todos los costos derivados de `costos` y lo guarda."""
+        for ingrediente in costos.get('ingredientes', []):
+            calcular_ingrediente(ingrediente)
+        self._reindexar(costos)
+        for receta in costos.get('hamburguesas', []):
+            receta['costoTotal'] = self.costo_receta(costos, receta)
+        self._guardar(costos)
+
+    def actualizar_ingrediente(self, ingrediente_id, cambios):
+        """Aplica `cambios` al ingrediente y recalcula solo las recetas que lo
+        usan. Devuelve (ingrediente, recetas recalculadas) o (None, None).
+        Si el recálculo falla, el ingrediente y las recetas quedan como
+        estaban."""
+        costos = read_data(COSTOS_FILE)
+        self._indexar(costos)
+        ingrediente = self._ingredientes.get(ingrediente_id)
+        if ingrediente is None:
+            return None, None
+        renombrado = 'nombre' in cambios and cambios['nombre'] != ingrediente.get('nombre')
+        with store.atomic():
+            store.savepoint(COSTOS_FILE, ingrediente)
+            ingrediente.update(cambios)
+            ingrediente['id'] = ingrediente_id
+            calcular_ingrediente(ingrediente)
+            afectadas = dict(self._recetas_por_ingrediente.get(id(ingrediente), {}))
+            if renombrado:
+                # Las recetas que lo nombran sin id pueden cambiar de ingrediente:
+                # se recalculan las que lo usaban y las que lo usan ahora
+                self._reindexar(costos)
+                afectadas.update(self._recetas_por_ingrediente.get(id(ingrediente), {}))
+            afectadas = list(afectadas.values())
+            for receta in afectadas:
+                store.savepoint(COSTOS_FILE, receta)
+                receta['costoTotal'] = self.costo_receta(costos, receta)
+            self._guardar(costos)
+        return ingrediente, afectadas
+
+    def actualizar_receta(self, receta_id, cambios):
+        costos = read_data(COSTOS_FILE)
+        self._indexar(costos)
+        receta = self._recetas.get(receta_id)
+        if receta is None:
+            return None
+        with store.atomic():
+            store.savepoint(COSTOS_FILE, receta)
+            self._desenlazar(receta)
+            receta.update(cambios)
+            receta['id'] = receta_id
+            self._enlazar(receta)
+            receta['costoTotal'] = self.costo_receta(costos, receta)
+            self._guardar(costos)
+        return receta
+
+cost_engine = CostEngine()
+
+@app.cli.command('recalcular-costos')
+def recalcular_costos_command():
+    """Recalcula los costos derivados de ingredientes y hamburguesas en costos.json."""
+    with store.lock:
+        store.begin()
+        try:
+            costos = read_data(COSTOS_FILE)
+            antes = {h.get('id'): h.get('costoTotal') for h in costos.get('hamburguesas', [])}
+            cost_engine.guardar_todo(costos)
+            cambiadas = [h for h in costos.get('hamburguesas', []) if antes.get(h.get('id')) != h['costoTotal']]
+        finally:
+            store.end()
+    store.flush()
+    for h in cambiadas:
+        print(f"✅ {h.get('nombre')}: {antes.get(h.get('id'))} -> {h['costoTotal']}")
+    print(f"{len(cambiadas)} hamburguesas con costo actualizado.")
 
 # --- Rutas para Costos ---
 @app.route('/api/data/costos', methods=['GET'])
@@ -294,24 +3256,61 @@ def update_costos():
     costos_data = request.json
     if 'ingredientes' not in costos_data or 'hamburguesas' not in costos_data:
         return jsonify({"error": "El formato de datos de costos es inválido."}), 400
-    write_data(COSTOS_FILE, costos_data)
+    # Los costos derivados que mande el cliente se recalculan acá
+    cost_engine.guardar_todo(costos_data)
+    invalidar_plan_stock()
     return jsonify({"message": "Datos de costos actualizados exitosamente."}), 200
 
+@app.route('/api/data/costos/ingredientes/<ingrediente_id>', methods=['PATCH'])
+def patch_ingrediente(ingrediente_id):
+    cambios = request.json or {}
+    for campo in INGREDIENTE_CAMPOS_NUMERICOS:
+        if campo in cambios:
+            try:
+                cambios[campo] = float(cambios[campo])
+            except (ValueError, TypeError):
+                return jsonify({"error": f"{campo} debe ser un número."}), 400
+    ingrediente, recetas = cost_engine.actualizar_ingrediente(ingrediente_id, cambios)
+    if ingrediente is None:
+        return jsonify({"error": "Ingrediente no encontrado"}), 404
+    invalidar_plan_stock()
+    return jsonify({"ingrediente": ingrediente, "hamburguesas": recetas}), 200
+
+@app.route('/api/data/costos/hamburguesas/<receta_id>', methods=['PATCH'])
+def patch_hamburguesa(receta_id):
+    cambios = request.json or {}
+    if 'ingredientes' in cambios and not isinstance(cambios['ingredientes'], list):
+        return jsonify({"error": "ingredientes debe ser una lista."}), 400
+    receta = cost_engine.actualizar_receta(receta_id, cambios)
+    if receta is None:
+        return jsonify({"error": "Hamburguesa no encontrada"}), 404
+    invalidar_plan_stock()
+    return jsonify(receta), 200
+
 # --- Rutas para STOCK ---
 @app.route('/api/data/stock', methods=['GET'])
 def get_stock():
-    return jsonify(read_data(STOCK_FILE)), 200
+    return query_collection(STOCK_FILE)
 
-@app.route('/api/data/stock', methods=['POST'])
-def add_stock_item():
-    new_item = request.json
-    
+@app.route('/api/data/stock/arbol', methods=['GET'])
+def get_stock_arbol():
+    return get_arbol(STOCK_FILE)
+
+@app.route('/api/data/stock/<item_id>/arbol', methods=['GET'])
+def get_stock_subarbol(item_id):
+    return get_arbol(STOCK_FILE, item_id, "Ítem de stock no encontrado")
+
+@app.route('/api/data/stock/<item_id>/mover', methods=['PUT'])
+def mover_stock_item(item_id):
+    return mover_item(STOCK_FILE, item_id, "Ítem de stock no encontrado")
+
+def crear_stock(new_item):
     # Validaciones básicas
     if 'descripcion' not in new_item or 'tipo' not in new_item:
-        return jsonify({"error": "Descripción y tipo son obligatorios."}), 400
+        return {"error": "Descripción y tipo son obligatorios."}, 400
     
     if new_item['tipo'] == 'producto' and 'padre_id' not in new_item:
-         return jsonify({"error": "Un producto debe tener un título padre."}), 400
+         return {"error": "Un producto debe tener un título padre."}, 400
 
     new_item['id'] = str(uuid.uuid4())
     
@@ -320,37 +3319,41 @@ def add_stock_item():
         try:
             new_item['cantidad'] = float(new_item.get('cantidad', 0))
         except (ValueError, TypeError):
-             return jsonify({"error": "La cantidad debe ser un número."}), 400
+             return {"error": "La cantidad debe ser un número."}, 400
     
-    stock_data = read_data(STOCK_FILE)
-    stock_data.append(new_item)
-    write_data(STOCK_FILE, stock_data)
-    return jsonify(new_item), 201
+    store.insert_item(STOCK_FILE, new_item)
+    invalidar_plan_stock()
+    return new_item, 201
 
-@app.route('/api/data/stock/<item_id>', methods=['PUT'])
-def update_stock_item(item_id):
-    updated_data = request.json
-    stock_data = read_data(STOCK_FILE)
-    item_found = False
-    
+def actualizar_stock(item_id, updated_data):
     # Asegurarnos que cantidad sea un número si es un producto
     if updated_data.get('tipo') == 'producto':
         try:
             updated_data['cantidad'] = float(updated_data.get('cantidad', 0))
         except (ValueError, TypeError):
-             return jsonify({"error": "La cantidad debe ser un número."}), 400
+             return {"error": "La cantidad debe ser un número."}, 400
              
-    for i, item in enumerate(stock_data):
-        if item.get('id') == item_id:
-            # Actualiza el item, preservando el 'id' original
-            stock_data[i] = {**item, **updated_data, 'id': item_id}
-            item_found = True
-            break
-    if not item_found:
-        return jsonify({"error": "Ítem de stock no encontrado"}), 404
-    
-    write_data(STOCK_FILE, stock_data)
-    return jsonify(stock_data[i]), 200
+    # Actualiza el item, preservando el 'id' original
+    item = store.update_item(STOCK_FILE, item_id, updated_data, preserve_key=True)
+    if item is None:
+        return {"error": "Ítem de stock no encontrado"}, 404
+    invalidar_plan_stock()
+    return item, 200
+
+def eliminar_stock(item_id):
+    # Eliminar el item y todos sus descendientes
+    if not borrar_subarbol(STOCK_FILE, item_id):
+        return {"error": "Ítem de stock no encontrado"}, 404
+    invalidar_plan_stock()
+    return {"message": "Ítem(s) de stock eliminado(s) exitosamente"}, 200
+
+@app.route('/api/data/stock', methods=['POST'])
+def add_stock_item():
+    return responder(crear_stock(request.json))
+
+@app.route('/api/data/stock/<item_id>', methods=['PUT'])
+def update_stock_item(item_id):
+    return responder(actualizar_stock(item_id, request.json))
 
     # --- NUEVO: Dinero en Rappi y Banco ---
 @app.route('/api/data/rappi-banco', methods=['GET'])
@@ -368,156 +3371,257 @@ def update_rappi_banco():
 
 @app.route('/api/data/stock/<item_id>', methods=['DELETE'])
 def delete_stock_item(item_id):
-    stock_data = read_data(STOCK_FILE)
-    
-    ids_to_delete = set()
-    
-    # Función recursiva para encontrar el item y todos sus hijos
-    def collect_children_ids(parent_id):
-        ids_to_delete.add(parent_id)
-        for item in stock_data:
-            if item.get('padre_id') == parent_id and item.get('id') not in ids_to_delete:
-                collect_children_ids(item.get('id'))
-
-    item_found = any(item.get('id') == item_id for item in stock_data)
-    if not item_found:
-        return jsonify({"error": "Ítem de stock no encontrado"}), 404
-
-    # Iniciar la recolección desde el item seleccionado
-    collect_children_ids(item_id)
-    
-    # Filtrar la lista, quedándose solo con los items que NO están en el set de borrado
-    stock_data = [item for item in stock_data if item.get('id') not in ids_to_delete]
-    
-    write_data(STOCK_FILE, stock_data)
-    return jsonify({"message": "Ítem(s) de stock eliminado(s) exitosamente"}), 200
+    return responder(eliminar_stock(item_id))
 
 # --- Lógica para Clientes y Pedidos ---
 @app.route('/api/data/clientes', methods=['GET'])
 def get_clientes():
-    return jsonify(read_data(CLIENTES_FILE)), 200
+    return query_collection(CLIENTES_FILE)
 
 def manage_cliente_on_pedido_creation(pedido):
-    clientes = read_data(CLIENTES_FILE, default_value=[])
     direccion = pedido.get('direccion', '').strip()
     if not direccion:
         return
 
-    cliente_existente = next((c for c in clientes if c.get('direccion', '').strip().lower() == direccion.lower()), None)
+    cliente_existente = store.find_items(CLIENTES_FILE, 'direccion', normalizar_direccion(direccion))
     
     if not cliente_existente:
         nuevo_cliente = {
             'id': str(uuid.uuid4()),
-            'numero': len(clientes) + 1,
+            'numero': len(read_data(CLIENTES_FILE)) + 1,
             'direccion': direccion,
             'cantidad_pedidos': 0,
             'ultimo_pedido_fecha': None
         }
-        clientes.append(nuevo_cliente)
-        write_data(CLIENTES_FILE, clientes)
+        store.insert_item(CLIENTES_FILE, nuevo_cliente)
 
-def update_cliente_on_pedido_status_change(pedido):
-    clientes = read_data(CLIENTES_FILE, default_value=[])
-    direccion = pedido.get('direccion', '').strip()
+# --- Estadísticas de clientes ---
+# 'cantidad_pedidos' (pedidos entregados) y 'ultimo_pedido_fecha' de cada
+# cliente se ajustan por diferencia cada vez que un pedido se crea, cambia o
+# se borra, en lugar de recorrer todos los pedidos. Solo cuando se quita el
+# pedido más reciente de un cliente se buscan los demás pedidos de esa
+# dirección (índice por dirección normalizada). `flask --app main
+# recalcular-clientes` compara los contadores con un recálculo completo.
+def aporte_cliente(pedido):
+    """(dirección normalizada, fecha de entrega) con que el pedido cuenta para su cliente, o None."""
+    if not pedido or pedido.get('estado') != 'entregado':
+        return None
+    direccion = normalizar_direccion(pedido.get('direccion'))
     if not direccion:
+        return None
+    return direccion, pedido.get('fecha_entrega') or ''
+
+def actualizar_estadisticas_cliente(antes, despues):
+    """Refleja en el cliente que un pedido pasó de `antes` a `despues`
+    (None = no existía / ya no existe). Se llama con el pedido ya guardado."""
+    quita, suma = aporte_cliente(antes), aporte_cliente(despues)
+    if quita == suma:
         return
+    if quita:
+        ajustar_cliente(quita[0], -1, quita[1])
+    if suma:
+        ajustar_cliente(suma[0], 1, suma[1])
 
-    cliente_idx = -1
-    for i, c in enumerate(clientes):
-        if c.get('direccion', '').strip().lower() == direccion.lower():
-            cliente_idx = i
-            break
+def ajustar_cliente(direccion, signo, fecha):
+    clientes = store.find_items(CLIENTES_FILE, 'direccion', direccion)
+    if not clientes:
+        return
+    cliente = clientes[0]
+    cantidad = max(int(cliente.get('cantidad_pedidos') or 0) + signo, 0)
+    ultimo = cliente.get('ultimo_pedido_fecha')
+    if cantidad == 0:
+        ultimo = None
+    elif signo > 0:
+        if ultimo is None or fecha > ultimo:
+            ultimo = fecha or None
+    elif fecha == (ultimo or ''):
+        ultimo = ultima_entrega(direccion)
+    if cantidad != cliente.get('cantidad_pedidos') or ultimo != cliente.get('ultimo_pedido_fecha'):
+        store.update_item(CLIENTES_FILE, cliente['id'], {'cantidad_pedidos': cantidad, 'ultimo_pedido_fecha': ultimo})
 
-    if cliente_idx != -1:
-        pedidos = read_data(PEDIDOS_FILE)
-        pedidos_cliente = [p for p in pedidos if p.get('direccion', '').strip().lower() == direccion.lower() and p.get('estado') == 'entregado']
-        
-        clientes[cliente_idx]['cantidad_pedidos'] = len(pedidos_cliente)
-        
-        if pedidos_cliente:
-            latest_pedido = max(pedidos_cliente, key=lambda p: p.get('fecha_entrega', ''))
-            clientes[cliente_idx]['ultimo_pedido_fecha'] = latest_pedido.get('fecha_entrega')
-        else:
-            clientes[cliente_idx]['ultimo_pedido_fecha'] = None
+def ultima_entrega(direccion):
+    fechas = [p.get('fecha_entrega') or '' for p in store.find_items(PEDIDOS_FILE, 'direccion', direccion)
+              if p.get('estado') == 'entregado']
+    # Los meses archivados se consultan por su resumen, sin abrirlos
+    for resumen in archivo_mensual.resumenes(PEDIDOS_FILE).values():
+        if direccion in resumen['clientes']:
+            fechas.append(resumen['clientes'][direccion]['ultima_entrega'])
+    return (max(fechas) or None) if fechas else None
 
-        write_data(CLIENTES_FILE, clientes)
+def calcular_estadisticas_clientes():
+    """Recálculo completo: dirección normalizada → (cantidad_pedidos, ultimo_pedido_fecha)."""
+    estadisticas = {}
+    for resumen in archivo_mensual.resumenes(PEDIDOS_FILE).values():
+        for direccion, cliente in resumen['clientes'].items():
+            cantidad, ultimo = estadisticas.get(direccion, (0, ''))
+            estadisticas[direccion] = (cantidad + cliente['cantidad'], max(ultimo, cliente['ultima_entrega']))
+    for pedido in read_data(PEDIDOS_FILE):
+        aporte = aporte_cliente(pedido)
+        if aporte is None:
+            continue
+        direccion, fecha = aporte
+        cantidad, ultimo = estadisticas.get(direccion, (0, ''))
+        estadisticas[direccion] = (cantidad + 1, max(ultimo, fecha))
+    return {d: (cantidad, ultimo or None) for d, (cantidad, ultimo) in estadisticas.items()}
 
-def modificar_stock_por_pedido(pedido, multiplicador):
-    """
-    Actualiza (descuenta o repone) el stock basado en los items de un pedido.
-    multiplicador = -1 para descontar (venta nueva)
-    multiplicador = +1 para reponer (venta eliminada)
-    """
-    # 1. Cargar los datos más recientes
-    stock_data = read_data(STOCK_FILE)
-    costos_data = read_data(COSTOS_FILE)
-    
-    # 2. Crear mapas para búsqueda rápida (convertir a minúsculas para evitar errores)
+@app.cli.command('recalcular-clientes')
+@click.option('--solo-verificar', is_flag=True, help='Informa las diferencias sin corregirlas.')
+def recalcular_clientes_command(solo_verificar):
+    """Verifica (y corrige) los contadores de pedidos de cada cliente contra todos los pedidos."""
+    with store.lock:
+        store.begin()
+        try:
+            estadisticas = calcular_estadisticas_clientes()
+            vistos = set()
+            diferencias = 0
+            for cliente in list(read_data(CLIENTES_FILE)):
+                direccion = normalizar_direccion(cliente.get('direccion'))
+                if not direccion or direccion in vistos:
+                    continue
+                vistos.add(direccion)
+                cantidad, ultimo = estadisticas.get(direccion, (0, None))
+                if (cliente.get('cantidad_pedidos'), cliente.get('ultimo_pedido_fecha')) == (cantidad, ultimo):
+                    continue
+                diferencias += 1
+                print(f"❌ {cliente.get('direccion')}: guardado {cliente.get('cantidad_pedidos')} / "
+                      f"{cliente.get('ultimo_pedido_fecha')}, calculado {cantidad} / {ultimo}")
+                if not solo_verificar:
+                    store.update_item(CLIENTES_FILE, cliente['id'], {'cantidad_pedidos': cantidad, 'ultimo_pedido_fecha': ultimo})
+        finally:
+            store.end()
+    store.flush()
+    if not diferencias:
+        print("✅ Los contadores de todos los clientes coinciden con los pedidos.")
+    elif solo_verificar:
+        print(f"{diferencias} clientes con contadores distintos.")
+    else:
+        print(f"✅ {diferencias} clientes corregidos.")
+
+# --- Plan de descuento de stock ---
+# Qué stock mueve cada item vendido se compila una vez a partir del stock y
+# del recetario: nombre vendido (minúsculas) → [(id de stock, cantidad por
+# unidad)]. Una hamburguesa descuenta el 'usoPorHamburguesa' de cada
+# ingrediente de su receta; un item que está en el stock se descuenta tal
+# cual; cualquier otro (ej. "Delivery") no mueve stock. El plan se vuelve a
+# compilar cuando cambian los costos o la estructura del stock (altas, bajas,
+# ediciones) o cuando alguna de las dos colecciones se recarga entera.
+class StockPlanCache:
+    def __init__(self):
+        self._plan = None
+        self._token = None
+        self._estructura = 0
+
+    def invalidate(self):
+        self._estructura += 1
+
+    def get(self):
+        stock_data = read_data(STOCK_FILE)
+        costos_data = read_data(COSTOS_FILE)
+        token = (store.generation(STOCK_FILE), store.generation(COSTOS_FILE), self._estructura)
+        if self._plan is None or token != self._token:
+            self._plan = compilar_plan_stock(stock_data, costos_data)
+            self._token = token
+        return self._plan
+
+def compilar_plan_stock(stock_data, costos_data):
+    # Mismas reglas de búsqueda que antes: por nombre en minúsculas y, ante
+    # nombres repetidos, gana el último
     stock_map = {str(item.get('descripcion', '')).lower(): item for item in stock_data}
     recetas_map = {str(h.get('nombre', '')).lower(): h for h in costos_data.get('hamburguesas', [])}
     ingredientes_base_map = {str(i.get('nombre', '')).lower(): i for i in costos_data.get('ingredientes', [])}
 
-    # 3. Recorrer cada item del pedido
+    plan = {}
+    sin_base, sin_stock, uso_invalido = set(), set(), set()
+    for nombre_receta, receta in recetas_map.items():
+        pasos = []
+        for ingrediente_en_receta in receta.get('ingredientes', []):
+            nombre_ingrediente_receta = str(ingrediente_en_receta.get('nombre', '')).lower()
+            ingrediente_base = ingredientes_base_map.get(nombre_ingrediente_receta)
+            if not ingrediente_base:
+                sin_base.add(nombre_ingrediente_receta)
+                continue
+            # Asumimos que el nombre del ingrediente base ES el que está en el stock
+            nombre_ingrediente_stock = str(ingrediente_base.get('nombre', '')).lower()
+            item_stock = stock_map.get(nombre_ingrediente_stock)
+            if item_stock is None:
+                sin_stock.add(nombre_ingrediente_stock)
+                continue
+            try:
+                pasos.append((item_stock.get('id'), float(ingrediente_base.get('usoPorHamburguesa', 0))))
+            except (ValueError, TypeError):
+                uso_invalido.add(nombre_ingrediente_stock)
+        plan[nombre_receta] = pasos
+    for nombre, item_stock in stock_map.items():
+        plan.setdefault(nombre, [(item_stock.get('id'), 1.0)])
+    # Se avisa una vez por compilación, no en cada pedido
+    metrics.inc('stock_plan_compilations_total')
+    metrics.set('stock_plan_missing_ingredients', len(sin_base), reason='sin_ingrediente_base')
+    metrics.set('stock_plan_missing_ingredients', len(sin_stock), reason='sin_stock')
+    metrics.set('stock_plan_missing_ingredients', len(uso_invalido), reason='uso_invalido')
+    if uso_invalido:
+        print(f"Error al calcular stock para ingrediente: {', '.join(sorted(uso_invalido))}")
+    if sin_base:
+        print(f"Advertencia: Ingredientes de receta no encontrados en COSTOS (ingredientes base): {', '.join(sorted(sin_base))}")
+    if sin_stock:
+        print(f"Advertencia: Ingredientes de receta no encontrados en STOCK: {', '.join(sorted(sin_stock))}")
+    return plan
+
+stock_plan = StockPlanCache()
+
+def invalidar_plan_stock():
+    stock_plan.invalidate()
+
+def acumular_delta_stock(delta, pedido, multiplicador):
+    """Suma en `delta` (id de stock → cantidad) lo que mueve el pedido.
+    multiplicador = -1 para descontar (venta nueva)
+    multiplicador = +1 para reponer (venta eliminada)
+    """
+    plan = stock_plan.get()
     for item_vendido in pedido.get('items', []):
         try:
             # Normalizar nombre y cantidad
             nombre_item_vendido = str(item_vendido.get('descripcion', '')).lower()
             cantidad_vendida = float(item_vendido.get('cantidad', 1))
         except (ValueError, TypeError):
-            print(f"Error al procesar item: {item_vendido}")
+            metrics.inc('stock_deduction_skipped_total', reason='cantidad_invalida')
             continue # Saltar este item si la cantidad no es válida
+        for stock_id, por_unidad in plan.get(nombre_item_vendido, ()):
+            delta[stock_id] = delta.get(stock_id, 0) + por_unidad * cantidad_vendida * multiplicador
+    return delta
 
-        # 4. PRIMERA VERIFICACIÓN: ¿Es una hamburguesa (está en el recetario)?
-        if nombre_item_vendido in recetas_map:
-            hamburguesa_receta = recetas_map[nombre_item_vendido]
-            
-            # Si es una hamburguesa, revisamos cada uno de sus ingredientes
-            for ingrediente_en_receta in hamburguesa_receta.get('ingredientes', []):
-                # El 'nombre' en la receta de la hamburguesa (ej. 'Carne')
-                nombre_ingrediente_receta = str(ingrediente_en_receta.get('nombre', '')).lower()
-                
-                # Buscamos la definición base de ese ingrediente (para saber su 'usoPorHamburguesa')
-                ingrediente_base = ingredientes_base_map.get(nombre_ingrediente_receta)
-                
-                if ingrediente_base:
-                    # El 'nombre' del ingrediente base (ej. 'Carne Picada')
-                    # Asumimos que el nombre del ingrediente base ES el que está en el stock
-                    nombre_ingrediente_stock = str(ingrediente_base.get('nombre', '')).lower()
-                    
-                    # Verificamos si este ingrediente existe en nuestra despensa (Stock)
-                    if nombre_ingrediente_stock in stock_map:
-                        try:
-                            # Calculamos cuánto modificar
-                            uso_por_hamburguesa = float(ingrediente_base.get('usoPorHamburguesa', 0))
-                            cantidad_a_modificar = (uso_por_hamburguesa * cantidad_vendida) * multiplicador
-                            
-                            # Actualizamos la cantidad en el stock
-                            stock_map[nombre_ingrediente_stock]['cantidad'] = float(stock_map[nombre_ingrediente_stock].get('cantidad', 0)) + cantidad_a_modificar
-                        except (ValueError, TypeError):
-                            print(f"Error al calcular stock para ingrediente: {nombre_ingrediente_stock}")
-                    else:
-                        print(f"Advertencia: Ingrediente '{nombre_ingrediente_stock}' de receta no encontrado en STOCK.")
-                else:
-                    print(f"Advertencia: Ingrediente '{nombre_ingrediente_receta}' de receta no encontrado en COSTOS (ingredientes base).")
+def aplicar_delta_stock(delta):
+    """Aplica de una vez el movimiento acumulado; un solo cambio por item de stock."""
+    for stock_id, cantidad in delta.items():
+        if not cantidad:
+            continue
+        if stock_id is None:
+            # Item sin id: no se puede guardar suelto
+            metrics.inc('stock_deduction_skipped_total', reason='stock_sin_id')
+            continue
+        item = store.get_item(STOCK_FILE, stock_id)
+        if item is None:
+            metrics.inc('stock_deduction_skipped_total', reason='stock_inexistente')
+            continue
+        try:
+            store.update_item(STOCK_FILE, stock_id, {'cantidad': float(item.get('cantidad', 0)) + cantidad})
+        except (ValueError, TypeError):
+            metrics.inc('stock_deduction_skipped_total', reason='cantidad_stock_invalida')
 
-        # 5. SEGUNDA VERIFICACIÓN: ¿Es un item directo del stock (ej. Coca-Cola)?
-        elif nombre_item_vendido in stock_map:
-            try:
-                # Descontamos o reponemos la cantidad vendida directamente
-                cantidad_a_modificar = cantidad_vendida * multiplicador
-                stock_map[nombre_item_vendido]['cantidad'] = float(stock_map[nombre_item_vendido].get('cantidad', 0)) + cantidad_a_modificar
-            except (ValueError, TypeError):
-                print(f"Error al calcular stock para item directo: {nombre_item_vendido}")
-        
-        # 6. Si no es hamburguesa ni item de stock, no hacemos nada (ej. "Delivery")
-        else:
-            print(f"Info: Item '{nombre_item_vendido}' no afecta stock (no es receta ni item de stock).")
-            
-    # 7. Finalmente, guardamos todos los cambios en nuestro archivo de stock
-    write_data(STOCK_FILE, list(stock_map.values()))
+def modificar_stock_por_pedido(pedido, multiplicador):
+    """
+    Actualiza (descuenta o repone) el stock basado en los items de un pedido.
+    multiplicador = -1 para descontar (venta nueva)
+    multiplicador = +1 para reponer (venta eliminada)
+    """
+    aplicar_delta_stock(acumular_delta_stock({}, pedido, multiplicador))
+
+@app.route('/api/data/pedidos', methods=['GET'])
+def get_pedidos():
+    return query_collection(PEDIDOS_FILE)
 
 @app.route('/api/data/pedidos', methods=['POST'])
 def add_pedido():
+    desde = store.revision
     new_pedido = request.json
     new_pedido['id'] = str(uuid.uuid4())
     
@@ -530,71 +3634,63 @@ def add_pedido():
     new_pedido['fecha_entrega'] = now
     # --- MODIFICACIÓN FIN ---
 
-    pedidos = read_data(PEDIDOS_FILE)
-    pedidos.append(new_pedido)
-    write_data(PEDIDOS_FILE, pedidos)
+    store.insert_item(PEDIDOS_FILE, new_pedido)
     
     # --- MODIFICACIÓN INICIO ---
     # Llamamos a las funciones para actualizar el stock y los datos del cliente
     # inmediatamente después de crear el pedido.
     modificar_stock_por_pedido(new_pedido, multiplicador=-1) # <-- CAMBIO AQUÍ
     manage_cliente_on_pedido_creation(new_pedido)
-    update_cliente_on_pedido_status_change(new_pedido)
+    actualizar_estadisticas_cliente(None, new_pedido)
     # --- MODIFICACIÓN FIN ---
+    publicar_pedido('crear', new_pedido, desde)
 
     return jsonify(new_pedido), 201
 
 
 @app.route('/api/data/pedidos/<pedido_id>', methods=['PUT'])
 def update_pedido(pedido_id):
+    desde = store.revision
     updated_data = request.json
-    pedidos = read_data(PEDIDOS_FILE)
-    item_found = False
-    original_pedido = None
+    item = store.get_item(PEDIDOS_FILE, pedido_id)
+    if item is None:
+        return jsonify({"error": "Pedido no encontrado"}), 404
+
+    original_pedido = item.copy() # Guardar el estado del pedido antes de modificarlo
+    
+    # --- INICIO: NUEVA LÓGICA DE STOCK (EDITAR) ---
+    # 1. Reponemos el stock del pedido original (tal como estaba ANTES de editar)
+    delta_stock = acumular_delta_stock({}, original_pedido, multiplicador=1)
+    # --- FIN: NUEVA LÓGICA ---
     
-    for i, item in enumerate(pedidos):
-        if item.get('id') == pedido_id:
-            original_pedido = item.copy() # Guardar el estado del pedido antes de modificarlo
-            
-            # --- INICIO: NUEVA LÓGICA DE STOCK (EDITAR) ---
-            # 1. Reponemos el stock del pedido original (tal como estaba ANTES de editar)
-            modificar_stock_por_pedido(original_pedido, multiplicador=1)
-            # --- FIN: NUEVA LÓGICA ---
-            
-            # Asignar fecha de entrega si se está marcando como 'entregado'
-            if updated_data.get('estado') == 'entregado' and not item.get('fecha_entrega'):
-                updated_data['fecha_entrega'] = datetime.datetime.now().isoformat()
-            elif updated_data.get('estado') == 'pendiente':
-                updated_data['fecha_entrega'] = None
-
-            # Aplicar los cambios al pedido
-            pedidos[i].update(updated_data)
-            item_found = True
-            
-            # --- INICIO: NUEVA LÓGICA DE STOCK (EDITAR) ---
-            # 2. Descontamos el stock del pedido actualizado (con los items NUEVOS)
-            modificar_stock_por_pedido(pedidos[i], multiplicador=-1)
-            # --- FIN: NUEVA LÓGICA DE STOCK ---
-            
-            # Lógica existente para actualizar datos del cliente
-            if original_pedido.get('estado') != pedidos[i].get('estado'):
-                update_cliente_on_pedido_status_change(pedidos[i])
-            
-            if original_pedido.get('direccion') != pedidos[i].get('direccion'):
-                manage_cliente_on_pedido_creation(pedidos[i])
+    # Asignar fecha de entrega si se está marcando como 'entregado'
+    if updated_data.get('estado') == 'entregado' and not item.get('fecha_entrega'):
+        updated_data['fecha_entrega'] = datetime.datetime.now().isoformat()
+    elif updated_data.get('estado') == 'pendiente':
+        updated_data['fecha_entrega'] = None
 
-            break
-            
-    if not item_found:
-        return jsonify({"error": "Pedido no encontrado"}), 404
-        
-    write_data(PEDIDOS_FILE, pedidos)
-    return jsonify(pedidos[i]), 200
+    # Aplicar los cambios al pedido
+    pedido = store.update_item(PEDIDOS_FILE, pedido_id, updated_data)
+    
+    # --- INICIO: NUEVA LÓGICA DE STOCK (EDITAR) ---
+    # 2. Descontamos el stock del pedido actualizado (con los items NUEVOS).
+    # Reposición y descuento se netean: cada item de stock se guarda una vez
+    # y, si los items no cambiaron, no se escribe nada
+    acumular_delta_stock(delta_stock, pedido, multiplicador=-1)
+    aplicar_delta_stock(delta_stock)
+    # --- FIN: NUEVA LÓGICA DE STOCK ---
+    
+    # Lógica existente para actualizar datos del cliente
+    if original_pedido.get('direccion') != pedido.get('direccion'):
+        manage_cliente_on_pedido_creation(pedido)
+    actualizar_estadisticas_cliente(original_pedido, pedido)
+    publicar_pedido('actualizar', pedido, desde)
+
+    return jsonify(pedido), 200
 @app.route('/api/data/pedidos/<pedido_id>', methods=['DELETE'])
 def delete_pedido(pedido_id):
-    pedidos = read_data(PEDIDOS_FILE)
-    
-    pedido_a_eliminar = next((p for p in pedidos if p.get('id') == pedido_id), None)
+    desde = store.revision
+    pedido_a_eliminar = store.get_item(PEDIDOS_FILE, pedido_id)
     if not pedido_a_eliminar:
         return jsonify({"error": "Pedido no encontrado"}), 404
 
@@ -603,12 +3699,11 @@ def delete_pedido(pedido_id):
     modificar_stock_por_pedido(pedido_a_eliminar, multiplicador=1) # <-- AGREGAMOS ESTA LÍNEA
     # --- FIN: NUEVA LÓGICA DE STOCK ---
 
-    pedidos_actualizados = [item for item in pedidos if item.get('id') != pedido_id]
-    
-    write_data(PEDIDOS_FILE, pedidos_actualizados)
+    store.delete_items(PEDIDOS_FILE, [pedido_id])
     
-    # Actualizar datos del cliente por si acaso
-    update_cliente_on_pedido_status_change(pedido_a_eliminar)
+    # Actualizar datos del cliente
+    actualizar_estadisticas_cliente(pedido_a_eliminar, None)
+    publicar_pedido('eliminar', {'id': pedido_id}, desde)
 
     return jsonify({"message": "Pedido eliminado exitosamente"}), 200
 
@@ -616,54 +3711,743 @@ def delete_pedido(pedido_id):
 
 @app.route('/api/data/vencimientos', methods=['GET'])
 def get_vencimientos():
-    return jsonify(read_data(VENCIMIENTOS_FILE)), 200
+    return query_collection(VENCIMIENTOS_FILE)
 
-@app.route('/api/data/vencimientos', methods=['POST'])
-def add_vencimiento_item():
-    new_item = request.json
+@app.route('/api/data/vencimientos/arbol', methods=['GET'])
+def get_vencimientos_arbol():
+    return get_arbol(VENCIMIENTOS_FILE)
+
+@app.route('/api/data/vencimientos/<item_id>/arbol', methods=['GET'])
+def get_vencimiento_subarbol(item_id):
+    return get_arbol(VENCIMIENTOS_FILE, item_id, "Ítem de vencimiento no encontrado")
+
+@app.route('/api/data/vencimientos/<item_id>/mover', methods=['PUT'])
+def mover_vencimiento_item(item_id):
+    return mover_item(VENCIMIENTOS_FILE, item_id, "Ítem de vencimiento no encontrado")
+
+def crear_vencimiento(new_item):
     if 'id' not in new_item or not new_item['id']:
         new_item['id'] = str(uuid.uuid4())
     
-    data = read_data(VENCIMIENTOS_FILE)
-    data.append(new_item)
-    write_data(VENCIMIENTOS_FILE, data)
-    return jsonify(new_item), 201
+    store.insert_item(VENCIMIENTOS_FILE, new_item)
+    agenda_vencimientos.vencimiento_cambiado(new_item)
+    return new_item, 201
+
+def actualizar_vencimiento(item_id, updated_data):
+    item = store.update_item(VENCIMIENTOS_FILE, item_id, updated_data)
+    if item is None:
+        return {"error": "Ítem de vencimiento no encontrado"}, 404
+    agenda_vencimientos.vencimiento_cambiado(item, item_id)
+    return item, 200
+
+def eliminar_vencimiento(item_id):
+    ids = [item.get('id') for item in subarbol(VENCIMIENTOS_FILE, item_id)]
+    if not store.delete_items(VENCIMIENTOS_FILE, ids):
+        return {"error": "Ítem de vencimiento no encontrado"}, 404
+    agenda_vencimientos.vencimientos_eliminados(ids)
+    return {"message": "Ítem(s) de vencimiento eliminado(s) exitosamente"}, 200
+
+@app.route('/api/data/vencimientos', methods=['POST'])
+def add_vencimiento_item():
+    return responder(crear_vencimiento(request.json))
 
 @app.route('/api/data/vencimientos/<item_id>', methods=['PUT'])
 def update_vencimiento_item(item_id):
-    updated_data = request.json
-    data = read_data(VENCIMIENTOS_FILE)
-    item_found = False
-    for i, item in enumerate(data):
-        if item.get('id') == item_id:
-            data[i] = {**item, **updated_data}
-            item_found = True
-            break
-    if not item_found:
-        return jsonify({"error": "Ítem de vencimiento no encontrado"}), 404
-    write_data(VENCIMIENTOS_FILE, data)
-    return jsonify(data[i]), 200
+    return responder(actualizar_vencimiento(item_id, request.json))
 
 @app.route('/api/data/vencimientos/<item_id>', methods=['DELETE'])
 def delete_vencimiento_item(item_id):
-    data = read_data(VENCIMIENTOS_FILE)
-    
-    ids_to_delete = set()
-    def collect_children_ids(parent_id):
-        ids_to_delete.add(parent_id)
-        for item in data:
-            if item.get('padre_id') == parent_id and item.get('id') not in ids_to_delete:
-                collect_children_ids(item.get('id'))
-
-    item_found = any(item.get('id') == item_id for item in data)
-    if not item_found:
-        return jsonify({"error": "Ítem de vencimiento no encontrado"}), 404
-        
-    collect_children_ids(item_id)
-    data = [item for item in data if item.get('id') not in ids_to_delete]
-    
-    write_data(VENCIMIENTOS_FILE, data)
-    return jsonify({"message": "Ítem(s) de vencimiento eliminado(s) exitosamente"}), 200
+    return responder(eliminar_vencimiento(item_id))
+
+# --- Próximos vencimientos ---
+# GET /api/data/vencimientos/upcoming?days=N devuelve, ordenado por fecha, lo
+# que vence entre hoy (o ?desde=AAAA-MM-DD) y N días después (7 por defecto):
+#   [{"fecha": "AAAA-MM-DD", "tipo": "vencimiento", "item": {...}},
+#    {"fecha": "AAAA-MM-DD", "tipo": "gasto", "anio": "2026", "mes": "Marzo", "item": {...}}]
+# Los gastos no tienen fecha de vencimiento propia: un gasto impago vence el
+# último día de su mes, salvo que traiga un campo 'vencimiento'.
+#
+# La agenda guarda las fechas de los ítems de vencimientos.json y de los
+# gastos impagos de los meses guardados (lo que vence de hoy en adelante, en un
+# heap); las rutas que los modifican la actualizan en el momento, y se rearma
+# entera si alguna de las dos colecciones se reemplaza (escritura completa,
+# recarga o rollback).
+# Los meses que no están en gastos.json se proyectan de las reglas recurrentes
+# al consultar: son pocos dentro de la ventana pedida.
+UPCOMING_DEFAULT_DAYS = 7
+UPCOMING_MAX_DAYS = 366
+
+def fecha_iso(texto):
+    """'AAAA-MM-DD' de una fecha ISO o DD/MM/AAAA; None si no se entiende."""
+    texto = str(texto or '')[:10]
+    try:
+        return datetime.datetime.strptime(texto, '%d/%m/%Y' if '/' in texto else '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return None
+
+def fin_de_mes(ym):
+    dia = datetime.date(int(ym[:4]), int(ym[5:]), 28)
+    return ((dia + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)).isoformat()
+
+def vence_gasto(gasto, ym):
+    """Fecha en que vence un gasto impago del mes `ym`; None si está pagado."""
+    if str(gasto.get('pagado', 'no')).lower() == 'si':
+        return None
+    return fecha_iso(gasto.get('vencimiento')) or fin_de_mes(ym)
+
+class AgendaVencimientos:
+    """Fechas de vencimiento de los ítems y de los gastos impagos.
+
+    Lo que vence de hoy en adelante está en un heap de (fecha, n, clave); a
+    medida que pasan los días lo vencido sale del heap en orden y se agrega al
+    final de una lista, que queda ordenada para las consultas con ?desde= en
+    el pasado. Un cambio no busca la entrada anterior: agrega una nueva y la
+    vieja queda obsoleta (_vigentes dice cuál vale para cada clave). Cuando
+    las obsoletas superan a las vigentes se rearman el heap y la lista.
+    """
+
+    def __init__(self):
+        self._token = None
+        self._heap = []
+        self._pasados = []        # vencidas antes de _hoy, ordenadas
+        self._hoy = ''
+        self._vigentes = {}       # clave → (fecha, n) de su entrada vigente
+        self._meses = {}          # (año, mes) → claves de sus gastos
+        self._obsoletas = 0
+        self._contador = itertools.count()
+        # Las consultas corren en paralelo (store.shared); los avisos de
+        # cambios llegan desde store.exclusive, sin consultas en curso
+        self._lock = threading.Lock()
+
+    def _vigente(self):
+        return (store.generation(VENCIMIENTOS_FILE), store.generation(GASTOS_FILE))
+
+    def _sincronizar(self):
+        read_data(VENCIMIENTOS_FILE)  # revalidan la colección si otro proceso la cambió
+        read_data(GASTOS_FILE)
+        if self._token != self._vigente():
+            self._reconstruir()
+
+    def _reconstruir(self):
+        self._vigentes, self._meses = {}, {}
+        for item in read_data(VENCIMIENTOS_FILE):
+            fecha = fecha_iso(item.get('vencimiento'))
+            if fecha is not None and item.get('id') is not None:
+                self._vigentes[('vencimiento', item['id'])] = (fecha, next(self._contador))
+        for year, meses in read_data(GASTOS_FILE).items():
+            for month in meses:
+                self._meses[(year, month)] = claves = []
+                for clave, fecha in self._gastos_mes(year, month):
+                    self._vigentes[clave] = (fecha, next(self._contador))
+                    claves.append(clave)
+        self._rearmar(datetime.date.today().isoformat())
+        self._token = self._vigente()
+
+    def _rearmar(self, hoy):
+        entradas = [(fecha, n, clave) for clave, (fecha, n) in self._vigentes.items()]
+        self._pasados = sorted(e for e in entradas if e[0] < hoy)
+        self._heap = [e for e in entradas if e[0] >= hoy]
+        heapq.heapify(self._heap)
+        self._hoy, self._obsoletas = hoy, 0
+
+    def _gastos_mes(self, year, month):
+        ym = year_month(year, month)
+        if ym is None:
+            return []
+        items = read_data(GASTOS_FILE).get(year, {}).get(month, [])
+        return [(('gasto', year, month, i), fecha) for i, fecha in
+                ((i, vence_gasto(gasto, ym)) for i, gasto in enumerate(items)) if fecha is not None]
+
+    def _valida(self, entrada):
+        return self._vigentes.get(entrada[2]) == entrada[:2]
+
+    def _poner(self, clave, fecha):
+        """Nueva fecha de `clave` (None: ya no vence)."""
+        if self._vigentes.pop(clave, None) is not None:
+            self._obsoletas += 1
+        if fecha is not None:
+            entrada = (fecha, next(self._contador), clave)
+            self._vigentes[clave] = entrada[:2]
+            if fecha < self._hoy:
+                bisect.insort(self._pasados, entrada)  # un vencimiento pasado: es raro
+            else:
+                heapq.heappush(self._heap, entrada)
+        if self._obsoletas > len(self._vigentes):
+            self._rearmar(self._hoy)
+
+    def _avanzar(self, hoy):
+        # Lo que venció desde la última consulta pasa del heap a _pasados
+        if hoy <= self._hoy:
+            return
+        while self._heap and self._heap[0][0] < hoy:
+            entrada = heapq.heappop(self._heap)
+            if self._valida(entrada):
+                self._pasados.append(entrada)
+            else:
+                self._obsoletas -= 1
+        self._hoy = hoy
+
+    # Las rutas avisan sus cambios; si la agenda todavía no se armó no hay
+    # nada que actualizar
+    def vencimiento_cambiado(self, item, item_id=None):
+        """`item_id`: la clave que tenía el ítem, si la modificación la cambió."""
+        if self._token is None:
+            return
+        if item_id is not None and item_id != item.get('id'):
+            self._poner(('vencimiento', item_id), None)
+        if item.get('id') is not None:
+            self._poner(('vencimiento', item['id']), fecha_iso(item.get('vencimiento')))
+
+    def vencimientos_eliminados(self, ids):
+        if self._token is None:
+            return
+        for item_id in ids:
+            self._poner(('vencimiento', item_id), None)
+
+    def mes_cambiado(self, year, month):
+        if self._token is None:
+            return
+        for clave in self._meses.pop((year, month), []):
+            self._poner(clave, None)
+        self._meses[(year, month)] = claves = []
+        for clave, fecha in self._gastos_mes(year, month):
+            self._poner(clave, fecha)
+            claves.append(clave)
+
+    def _entre(self, desde, hasta):
+        entradas = []
+        if desde < self._hoy:
+            for i in range(bisect.bisect_left(self._pasados, (desde,)), len(self._pasados)):
+                entrada = self._pasados[i]
+                if entrada[0] > hasta:
+                    break
+                if self._valida(entrada):
+                    entradas.append(entrada)
+        # Del heap se recorren solo los nodos con fecha <= hasta: los hijos de
+        # un nodo nunca vencen antes que él
+        pendientes = [0] if self._heap else []
+        while pendientes:
+            i = pendientes.pop()
+            entrada = self._heap[i]
+            if entrada[0] > hasta:
+                continue
+            if entrada[0] >= desde and self._valida(entrada):
+                entradas.append(entrada)
+            pendientes.extend(j for j in (2 * i + 1, 2 * i + 2) if j < len(self._heap))
+        entradas.sort()
+        return entradas
+
+    def proximos(self, desde, hasta):
+        """Lo que vence entre `desde` y `hasta` (fechas ISO, inclusive), por fecha."""
+        with self._lock:
+            self._sincronizar()
+            self._avanzar(datetime.date.today().isoformat())
+            entradas = self._entre(desde, hasta)
+        gastos = read_data(GASTOS_FILE)
+        resultado = []
+        for fecha, _, clave in entradas:
+            if clave[0] == 'vencimiento':
+                resultado.append({"fecha": fecha, "tipo": "vencimiento", "item": store.get_item(VENCIMIENTOS_FILE, clave[1])})
+            else:
+                _, year, month, i = clave
+                resultado.append({"fecha": fecha, "tipo": "gasto", "anio": year, "mes": month, "item": gastos[year][month][i]})
+        # Meses sin guardar dentro de la ventana: todos sus gastos están impagos
+        ym, ultimo = desde[:7], hasta[:7]
+        while ym <= ultimo:
+            year, month = ym[:4], MESES[int(ym[5:]) - 1]
+            if month not in gastos.get(year, {}):
+                for gasto in proyectar_gastos(year, month):
+                    fecha = vence_gasto(gasto, ym)
+                    if fecha is not None and desde <= fecha <= hasta:
+                        resultado.append({"fecha": fecha, "tipo": "gasto", "anio": year, "mes": month, "item": gasto})
+            ym = siguiente_mes(ym)
+        resultado.sort(key=lambda r: r['fecha'])
+        return resultado
+
+agenda_vencimientos = AgendaVencimientos()
+
+@app.route('/api/data/vencimientos/upcoming', methods=['GET'])
+def get_proximos_vencimientos():
+    try:
+        days = int(request.args.get('days', UPCOMING_DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'days' debe ser un número."}), 400
+    if not 0 <= days <= UPCOMING_MAX_DAYS:
+        return jsonify({"error": f"days debe estar entre 0 y {UPCOMING_MAX_DAYS}."}), 400
+    desde = fecha_iso(request.args['desde']) if request.args.get('desde') else datetime.date.today().isoformat()
+    if desde is None:
+        return jsonify({"error": "desde debe ser una fecha AAAA-MM-DD."}), 400
+    hasta = (datetime.date.fromisoformat(desde) + datetime.timedelta(days=days)).isoformat()
+    return jsonify(agenda_vencimientos.proximos(desde, hasta)), 200
+
+# --- Operaciones en lote ---
+# La pantalla guarda planillas enteras (stock, precios, vencimientos) fila por
+# fila. POST /api/data/batch aplica una lista ordenada de operaciones en una
+# sola petición:
+#   {"operaciones": [
+#       {"coleccion": "stock", "accion": "crear", "datos": {...}},
+#       {"coleccion": "stock", "accion": "actualizar", "id": "...", "datos": {...}},
+#       {"coleccion": "vencimientos", "accion": "eliminar", "id": "..."}]}
+# Cada operación hace lo mismo que su ruta individual. Se aplican todas o
+# ninguna: si una falla se deshacen las anteriores y se responde con el código
+# de la que falló. Cada colección tocada se guarda una sola vez.
+OPERACIONES_LOTE = {
+    'stock': {'crear': crear_stock, 'actualizar': actualizar_stock, 'eliminar': eliminar_stock},
+    'precios': {'crear': crear_precio, 'actualizar': actualizar_precio, 'eliminar': eliminar_precio},
+    'vencimientos': {'crear': crear_vencimiento, 'actualizar': actualizar_vencimiento, 'eliminar': eliminar_vencimiento},
+    'ingresos': {'crear': crear_movimiento, 'eliminar': eliminar_movimiento},
+}
+
+class OperacionFallida(Exception):
+    """Una operación del lote no se pudo aplicar; el lote entero se deshace."""
+
+    def __init__(self, indice, cuerpo, status):
+        super().__init__(cuerpo.get('error'))
+        self.indice = indice
+        self.cuerpo = cuerpo
+        self.status = status
+
+def aplicar_operacion(op):
+    if not isinstance(op, dict):
+        return {"error": "Cada operación debe ser un objeto."}, 400
+    acciones = OPERACIONES_LOTE.get(op.get('coleccion'))
+    if acciones is None:
+        return {"error": f"Colección no soportada: {op.get('coleccion')}"}, 400
+    funcion = acciones.get(op.get('accion'))
+    if funcion is None:
+        return {"error": f"Acción no soportada en {op['coleccion']}: {op.get('accion')}"}, 400
+    datos = op.get('datos', {})
+    if op['accion'] != 'eliminar' and not isinstance(datos, dict):
+        return {"error": "'datos' debe ser un objeto."}, 400
+    if op['accion'] == 'crear':
+        return funcion(datos)
+    if not op.get('id'):
+        return {"error": "Falta el id."}, 400
+    if op['accion'] == 'eliminar':
+        return funcion(op['id'])
+    return funcion(op['id'], datos)
+
+@app.route('/api/data/batch', methods=['POST'])
+def aplicar_lote():
+    datos = request.json
+    operaciones = datos.get('operaciones') if isinstance(datos, dict) else None
+    if not isinstance(operaciones, list):
+        return jsonify({"error": "Se espera {'operaciones': [...]}"}), 400
+    resultados = []
+    try:
+        with store.atomic():
+            for indice, op in enumerate(operaciones):
+                cuerpo, status = aplicar_operacion(op)
+                if status >= 400:
+                    raise OperacionFallida(indice, cuerpo, status)
+                resultados.append({"status": status, "resultado": cuerpo})
+    except OperacionFallida as e:
+        return jsonify({
+            "error": f"Operación {e.indice}: {str(e.cuerpo.get('error')).rstrip('.')}. No se aplicó ningún cambio.",
+            "operacion": e.indice,
+            "resultados": resultados + [{"status": e.status, "resultado": e.cuerpo}],
+        }), e.status
+    return jsonify({"resultados": resultados}), 200
+
+# --- Importación y exportación CSV/XLSX ---
+# GET  /api/data/<coleccion>/exportar  CSV generado de a tandas de filas, sin
+#      armar el archivo completo en memoria. En gastos, ?anio= y ?mes= acotan
+#      los meses (sin anio: todos los años guardados).
+# POST /api/data/<coleccion>/importar  CSV o XLSX, en el campo 'archivo' de un
+#      formulario o como cuerpo text/csv. El archivo se recorre dos veces sin
+#      guardar las filas: primero se validan (si alguna tiene errores no se
+#      aplica nada y la respuesta las lista) y después se aplican de a tandas
+#      de CSV_CHUNK_ROWS, cada una con el almacén tomado solo mientras dura y
+#      todo o nada. Si una fila falla al aplicarse (un padre_id que no existe)
+#      quedan las tandas anteriores y la respuesta dice cuántas filas entraron.
+# Los encabezados no distinguen mayúsculas ni acentos ('Descripción',
+# 'descripcion'); el separador puede ser ',' o ';'. Por colección:
+#   gastos    anio, mes, concepto, monto, fecha, pagado. anio y mes pueden ir en
+#             la URL (?anio=2025&mes=Enero) para los gastos_<Mes>.csv. Los
+#             conceptos se combinan con los del mes; ?modo=reemplazar deja
+#             solo los del archivo.
+#   clientes  se busca por id o por dirección; si no existe se crea.
+#   stock     se busca por id o codigo; tipo (titulo | producto), descripcion,
+#             padre_id, cantidad.
+#   precios   se busca por id o codigo. El precio entra al historial con la
+#             fecha de la fila (o ?fecha=, o hoy). Los ítems nuevos necesitan
+#             tipo, descripcion y padre_id (salvo los de tipo concepto).
+# openpyxl es opcional: sin él solo se importan CSV.
+CSV_CHUNK_ROWS = 500
+IMPORT_MAX_ERRORS = 50
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+COLUMNAS_ALIAS = {'ano': 'anio', 'cod': 'codigo', 'id_cliente': 'id'}
+
+class ImportacionInvalida(Exception):
+    """El archivo subido no se puede leer."""
+
+class FilaInvalida(Exception):
+    """Una fila no se pudo aplicar; la importación entera se deshace."""
+
+    def __init__(self, fila, mensaje):
+        super().__init__(mensaje)
+        self.fila = fila
+
+def normalizar_columna(nombre):
+    texto = unicodedata.normalize('NFKD', str(nombre or '').strip().lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).replace(' ', '_').replace('-', '_')
+    return COLUMNAS_ALIAS.get(texto, texto)
+
+def numero_csv(texto):
+    """Número de una celda: admite '1234.5', '1234,5' y '1.234,50'; None si no es número."""
+    texto = str(texto).strip().replace('$', '').replace(' ', '')
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.') if texto.rfind(',') > texto.rfind('.') else texto.replace(',', '')
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+def texto_numero(valor):
+    return str(int(valor)) if valor.is_integer() else str(valor)
+
+def nombre_mes(texto):
+    """'Enero' a partir de 'enero', 'ENERO', '1' o '01'; None si no es un mes."""
+    texto = str(texto or '').strip()
+    if texto.isdigit():
+        return MESES[int(texto) - 1] if 1 <= int(texto) <= 12 else None
+    return next((mes for mes in MESES if mes.lower() == texto.lower()), None)
+
+def texto_celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime.datetime):
+        return valor.date().isoformat() if valor.time() == datetime.time() else valor.isoformat()
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+def filas_con_encabezado(filas):
+    """(número de fila, {columna: texto}) de cada fila no vacía; la primera es el encabezado."""
+    filas = iter(filas)
+    encabezado = [normalizar_columna(c) for c in next(filas, [])]
+    for numero, fila in enumerate(filas, start=2):
+        valores = [str(v).strip() for v in fila]
+        if any(valores):
+            yield numero, {columna: valor for columna, valor in zip(encabezado, valores) if columna}
+
+def filas_csv(stream):
+    texto = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        primera = texto.readline()
+        separador = ';' if primera.count(';') > primera.count(',') else ','
+        yield from filas_con_encabezado(csv.reader(itertools.chain([primera], texto), delimiter=separador))
+    finally:
+        texto.detach()  # sin cerrar el archivo subido: se vuelve a leer
+
+def filas_xlsx(stream):
+    try:
+        import openpyxl  # opcional y pesado: solo se carga al importar un XLSX
+    except ImportError:
+        raise ImportacionInvalida("Para importar XLSX hay que instalar openpyxl (o subir el archivo como CSV).")
+    try:
+        libro = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+        raise ImportacionInvalida(f"El archivo no es un XLSX válido: {e}")
+    return filas_con_encabezado([texto_celda(v) for v in fila] for fila in libro.active.iter_rows(values_only=True))
+
+def filas_subidas():
+    """Función que recorre (desde el principio, cada vez que se la llama) las
+    filas del archivo subido."""
+    archivo = request.files.get('archivo')
+    if archivo is not None:
+        nombre, stream = archivo.filename or '', archivo.stream
+    elif request.mimetype in ('text/csv', 'text/plain', XLSX_MIMETYPE):
+        nombre = 'datos.xlsx' if request.mimetype == XLSX_MIMETYPE else 'datos.csv'
+        stream = io.BytesIO(request.get_data())
+    else:
+        raise ImportacionInvalida("Falta el archivo: campo 'archivo' de un formulario o cuerpo text/csv.")
+    leer = filas_xlsx if nombre.lower().endswith('.xlsx') else filas_csv
+
+    def recorrer():
+        stream.seek(0)
+        return leer(stream)
+    return recorrer
+
+def validar_gasto(fila):
+    anio = fila.get('anio') or request.args.get('anio', '')
+    mes = nombre_mes(fila.get('mes') or request.args.get('mes', ''))
+    if year_month(anio, mes) is None:
+        raise ValueError("Año o mes inválido.")
+    if not fila.get('concepto'):
+        raise ValueError("Falta el concepto.")
+    monto = fila.get('monto', '')
+    if monto and numero_csv(monto) is None:
+        raise ValueError(f"Monto inválido: {monto}")
+    pagado = fila.get('pagado', '').lower() or 'no'
+    if pagado not in ('si', 'sí', 'no'):
+        raise ValueError("'pagado' debe ser si o no.")
+    gasto = {'concepto': fila['concepto'], 'monto': texto_numero(numero_csv(monto)) if monto else '',
+             'fecha': fila.get('fecha', ''), 'pagado': 'no' if pagado == 'no' else 'si'}
+    return str(int(anio)), mes, gasto
+
+def aplicar_gastos(filas):
+    reemplazar = request.args.get('modo') == 'reemplazar'
+    por_mes = {}
+    for _, (anio, mes, gasto) in filas:
+        por_mes.setdefault((anio, mes), []).append(gasto)
+    creados = actualizados = 0
+    for (anio, mes), gastos in por_mes.items():
+        items = [] if reemplazar else [dict(item) for item in gastos_del_mes(anio, mes)]
+        por_concepto = {item['concepto'].lower(): item for item in items}
+        for gasto in gastos:
+            existente = por_concepto.get(gasto['concepto'].lower())
+            if existente is None:
+                items.append(gasto)
+                por_concepto[gasto['concepto'].lower()] = gasto
+                creados += 1
+            else:
+                existente.update(gasto)
+                actualizados += 1
+        guardar_gastos_mes(anio, mes, items)
+    return {'meses': set(por_mes), 'creados': creados, 'actualizados': actualizados}
+
+def validar_cliente(fila):
+    # Los contadores de pedidos los mantiene el servidor
+    cliente = {k: v for k, v in fila.items() if v and k not in ('numero', 'cantidad_pedidos', 'ultimo_pedido_fecha')}
+    if not any(k != 'id' for k in cliente):
+        raise ValueError("La fila no tiene datos.")
+    return cliente
+
+def aplicar_clientes(filas):
+    creados = actualizados = 0
+    for numero, cliente in filas:
+        existente = store.get_item(CLIENTES_FILE, cliente['id']) if cliente.get('id') else None
+        if existente is None and cliente.get('direccion'):
+            coincidencias = store.find_items(CLIENTES_FILE, 'direccion', normalizar_direccion(cliente['direccion']))
+            existente = coincidencias[0] if coincidencias else None
+        if existente is not None:
+            store.update_item(CLIENTES_FILE, existente['id'], cliente, preserve_key=True)
+            actualizados += 1
+            continue
+        nuevo = dict(cliente, id=cliente.get('id') or str(uuid.uuid4()))
+        if nuevo.get('direccion'):
+            nuevo.update(numero=len(read_data(CLIENTES_FILE)) + 1, cantidad_pedidos=0, ultimo_pedido_fecha=None)
+        store.insert_item(CLIENTES_FILE, nuevo)
+        creados += 1
+    return {'creados': creados, 'actualizados': actualizados}
+
+def validar_stock(fila):
+    item = {k: v for k, v in fila.items() if v}
+    if item.get('tipo') not in (None, 'titulo', 'producto'):
+        raise ValueError("'tipo' debe ser titulo o producto.")
+    if 'cantidad' in item:
+        item['cantidad'] = numero_csv(item['cantidad'])
+        if item['cantidad'] is None:
+            raise ValueError(f"Cantidad inválida: {fila['cantidad']}")
+    return item
+
+def buscar_por_id_o_codigo(filepath, por_codigo, item):
+    existente = store.get_item(filepath, item['id']) if item.get('id') else None
+    if existente is None and item.get('codigo'):
+        existente = por_codigo.get(item['codigo'].lower())
+    return existente
+
+def por_codigo(filepath):
+    return {str(item['codigo']).lower(): item for item in read_data(filepath) if item.get('codigo')}
+
+def aplicar_stock(filas):
+    codigos = por_codigo(STOCK_FILE)
+    creados = actualizados = 0
+    for numero, item in filas:
+        existente = buscar_por_id_o_codigo(STOCK_FILE, codigos, item)
+        if existente is not None:
+            store.update_item(STOCK_FILE, existente['id'], item, preserve_key=True)
+            actualizados += 1
+            continue
+        if not item.get('descripcion') or not item.get('tipo'):
+            raise FilaInvalida(numero, "Ítem nuevo: descripcion y tipo son obligatorios.")
+        if item['tipo'] == 'producto':
+            if not item.get('padre_id') or store.get_item(STOCK_FILE, item['padre_id']) is None:
+                raise FilaInvalida(numero, "Un producto debe tener un título padre existente (padre_id).")
+            item.setdefault('cantidad', 0.0)
+        item.setdefault('id', str(uuid.uuid4()))
+        store.insert_item(STOCK_FILE, item)
+        if item.get('codigo'):
+            codigos[item['codigo'].lower()] = item
+        creados += 1
+    invalidar_plan_stock()
+    return {'creados': creados, 'actualizados': actualizados}
+
+def validar_precio(fila):
+    item = {k: v for k, v in fila.items() if v}
+    if 'precio' in item:
+        item['precio'] = numero_csv(item['precio'])
+        if item['precio'] is None:
+            raise ValueError(f"Precio inválido: {fila['precio']}")
+    fecha = item.get('fecha') or request.args.get('fecha') or datetime.date.today().isoformat()
+    try:
+        datetime.date.fromisoformat(fecha[:10])
+    except ValueError:
+        raise ValueError(f"Fecha inválida (AAAA-MM-DD): {fecha}")
+    item['fecha'] = fecha[:10]
+    return item
+
+def aplicar_precios(filas):
+    codigos = por_codigo(PRECIOS_FILE)
+    creados = actualizados = precios = 0
+    for numero, fila in filas:
+        precio, fecha = fila.pop('precio', None), fila.pop('fecha')
+        existente = buscar_por_id_o_codigo(PRECIOS_FILE, codigos, fila)
+        if existente is not None:
+            cambios = {k: v for k, v in fila.items() if k != 'id' and existente.get(k) != v}
+            if cambios:
+                store.update_item(PRECIOS_FILE, existente['id'], cambios)
+            item = existente
+            actualizados += 1
+        else:
+            if not fila.get('descripcion') or not fila.get('tipo'):
+                raise FilaInvalida(numero, "Ítem nuevo: descripcion y tipo son obligatorios.")
+            if fila['tipo'] != 'concepto' and (not fila.get('padre_id') or store.get_item(PRECIOS_FILE, fila['padre_id']) is None):
+                raise FilaInvalida(numero, "Ítem nuevo: padre_id debe ser un ítem existente.")
+            item = dict({'id': str(uuid.uuid4()), 'codigo': '', 'padre_id': '', 'price_history': []}, **fila)
+            store.insert_item(PRECIOS_FILE, item)
+            if item.get('codigo'):
+                codigos[item['codigo'].lower()] = item
+            creados += 1
+        if precio is not None and historial_de(item['id']).get(fecha) != precio:
+            registrar_precio(item['id'], fecha, precio)
+            precios += 1
+    return {'creados': creados, 'actualizados': actualizados, 'precios_registrados': precios}
+
+# colección → (validar una fila, aplicar las filas válidas)
+IMPORTADORES = {
+    'gastos': (validar_gasto, aplicar_gastos),
+    'clientes': (validar_cliente, aplicar_clientes),
+    'stock': (validar_stock, aplicar_stock),
+    'precios': (validar_precio, aplicar_precios),
+}
+
+def sumar_resumen(total, parcial):
+    # Los conjuntos (meses de gastos) se unen: un mes puede venir en varias tandas
+    for clave, valor in parcial.items():
+        total[clave] = total.get(clave, set()) | valor if isinstance(valor, set) else total.get(clave, 0) + valor
+
+def tandas(filas, tamano):
+    filas = iter(filas)
+    while True:
+        tanda = list(itertools.islice(filas, tamano))
+        if not tanda:
+            return
+        yield tanda
+
+@app.route('/api/data/<coleccion>/importar', methods=['POST'])
+@bloqueo_propio
+def importar_coleccion(coleccion):
+    if coleccion not in IMPORTADORES:
+        return jsonify({"error": f"No se puede importar {coleccion}. Disponibles: {', '.join(IMPORTADORES)}"}), 404
+    validar, aplicar = IMPORTADORES[coleccion]
+    total, errores = 0, []
+    try:
+        recorrer = filas_subidas()
+        for numero, fila in recorrer():
+            total += 1
+            try:
+                validar(fila)
+            except ValueError as e:
+                errores.append({'fila': numero, 'error': str(e)})
+    except ImportacionInvalida as e:
+        return jsonify({"error": str(e)}), 400
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"No se pudo leer el archivo (se espera CSV en UTF-8 o XLSX): {e}"}), 400
+    if errores:
+        return jsonify({"error": f"{len(errores)} fila(s) con errores. No se importó nada.",
+                        "errores": errores[:IMPORT_MAX_ERRORS]}), 400
+    if not total:
+        return jsonify({"error": "El archivo no tiene filas para importar."}), 400
+    resumen, aplicadas = {}, 0
+    for tanda in tandas(recorrer(), CSV_CHUNK_ROWS):
+        validas = [(numero, validar(fila)) for numero, fila in tanda]
+        try:
+            with store.exclusive(), store.atomic():
+                sumar_resumen(resumen, aplicar(validas))
+        except FilaInvalida as e:
+            detalle = "No se importó nada." if not aplicadas else \
+                f"Se importaron las {aplicadas} filas anteriores a la fila {validas[0][0]}; desde ahí no se importó nada."
+            return jsonify({"error": f"Fila {e.fila}: {str(e).rstrip('.')}. {detalle}", "filas_importadas": aplicadas,
+                            "errores": [{'fila': e.fila, 'error': str(e)}]}), 400
+        aplicadas += len(validas)
+    resumen = {clave: len(valor) if isinstance(valor, set) else valor for clave, valor in resumen.items()}
+    return jsonify(dict(resumen, coleccion=coleccion, filas=aplicadas)), 200
+
+def columnas_de(base, items, excluir=()):
+    """`base` más las demás claves que aparezcan en `items`, en orden de aparición."""
+    columnas = dict.fromkeys(base)
+    for item in items:
+        columnas.update((k, None) for k in item if k not in excluir and not isinstance(item[k], (list, dict)))
+    return list(columnas)
+
+def exportar_gastos():
+    anio, mes = request.args.get('anio'), request.args.get('mes')
+    if mes and nombre_mes(mes) is None:
+        raise ValueError("Mes inválido.")
+    anios = [anio] if anio else sorted(y for y in read_data(GASTOS_FILE) if y.isdigit())
+    meses = [nombre_mes(mes)] if mes else MESES
+    bloques = [(y, m, gastos_del_mes(y, m)) for y in anios for m in meses]
+    filas = (dict(item, anio=y, mes=m) for y, m, items in bloques for item in items)
+    nombre = f"gastos_{anio or 'todos'}{'_' + nombre_mes(mes) if mes else ''}.csv"
+    return nombre, ['anio', 'mes', 'concepto', 'monto', 'fecha', 'pagado'], filas
+
+def exportar_lista(filepath, base, excluir=()):
+    items = list(read_data(filepath))
+    return f"{collection_name(filepath)}.csv", columnas_de(base, items, excluir), items
+
+def exportar_precios():
+    hoy = datetime.date.today().isoformat()
+    items = list(read_data(PRECIOS_FILE))
+    filas = (dict(item, precio=precio, fecha_precio=fecha) for item in items for fecha, precio in [precio_vigente(item, hoy)])
+    columnas = columnas_de(['id', 'tipo', 'descripcion', 'codigo', 'padre_id', 'precio', 'fecha_precio'], items, ('price_history',))
+    return 'precios.csv', columnas, filas
+
+# colección → función que devuelve (nombre del archivo, columnas, filas)
+EXPORTADORES = {
+    'gastos': exportar_gastos,
+    'clientes': lambda: exportar_lista(CLIENTES_FILE, ['id', 'numero', 'nombre', 'direccion', 'cuit', 'cantidad_pedidos', 'ultimo_pedido_fecha']),
+    'stock': lambda: exportar_lista(STOCK_FILE, ['id', 'tipo', 'descripcion', 'codigo', 'padre_id', 'cantidad']),
+    'precios': exportar_precios,
+}
+
+def generar_csv(columnas, filas):
+    """CSV de `filas`, de a tandas de CSV_CHUNK_ROWS. Cada tanda se lee con
+    store.shared() tomado: ningún registro se ve a mitad de un cambio, y entre
+    tandas (mientras se envían) el almacén queda libre."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columnas)
+    filas = iter(filas)
+    while True:
+        with store.shared():
+            tanda = [['' if fila.get(c) is None else fila.get(c) for c in columnas]
+                     for fila in itertools.islice(filas, CSV_CHUNK_ROWS)]
+        writer.writerows(tanda)
+        if len(tanda) < CSV_CHUNK_ROWS:
+            break
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route('/api/data/<coleccion>/exportar', methods=['GET'])
+def exportar_coleccion(coleccion):
+    if coleccion not in EXPORTADORES:
+        return jsonify({"error": f"No se puede exportar {coleccion}. Disponibles: {', '.join(EXPORTADORES)}"}), 404
+    # Acá, con el almacén bloqueado, se fijan qué registros se exportan (una
+    # lista de referencias, sin copiarlos); sus valores se leen de a tandas
+    # mientras se envía el CSV (ver generar_csv)
+    try:
+        nombre, columnas, filas = EXPORTADORES[coleccion]()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = app.response_class(generar_csv(columnas, filas), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
 
     # --- Rutas para Proveedores ---
 
@@ -677,6 +4461,494 @@ def save_proveedores():
     write_data(PROVEEDORES_FILE, data)
     return jsonify({"message": "Datos de proveedores guardados exitosamente."}), 200
 
+# --- Archivo mensual de pedidos e ingresos ---
+# pedidos.json e ingresos.json guardan solo el período activo: el mes en curso
+# y los ARCHIVE_HOT_MONTHS - 1 anteriores. Los meses cerrados pasan a
+# datos/archivo/<coleccion>/<AAAA-MM>.json.gz, de solo lectura, y cada
+# colección lleva un indice.json con el resumen de cada mes (totales y, en
+# pedidos, cantidad y última entrega por cliente) para que los agregados no
+# tengan que abrir las particiones. Los pedidos pendientes no se archivan.
+#
+# Una partición se lee solo cuando hace falta: consultas con ?desde=/?hasta=
+# que llegan a meses archivados, reportes de ese año o
+# GET /api/data/archivo/<coleccion>/<AAAA-MM>. /api/data y las listas sin
+# rango de fechas devuelven solo el período activo, así que lo archivado deja
+# de verse en la pantalla: el archivado es opcional. Corre a mano con
+# `flask --app main archivar`, o al iniciar y cada ARCHIVE_CHECK_SECONDS con
+# ARCHIVE_AUTO=1.
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archivo')
+ARCHIVE_AUTO = os.environ.get('ARCHIVE_AUTO', '0') == '1'
+ARCHIVE_HOT_MONTHS = max(1, int(os.environ.get('ARCHIVE_HOT_MONTHS', 2)))
+ARCHIVE_CHECK_SECONDS = float(os.environ.get('ARCHIVE_CHECK_SECONDS', 3600))
+ARCHIVE_CACHE_PARTITIONS = int(os.environ.get('ARCHIVE_CACHE_PARTITIONS', 12))
+
+def fecha_archivo_pedido(pedido):
+    if pedido.get('estado') != 'entregado':
+        return None
+    return pedido.get('fecha_entrega') or pedido.get('fecha_creacion')
+
+# colección → fecha que decide el mes de cada registro (None = sigue activo)
+ARCHIVE_COLLECTIONS = {
+    PEDIDOS_FILE: fecha_archivo_pedido,
+    INGRESOS_FILE: lambda movimiento: movimiento.get('fecha'),
+}
+
+def periodo_de(fecha):
+    """'AAAA-MM' de una fecha ISO o DD/MM/AAAA; None si no se entiende."""
+    texto = str(fecha or '')[:10]
+    try:
+        d = datetime.datetime.strptime(texto, '%d/%m/%Y' if '/' in texto else '%Y-%m-%d')
+    except ValueError:
+        return None
+    return f'{d.year:04d}-{d.month:02d}'
+
+def primer_periodo_activo(hoy=None):
+    hoy = hoy or datetime.date.today()
+    meses = hoy.year * 12 + hoy.month - 1 - (ARCHIVE_HOT_MONTHS - 1)
+    return f'{meses // 12:04d}-{meses % 12 + 1:02d}'
+
+def resumen_particion(filepath, registros):
+    resumen = {'registros': len(registros)}
+    if filepath == PEDIDOS_FILE:
+        clientes = {}
+        for pedido in registros:
+            aporte = aporte_cliente(pedido)
+            if aporte is None:
+                continue
+            direccion, fecha = aporte
+            cliente = clientes.setdefault(direccion, {'cantidad': 0, 'ultima_entrega': ''})
+            cliente['cantidad'] += 1
+            cliente['ultima_entrega'] = max(cliente['ultima_entrega'], fecha)
+        resumen['total'] = round(sum(numero(p.get('montoTotal')) for p in registros), 2)
+        resumen['clientes'] = clientes
+    else:
+        for nombre, movimientos in (('', registros), ('_manuales', [m for m in registros if not m.get('origen_tipo')])):
+            resumen['ingresos' + nombre] = round(sum(numero(m.get('importe')) for m in movimientos if m.get('tipo') != 'egreso'), 2)
+            resumen['egresos' + nombre] = round(sum(numero(m.get('importe')) for m in movimientos if m.get('tipo') == 'egreso'), 2)
+    return resumen
+
+class ArchivoMensual:
+    """Particiones mensuales de solo lectura.
+
+    El índice de cada colección y las últimas particiones leídas quedan en
+    memoria mientras no cambie el archivo en disco (otro proceso puede haber
+    archivado más meses).
+    """
+
+    def __init__(self, directorio, max_particiones):
+        self.directorio = directorio
+        self.max_particiones = max_particiones
+        self._lock = threading.Lock()
+        self._indices = {}  # filepath → (firma, {período: resumen})
+        self._particiones = OrderedDict()  # ruta → (firma, registros)
+
+    def ruta_indice(self, filepath):
+        return os.path.join(self.directorio, collection_name(filepath), 'indice.json')
+
+    def ruta_particion(self, filepath, periodo):
+        return os.path.join(self.directorio, collection_name(filepath), f'{periodo}.json.gz')
+
+    def resumenes(self, filepath):
+        """{período: resumen} de los meses archivados de la colección."""
+        ruta = self.ruta_indice(filepath)
+        firma = file_signature(ruta)
+        if firma is None:
+            return {}
+        with self._lock:
+            cacheado = self._indices.get(filepath)
+            if cacheado is not None and cacheado[0] == firma:
+                return cacheado[1]
+        with open(ruta, 'rb') as f:
+            indice = deserializar(f.read())
+        with self._lock:
+            self._indices[filepath] = (firma, indice)
+        return indice
+
+    def periodos(self, filepath, desde=None, hasta=None):
+        return sorted(p for p in self.resumenes(filepath)
+                      if (not desde or p >= desde) and (not hasta or p <= hasta))
+
+    def registros(self, filepath, periodo):
+        ruta = self.ruta_particion(filepath, periodo)
+        firma = file_signature(ruta)
+        if firma is None:
+            return []
+        with self._lock:
+            cacheado = self._particiones.get(ruta)
+            if cacheado is not None and cacheado[0] == firma:
+                self._particiones.move_to_end(ruta)
+                return cacheado[1]
+        with open(ruta, 'rb') as f:
+            registros = deserializar(gzip.decompress(f.read()))['registros']
+        with self._lock:
+            self._particiones[ruta] = (firma, registros)
+            while len(self._particiones) > self.max_particiones:
+                self._particiones.popitem(last=False)
+        return registros
+
+    def registros_rango(self, filepath, desde=None, hasta=None):
+        """Registros archivados de los meses entre `desde` y `hasta` (AAAA-MM), en orden."""
+        return [item for periodo in self.periodos(filepath, desde, hasta)
+                for item in self.registros(filepath, periodo)]
+
+    def agregar(self, filepath, periodo, nuevos):
+        """Suma `nuevos` a la partición del mes (reemplazando los que tengan la
+        misma clave) y actualiza el índice. Se llama con la colección bloqueada."""
+        key_field = collection_key(filepath)
+        claves = {item.get(key_field) for item in nuevos}
+        registros = [item for item in self.registros(filepath, periodo) if item.get(key_field) not in claves] + nuevos
+        resumen = resumen_particion(filepath, registros)
+        ruta = self.ruta_particion(filepath, periodo)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        contenido = {'coleccion': collection_name(filepath), 'periodo': periodo, 'resumen': resumen, 'registros': registros}
+        atomic_write_bytes(ruta, gzip.compress(serializar(contenido), compresslevel=STORE_GZIP_LEVEL))
+        indice = dict(self.resumenes(filepath), **{periodo: resumen})
+        atomic_write_bytes(self.ruta_indice(filepath), serializar(dict(sorted(indice.items())), indentado=True))
+
+archivo_mensual = ArchivoMensual(ARCHIVE_DIR, ARCHIVE_CACHE_PARTITIONS)
+metrics.counter('archive_records_total', 'Registros movidos al archivo mensual, por colección.')
+
+def archivar_periodos_cerrados(hasta=None):
+    """Mueve al archivo los registros de los meses anteriores a `hasta`
+    (AAAA-MM; por defecto el primer mes activo). Devuelve
+    {colección: {período: cantidad}}."""
+    hasta = hasta or primer_periodo_activo()
+    movidos = {}
+    with store.exclusive():
+        for filepath, fecha_de in ARCHIVE_COLLECTIONS.items():
+            key_field = collection_key(filepath)
+            por_periodo = {}
+            for item in read_data(filepath):
+                periodo = periodo_de(fecha_de(item))
+                if periodo is not None and periodo < hasta and item.get(key_field) is not None:
+                    por_periodo.setdefault(periodo, []).append(item)
+            # Primero se escribe la partición y después se quita de la
+            # colección activa: si algo falla en el medio, la próxima
+            # pasada vuelve a agregarlos sin duplicar
+            for periodo, registros in sorted(por_periodo.items()):
+                archivo_mensual.agregar(filepath, periodo, registros)
+                store.delete_items(filepath, [item[key_field] for item in registros])
+                movidos.setdefault(collection_name(filepath), {})[periodo] = len(registros)
+                metrics.inc('archive_records_total', len(registros), coleccion=collection_name(filepath))
+    return movidos
+
+def informar_archivado(movidos):
+    for coleccion, periodos in movidos.items():
+        print(f"✅ Archivados {sum(periodos.values())} registros de {coleccion} ({', '.join(periodos)})")
+
+def archivar_periodicamente():
+    while True:
+        try:
+            informar_archivado(archivar_periodos_cerrados())
+        except (OSError, ValueError, StorageError) as e:
+            print(f"❌ Error al archivar meses cerrados: {e}")
+        time.sleep(ARCHIVE_CHECK_SECONDS)
+
+@app.cli.command('archivar')
+@click.option('--hasta', help='Primer mes que queda activo (AAAA-MM). Por defecto, según ARCHIVE_HOT_MONTHS.')
+def archivar_command(hasta):
+    """Mueve los pedidos e ingresos de meses cerrados al archivo mensual."""
+    if hasta is not None and periodo_de(f'{hasta}-01') != hasta:
+        raise click.BadParameter('debe ser AAAA-MM.', param_hint='--hasta')
+    movidos = archivar_periodos_cerrados(hasta)
+    store.flush()
+    if movidos:
+        informar_archivado(movidos)
+    else:
+        print("No hay meses cerrados para archivar.")
+
+@app.route('/api/data/archivo', methods=['GET'])
+def get_archivo():
+    # Resúmenes de los meses archivados: {"pedidos": {"2025-03": {...}}, "ingresos": {...}}
+    return jsonify({collection_name(fp): archivo_mensual.resumenes(fp) for fp in ARCHIVE_COLLECTIONS}), 200
+
+@app.route('/api/data/archivo/<coleccion>/<periodo>', methods=['GET'])
+def get_particion_archivo(coleccion, periodo):
+    filepath = next((fp for fp in ARCHIVE_COLLECTIONS if collection_name(fp) == coleccion), None)
+    if filepath is None:
+        return jsonify({"error": f"Colección sin archivo. Disponibles: {', '.join(map(collection_name, ARCHIVE_COLLECTIONS))}"}), 404
+    if periodo not in archivo_mensual.resumenes(filepath):
+        return jsonify({"error": "Ese mes no está archivado."}), 404
+    return jsonify(archivo_mensual.registros(filepath, periodo)), 200
+
+# --- Reportes ---
+# Totales mensuales calculados en el servidor con pandas, con los mismos
+# criterios que usaba la pantalla:
+#   ventas   pedidos entregados, por fecha_entrega (o fecha_creacion), montoTotal
+#   costo    costo del ítem en la lista de precios × cantidad vendida
+#   gastos   conceptos pagados del mes (gastos.json)
+#   manuales movimientos de ingresos cargados a mano (sin origen_tipo)
+# GET /api/reportes/<nombre>?anio=AAAA[&mes=M]. Cada resultado se guarda en un
+# LRU por (reporte, parámetros, versión de las colecciones que usa). Los meses
+# del año que ya están en el archivo mensual se leen de sus particiones.
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 64))
+
+class ImportacionDiferida:
+    """Módulo que se importa recién la primera vez que se usa un atributo."""
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def cargar(self):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        return getattr(self.cargar(), atributo)
+
+# pandas tarda casi medio segundo en importarse y solo lo usan los reportes
+pd = ImportacionDiferida('pandas')
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+report_cache = LRUCache(REPORT_CACHE_SIZE)
+
+def parse_fechas(serie):
+    """Fechas ISO (AAAA-MM-DD[THH:MM...]) o DD/MM/AAAA; lo que no se entiende queda NaT."""
+    texto = serie.astype('string')
+    fechas = pd.to_datetime(texto.str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+    faltan = fechas.isna() & texto.notna()
+    if faltan.any():
+        fechas[faltan] = pd.to_datetime(texto[faltan], format='%d/%m/%Y', errors='coerce')
+    return fechas
+
+def a_numero(serie):
+    return pd.to_numeric(serie, errors='coerce').fillna(0.0)
+
+def filas(df):
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+def copiar_fuente(filepath, anio):
+    """Lo que un reporte usa de una colección, copiado para calcularlo sin
+    retener el almacén: los registros (más los archivados del año) o, en
+    gastos, los meses del año."""
+    if filepath == GASTOS_FILE:
+        return {month: [dict(item) for item in items] for month, items in read_data(GASTOS_FILE).get(str(anio), {}).items()}
+    registros = [dict(item) for item in read_data(filepath)]
+    if filepath in ARCHIVE_COLLECTIONS:
+        registros = archivo_mensual.registros_rango(filepath, f'{anio}-01', f'{anio}-12') + registros
+    return registros
+
+def pedidos_entregados_df(registros, anio, mes=None):
+    pedidos = pd.DataFrame(registros, columns=['id', 'estado', 'fecha_entrega', 'fecha_creacion', 'montoTotal', 'items'])
+    pedidos = pedidos[pedidos['estado'] == 'entregado'].copy()
+    pedidos['fecha'] = parse_fechas(pedidos['fecha_entrega'].fillna(pedidos['fecha_creacion']))
+    pedidos = pedidos[pedidos['fecha'].dt.year == anio]
+    if mes is not None:
+        pedidos = pedidos[pedidos['fecha'].dt.month == mes]
+    pedidos['mes'] = pedidos['fecha'].dt.month
+    pedidos['montoTotal'] = a_numero(pedidos['montoTotal'])
+    return pedidos
+
+def items_vendidos_df(pedidos):
+    """Una fila por ítem vendido: mes, id, descripcion, cantidad, precio."""
+    items = pedidos[['mes', 'items']].explode('items').dropna(subset=['items'])
+    detalle = pd.DataFrame(items['items'].tolist(), index=items.index, columns=['id', 'descripcion', 'cantidad', 'precio'])
+    detalle['mes'] = items['mes']
+    detalle['cantidad'] = pd.to_numeric(detalle['cantidad'], errors='coerce').fillna(1.0)
+    detalle['precio'] = a_numero(detalle['precio'])
+    return detalle.reset_index(drop=True)
+
+def gastos_df(meses):
+    """Una fila por concepto de los meses guardados del año."""
+    registros = []
+    for month, items in meses.items():
+        if month in MESES:
+            for item in items:
+                registros.append({'mes': MESES.index(month) + 1, 'concepto': item.get('concepto'),
+                                  'monto': item.get('monto'), 'pagado': item.get('pagado') == 'si'})
+    gastos = pd.DataFrame(registros, columns=['mes', 'concepto', 'monto', 'pagado'])
+    gastos['monto'] = a_numero(gastos['monto'])
+    return gastos
+
+def por_mes(serie):
+    return serie.reindex(range(1, 13), fill_value=0.0)
+
+def reporte_resumen_mensual(datos, anio, mes):
+    pedidos = pedidos_entregados_df(datos[PEDIDOS_FILE], anio)
+    ventas = por_mes(pedidos.groupby('mes')['montoTotal'].sum())
+    items = items_vendidos_df(pedidos)
+    costos = pd.DataFrame(datos[PRECIOS_FILE], columns=['id', 'costo']).dropna(subset=['id']).drop_duplicates('id')
+    items = items.merge(costos, on='id', how='left')
+    items['costo'] = pd.to_numeric(items['costo'], errors='coerce')
+    costo = por_mes((items['costo'] * items['cantidad']).groupby(items['mes']).sum())
+    gastos = gastos_df(datos[GASTOS_FILE])
+    gastos_pagados = por_mes(gastos[gastos['pagado']].groupby('mes')['monto'].sum())
+    manuales = pd.DataFrame(datos[INGRESOS_FILE], columns=['tipo', 'importe', 'fecha', 'origen_tipo'])
+    manuales = manuales[manuales['origen_tipo'].isna()].copy()
+    manuales['fecha'] = parse_fechas(manuales['fecha'])
+    manuales = manuales[manuales['fecha'].dt.year == anio]
+    manuales['importe'] = a_numero(manuales['importe'])
+    manuales['mes'] = manuales['fecha'].dt.month
+    es_egreso = manuales['tipo'] == 'egreso'
+    ingresos_manuales = por_mes(manuales[~es_egreso].groupby('mes')['importe'].sum())
+    egresos_manuales = por_mes(manuales[es_egreso].groupby('mes')['importe'].sum())
+    tabla = pd.DataFrame({
+        'mes': range(1, 13),
+        'nombre': MESES,
+        'ventas': ventas.values,
+        'costo': costo.values,
+        'gastos_pagados': gastos_pagados.values,
+        'ingresos_manuales': ingresos_manuales.values,
+        'egresos_manuales': egresos_manuales.values,
+    })
+    tabla['balance'] = tabla['ventas'] - tabla['costo'] - tabla['gastos_pagados']
+    if mes is not None:
+        tabla = tabla[tabla['mes'] == mes]
+    totales = tabla.drop(columns=['mes', 'nombre']).sum().round(2)
+    return {'filas': filas(tabla.round(2)), 'totales': totales.to_dict()}
+
+def reporte_ventas_por_producto(datos, anio, mes):
+    items = items_vendidos_df(pedidos_entregados_df(datos[PEDIDOS_FILE], anio, mes))
+    items['total'] = items['precio'] * items['cantidad']
+    tabla = (items.groupby('descripcion', dropna=False)
+             .agg(cantidad=('cantidad', 'sum'), total=('total', 'sum'))
+             .reset_index()
+             .sort_values('total', ascending=False))
+    total = float(tabla['total'].sum())
+    tabla['porcentaje'] = (tabla['total'] / total * 100) if total else 0.0
+    return {'filas': filas(tabla.round(2)), 'totales': {'total': round(total, 2)}}
+
+def reporte_gastos_por_concepto(datos, anio, mes):
+    gastos = gastos_df(datos[GASTOS_FILE])
+    if mes is not None:
+        gastos = gastos[gastos['mes'] == mes]
+    gastos = gastos.assign(pagado_monto=gastos['monto'].where(gastos['pagado'], 0.0),
+                           pendiente_monto=gastos['monto'].where(~gastos['pagado'], 0.0))
+    tabla = (gastos.groupby('concepto')
+             .agg(pagado=('pagado_monto', 'sum'), pendiente=('pendiente_monto', 'sum'))
+             .reset_index())
+    tabla = tabla[(tabla['pagado'] != 0) | (tabla['pendiente'] != 0)].sort_values('pagado', ascending=False)
+    return {'filas': filas(tabla.round(2)), 'totales': tabla[['pagado', 'pendiente']].sum().round(2).to_dict()}
+
+def reporte_gastos_pagados(datos, anio, mes):
+    gastos = gastos_df(datos[GASTOS_FILE])
+    con_monto = gastos[gastos['monto'] != 0]
+    tabla = pd.DataFrame({
+        'mes': range(1, 13),
+        'nombre': MESES,
+        'pagado': por_mes(con_monto[con_monto['pagado']].groupby('mes')['monto'].sum()).values,
+        'pendiente': por_mes(con_monto[~con_monto['pagado']].groupby('mes')['monto'].sum()).values,
+        'conceptos_pendientes': por_mes(con_monto[~con_monto['pagado']].groupby('mes').size()).astype(int).values,
+    })
+    if mes is not None:
+        tabla = tabla[tabla['mes'] == mes]
+    totales = tabla[['pagado', 'pendiente', 'conceptos_pendientes']].sum()
+    return {'filas': filas(tabla.round(2)), 'totales': json.loads(totales.round(2).to_json())}
+
+# nombre → (función, colecciones de las que depende)
+REPORTES = {
+    'resumen-mensual': (reporte_resumen_mensual, (PEDIDOS_FILE, PRECIOS_FILE, GASTOS_FILE, INGRESOS_FILE)),
+    'ventas-por-producto': (reporte_ventas_por_producto, (PEDIDOS_FILE,)),
+    'gastos-por-concepto': (reporte_gastos_por_concepto, (GASTOS_FILE,)),
+    'gastos-pagados': (reporte_gastos_pagados, (GASTOS_FILE,)),
+}
+
+@app.route('/api/reportes/<nombre>', methods=['GET'])
+@bloqueo_propio
+def get_reporte(nombre):
+    if nombre not in REPORTES:
+        return jsonify({"error": f"Reporte desconocido. Disponibles: {', '.join(REPORTES)}"}), 404
+    funcion, fuentes = REPORTES[nombre]
+    try:
+        anio = int(request.args.get('anio', datetime.date.today().year))
+        mes = int(request.args['mes']) if request.args.get('mes') else None
+    except ValueError:
+        return jsonify({"error": "anio y mes deben ser números."}), 400
+    if mes is not None and not 1 <= mes <= 12:
+        return jsonify({"error": "mes debe estar entre 1 y 12."}), 400
+    # pandas se importa y el cálculo corre sin retener el almacén: bajo
+    # store.shared() solo se copian los datos que usa el reporte
+    pd.cargar()
+    with store.shared():
+        for filepath in fuentes:
+            read_data(filepath)  # revalida la colección si otro proceso la cambió
+        clave = (nombre, anio, mes, store.epoch, tuple(store.version(fp) for fp in fuentes))
+        resultado = report_cache.get(clave)
+        if resultado is None:
+            datos = {filepath: copiar_fuente(filepath, anio) for filepath in fuentes}
+    if resultado is None:
+        resultado = dict(funcion(datos, anio, mes), reporte=nombre, anio=anio, mes=mes)
+        report_cache.put(clave, resultado)
+    return jsonify(resultado), 200
+
+# --- Arranque ---
+# Importar el módulo solo define las rutas y verifica con stat que existan los
+# archivos de datos (creando los que falten). Las colecciones se cargan en
+# memoria y los estáticos se comprimen en un hilo aparte mientras /ping ya
+# responde; una petición que llegue antes carga solo lo que necesita. pandas
+# se importa con el primer reporte. Con STARTUP_MODE=completo todo eso se hace
+# antes de atender. Los tiempos de cada fase salen por consola, en /ping y en
+# startup_phase_seconds (/metrics). El archivado mensual empieza después del
+# precalentamiento.
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'rapido')
+tiempos_arranque = {}
+precalentado = threading.Event()
+metrics.gauge('startup_phase_seconds', 'Duración de cada fase del arranque del proceso.')
+
+def registrar_fase(fase, inicio, fin=None):
+    segundos = (fin or time.perf_counter()) - inicio
+    tiempos_arranque[fase] = round(segundos * 1000, 1)
+    metrics.set('startup_phase_seconds', segundos, fase=fase)
+
+def precalentar():
+    inicio = time.perf_counter()
+    for filepath in DATA_FILES:
+        try:
+            read_data(filepath)
+        except StorageError as e:
+            print(f"❌ No se pudo precargar {collection_name(filepath)}: {e}")
+    static_assets.precargar(app.static_folder)
+    registrar_fase('precalentamiento', inicio)
+    precalentado.set()
+    print(f"✅ Precalentamiento completo en {tiempos_arranque['precalentamiento']} ms")
+    if ARCHIVE_AUTO:
+        threading.Thread(target=archivar_periodicamente, name='archivo-mensual', daemon=True).start()
+
+def arrancar():
+    registrar_fase('importaciones', INICIO_ARRANQUE, FIN_IMPORTACIONES)
+    registrar_fase('definiciones', FIN_IMPORTACIONES)
+    inicio = time.perf_counter()
+    try:
+        initialize_data()
+    except (OSError, StorageError) as e:
+        print(f"❌ Error en inicialización: {e}")
+    registrar_fase('inicializacion', inicio)
+    if STARTUP_MODE == 'completo':
+        precalentar()
+    else:
+        threading.Thread(target=precalentar, name='precalentamiento', daemon=True).start()
+    registrar_fase('listo', INICIO_ARRANQUE)
+    print(f"✅ Listo para atender en {tiempos_arranque['listo']} ms "
+          f"(importaciones {tiempos_arranque['importaciones']} ms, definiciones {tiempos_arranque['definiciones']} ms, "
+          f"inicialización {tiempos_arranque['inicializacion']} ms)")
+
+arrancar()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     print(f"Servidor Flask iniciado en http://0.0.0.0:{port}")
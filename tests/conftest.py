@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# main.py trabaja con rutas relativas ('datos/...'): las pruebas corren sobre
+# una copia de los datos en una carpeta temporal, nunca sobre los reales
+TRABAJO = tempfile.mkdtemp(prefix='milhover-pruebas-')
+shutil.copytree(os.path.join(RAIZ, 'datos'), os.path.join(TRABAJO, 'datos'),
+                ignore=shutil.ignore_patterns('.locks', '*.db-wal', '*.db-shm'))
+os.chdir(TRABAJO)
+os.environ['STORE_FLUSH_INTERVAL'] = '0'
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main as modulo
+    return modulo
+
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+
+@pytest.fixture
+def carpeta(tmp_path):
+    """Carpeta vacía con su propio datos/ para procesos aparte."""
+    (tmp_path / 'datos').mkdir()
+    return tmp_path
+
+
+def iniciar_proceso(carpeta, codigo, **env):
+    """Lanza `python -c codigo` en `carpeta` con main importable."""
+    entorno = dict(os.environ, PYTHONPATH=RAIZ, **env)
+    return subprocess.Popen([sys.executable, '-c', codigo], cwd=str(carpeta), env=entorno,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def ejecutar(carpeta, codigo, **env):
+    """Corre `codigo` en un proceso aparte y devuelve su última línea de salida.
+
+    Con STARTUP_MODE=completo el precalentamiento termina dentro del import
+    de main: sus mensajes no se mezclan con la salida de `codigo`."""
+    proceso = iniciar_proceso(carpeta, codigo, **dict({'STARTUP_MODE': 'completo'}, **env))
+    salida, errores = proceso.communicate(timeout=120)
+    assert proceso.returncode == 0, errores
+    return salida.strip().splitlines()[-1]
@@ -0,0 +1,44 @@
+import json
+
+from conftest import ejecutar
+
+ARRANQUE = '''
+import json, os, time
+import main
+# El archivado automático corre en su hilo después del precalentamiento y
+# retiene el almacén mientras mueve los registros
+fin = time.monotonic() + (10 if main.ARCHIVE_AUTO else 1)
+while not os.path.exists('datos/archivo/ingresos/2020-01.json.gz') and time.monotonic() < fin:
+    time.sleep(0.05)
+cliente = main.app.test_client()
+todo = cliente.get('/api/data').get_json()
+ingresos = cliente.get('/api/data/ingresos').get_json()
+print(json.dumps({
+    'pedidos': [p['id'] for p in todo['pedidos']],
+    'ingresos': [i['id'] for i in todo['ingresos']],
+    'lista_ingresos': [i['id'] for i in ingresos],
+}))
+'''
+
+
+def sembrar(carpeta):
+    (carpeta / 'datos' / 'pedidos.json').write_text(json.dumps([
+        {'id': 'pedido-viejo', 'estado': 'entregado', 'fecha_creacion': '2020-01-10', 'fecha_entrega': '2020-01-15'},
+    ]))
+    (carpeta / 'datos' / 'ingresos.json').write_text(json.dumps([
+        {'id': 'ingreso-viejo', 'tipo': 'ingreso', 'fecha': '2020-01-10', 'importe': 100},
+    ]))
+
+
+def test_los_meses_cerrados_se_siguen_sirviendo_al_arrancar(carpeta):
+    sembrar(carpeta)
+    salida = json.loads(ejecutar(carpeta, ARRANQUE, STARTUP_MODE='completo'))
+    assert salida == {'pedidos': ['pedido-viejo'], 'ingresos': ['ingreso-viejo'], 'lista_ingresos': ['ingreso-viejo']}
+    assert not (carpeta / 'datos' / 'archivo' / 'ingresos').exists()
+
+
+def test_el_archivado_automatico_es_opcional(carpeta):
+    sembrar(carpeta)
+    salida = json.loads(ejecutar(carpeta, ARRANQUE, STARTUP_MODE='completo', ARCHIVE_AUTO='1'))
+    assert salida['ingresos'] == [] and salida['pedidos'] == []
+    assert list((carpeta / 'datos' / 'archivo' / 'ingresos').glob('2020-01*'))
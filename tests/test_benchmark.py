@@ -0,0 +1,11 @@
+import random
+
+import pytest
+
+import benchmark
+
+
+def test_las_recetas_generadas_cuestan_lo_que_calcula_el_motor(main):
+    costos = benchmark.generar_costos(random.Random(7), benchmark.ESCALAS['chica'])
+    for receta in costos['hamburguesas']:
+        assert receta['costoTotal'] == pytest.approx(main.cost_engine.costo_receta(costos, receta))
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+
+from conftest import ejecutar, iniciar_proceso
+
+
+def en_hilo(funcion):
+    """Corre `funcion` en un hilo y devuelve (hilo, resultado)."""
+    resultado = {}
+    hilo = threading.Thread(target=lambda: resultado.setdefault('valor', funcion()), daemon=True)
+    hilo.start()
+    return hilo, resultado
+
+
+@pytest.fixture
+def lectura_en_curso(main):
+    """Una lectura larga que retiene store.shared() hasta que se la suelta."""
+    adentro, soltar = threading.Event(), threading.Event()
+
+    def leer():
+        with main.store.shared():
+            adentro.set()
+            soltar.wait(10)
+
+    hilo = threading.Thread(target=leer, daemon=True)
+    hilo.start()
+    assert adentro.wait(5)
+    yield soltar
+    soltar.set()
+    hilo.join(5)
+
+
+def test_las_lecturas_corren_en_paralelo(main, lectura_en_curso):
+    hilo, resultado = en_hilo(lambda: main.app.test_client().get('/api/data/stock').status_code)
+    hilo.join(5)
+    assert resultado.get('valor') == 200
+
+
+def test_una_escritura_espera_a_las_lecturas_en_curso(main, lectura_en_curso):
+    hilo, resultado = en_hilo(lambda: main.app.test_client().post(
+        '/api/data/ingresos', json={'tipo': 'ingreso', 'importe': 1, 'descripcion': 'concurrencia'}).status_code)
+    hilo.join(0.3)
+    assert hilo.is_alive()
+    lectura_en_curso.set()
+    hilo.join(5)
+    assert resultado.get('valor') == 201
+
+
+def test_un_reporte_no_retiene_el_almacen(main, client, monkeypatch):
+    calculando, terminar = threading.Event(), threading.Event()
+
+    def reporte_lento(datos, anio, mes):
+        calculando.set()
+        terminar.wait(10)
+        return {'filas': [], 'totales': {'conceptos': sum(len(items) for items in datos[main.GASTOS_FILE].values())}}
+
+    monkeypatch.setitem(main.REPORTES, 'lento', (reporte_lento, (main.GASTOS_FILE,)))
+    hilo, resultado = en_hilo(lambda: main.app.test_client().get('/api/reportes/lento?anio=2025'))
+    assert calculando.wait(5)
+    # Mientras el reporte calcula, las escrituras no esperan
+    r = client.post('/api/data/ingresos', json={'tipo': 'ingreso', 'importe': 2, 'descripcion': 'durante reporte'})
+    assert r.status_code == 201
+    terminar.set()
+    hilo.join(5)
+    assert resultado['valor'].status_code == 200
+    assert resultado['valor'].json['totales']['conceptos'] > 0
+
+
+def test_read_write_lock_es_reentrante_para_el_escritor(main):
+    lock = main.ReadWriteLock()
+    lock.acquire_write()
+    lock.acquire_read()
+    lock.acquire_write()
+    lock.release_write()
+    lock.release_read()
+    lock.release_write()
+    hilo, resultado = en_hilo(lambda: (lock.acquire_read(), lock.release_read(), True)[-1])
+    hilo.join(5)
+    assert resultado.get('valor') is True
+
+
+# --- Varios procesos sobre la misma carpeta de datos ---
+
+STOCK_INICIAL = """
+import main
+main.store.insert_item(main.STOCK_FILE, {'id': 'pan', 'tipo': 'producto', 'descripcion': 'Pan', 'cantidad': 1000.0})
+print('ok')
+"""
+
+VENDEDOR = """
+import main
+c = main.app.test_client()
+for i in range(25):
+    r = c.post('/api/data/pedidos', json={'items': [{'descripcion': 'pan', 'cantidad': 1}]})
+    assert r.status_code == 201, r.data
+print('ok')
+"""
+
+STOCK_FINAL = """
+import main
+print(main.store.get_item(main.STOCK_FILE, 'pan')['cantidad'])
+"""
+
+
+def test_los_procesos_no_pierden_descuentos_de_stock(carpeta):
+    # Cada pedido lee, descuenta y guarda el stock: sin el bloqueo entre
+    # procesos, dos workers que leen a la vez pisan uno el descuento del otro
+    env = {'STORE_MULTIPROCESS': '1'}
+    ejecutar(carpeta, STOCK_INICIAL, **env)
+    procesos = [iniciar_proceso(carpeta, VENDEDOR, **env) for _ in range(4)]
+    for proceso in procesos:
+        salida, errores = proceso.communicate(timeout=120)
+        assert proceso.returncode == 0, errores
+    assert float(ejecutar(carpeta, STOCK_FINAL, **env)) == 1000 - 4 * 25
+
+
+RETENER_STOCK = """
+import time, main
+with main.CollectionLock(main.STOCK_FILE):
+    print('bloqueado', flush=True)
+    time.sleep(60)
+"""
+
+VENDER_UNO = """
+import main
+print(main.app.test_client().post('/api/data/pedidos', json={'items': [{'descripcion': 'pan', 'cantidad': 1}]}).status_code)
+"""
+
+
+def test_una_coleccion_bloqueada_por_otro_proceso_responde_503(carpeta):
+    env = {'STORE_MULTIPROCESS': '1'}
+    ejecutar(carpeta, STOCK_INICIAL, **env)
+    dueno = iniciar_proceso(carpeta, RETENER_STOCK, STARTUP_MODE='completo', **env)
+    try:
+        assert 'bloqueado\n' in iter(dueno.stdout.readline, '')
+        assert ejecutar(carpeta, VENDER_UNO, STORE_LOCK_TIMEOUT='0.3', **env) == '503'
+    finally:
+        dueno.kill()
+        dueno.communicate(timeout=30)
+    # Al terminar el proceso se libera el bloqueo y la misma venta pasa
+    assert ejecutar(carpeta, VENDER_UNO, **env) == '201'
+    assert float(ejecutar(carpeta, STOCK_FINAL, **env)) == 999
@@ -0,0 +1,71 @@
+import copy
+
+import pytest
+
+# Dos ingredientes y una receta que usa uno por id y otro solo por nombre:
+#   A: 100 / 4 unidades = 25 por unidad;  B: 30 / 10 unidades = 3 por unidad
+#   receta: 2 A + 5 B = 2 * 25 + 5 * 3 = 65
+COSTOS = {
+    'ingredientes': [
+        {'id': 'ing-a', 'nombre': 'Carne', 'costoBase': 100, 'cantidadBase': 4, 'usoPorHamburguesa': 2},
+        {'id': 'ing-b', 'nombre': 'Pan', 'costoBase': 30, 'cantidadBase': 10, 'usoPorHamburguesa': 1},
+    ],
+    'hamburguesas': [
+        {'id': 'rec-1', 'nombre': 'Doble', 'ingredientes': [
+            {'id': 'ing-a', 'nombre': 'Carne', 'cantidad': 2},
+            {'nombre': 'PAN', 'cantidad': 5},
+        ]},
+    ],
+}
+
+
+@pytest.fixture
+def costos(main, client):
+    """Carga COSTOS por la API y deja los costos originales al final."""
+    with main.store.shared():
+        original = copy.deepcopy(main.read_data(main.COSTOS_FILE))
+    assert client.post('/api/data/costos', json=copy.deepcopy(COSTOS)).status_code == 200
+    yield
+    with main.store.exclusive():
+        main.write_data(main.COSTOS_FILE, original)
+
+
+def receta(client):
+    return client.get('/api/data/costos').get_json()['hamburguesas'][0]
+
+
+def test_los_costos_coinciden_con_la_cuenta_a_mano(client, costos):
+    ingredientes = client.get('/api/data/costos').get_json()['ingredientes']
+    assert [i['costoPorUnidad'] for i in ingredientes] == [25, 3]
+    assert [i['costoRealPorHamburguesa'] for i in ingredientes] == [50, 3]
+    assert receta(client)['costoTotal'] == pytest.approx(65)
+
+    # Pan pasa a 60 / 10 = 6 por unidad: 2 * 25 + 5 * 6 = 80
+    respuesta = client.patch('/api/data/costos/ingredientes/ing-b', json={'costoBase': 60})
+    assert [h['costoTotal'] for h in respuesta.get_json()['hamburguesas']] == [pytest.approx(80)]
+    assert receta(client)['costoTotal'] == pytest.approx(80)
+
+    # Renombrado, la línea sin id ya no lo encuentra: 2 * 25 = 50
+    client.patch('/api/data/costos/ingredientes/ing-b', json={'nombre': 'Pan de papa'})
+    assert receta(client)['costoTotal'] == pytest.approx(50)
+
+    # Una sola carne: 25
+    client.patch('/api/data/costos/hamburguesas/rec-1', json={'ingredientes': [{'id': 'ing-a', 'cantidad': 1}]})
+    assert receta(client)['costoTotal'] == pytest.approx(25)
+
+
+def test_un_recalculo_fallido_no_deja_el_cambio_aplicado(main, client, costos, monkeypatch):
+    def falla(costos, receta):
+        raise RuntimeError('falla en el recálculo')
+
+    monkeypatch.setattr(main.cost_engine, 'costo_receta', falla)
+    with main.store.exclusive(), pytest.raises(RuntimeError):
+        main.cost_engine.actualizar_ingrediente('ing-b', {'costoBase': 60, 'nombre': 'Otro'})
+    monkeypatch.undo()
+
+    ingrediente = client.get('/api/data/costos').get_json()['ingredientes'][1]
+    assert (ingrediente['nombre'], ingrediente['costoBase'], ingrediente['costoPorUnidad']) == ('Pan', 30, 3)
+    assert receta(client)['costoTotal'] == pytest.approx(65)
+    # El índice del motor tampoco quedó con el cambio a medias
+    client.patch('/api/data/costos/ingredientes/ing-a', json={'costoBase': 200})
+    assert receta(client)['costoTotal'] == pytest.approx(2 * 50 + 5 * 3)
@@ -0,0 +1,97 @@
+import csv
+import io
+import threading
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def tandas_chicas(main, monkeypatch):
+    monkeypatch.setattr(main, 'CSV_CHUNK_ROWS', 2)
+
+
+def test_la_exportacion_no_retiene_el_almacen_mientras_se_envia(main, client, tandas_chicas):
+    clientes = main.read_data(main.CLIENTES_FILE)
+    esperados = [c['id'] for c in clientes]
+    primero, ultimo = esperados[0], esperados[-1]
+    respuesta = client.get('/api/data/clientes/exportar')
+    partes = (parte.decode('utf-8') for parte in respuesta.response)
+    texto = next(partes)
+
+    # Entre tandas el almacén está libre: una escritura no espera al envío
+    def modificar():
+        with main.store.exclusive():
+            main.store.update_item(main.CLIENTES_FILE, ultimo, {'nombre': 'CAMBIADO DURANTE LA EXPORTACION'})
+            main.store.insert_item(main.CLIENTES_FILE, {'id': str(uuid.uuid4()), 'nombre': 'NUEVO DURANTE LA EXPORTACION'})
+            main.store.delete_items(main.CLIENTES_FILE, [primero])
+    hilo = threading.Thread(target=modificar, daemon=True)
+    hilo.start()
+    hilo.join(5)
+    assert not hilo.is_alive()
+
+    texto += ''.join(partes)
+    filas = list(csv.DictReader(io.StringIO(texto)))
+    # Los registros son los del comienzo; los que faltan enviar se leen tal
+    # como están cuando sale su tanda
+    assert [f['id'] for f in filas] == esperados
+    assert filas[-1]['nombre'] == 'CAMBIADO DURANTE LA EXPORTACION'
+
+
+def test_una_escritura_en_curso_demora_la_tanda_siguiente(main, client, tandas_chicas):
+    respuesta = client.get('/api/data/stock/exportar')
+    partes = (parte.decode('utf-8') for parte in respuesta.response)
+    next(partes)
+    tomado, soltar = threading.Event(), threading.Event()
+
+    def escribir():
+        with main.store.exclusive():
+            tomado.set()
+            soltar.wait(5)
+    hilo = threading.Thread(target=escribir, daemon=True)
+    hilo.start()
+    assert tomado.wait(5)
+    resto = {}
+    lector = threading.Thread(target=lambda: resto.setdefault('texto', ''.join(partes)), daemon=True)
+    lector.start()
+    lector.join(0.2)
+    assert lector.is_alive()  # la tanda espera a que termine la escritura
+    soltar.set()
+    lector.join(5)
+    hilo.join(5)
+    assert resto['texto']
+
+
+def importar(client, coleccion, texto):
+    return client.post(f'/api/data/{coleccion}/importar', data=texto.encode('utf-8'), content_type='text/csv')
+
+
+def test_la_importacion_aplica_de_a_tandas(main, client, tandas_chicas):
+    codigos = [f'TANDA-{uuid.uuid4().hex[:6]}-{i}' for i in range(5)]
+    filas = ''.join(f'{c},titulo,Título {i}\n' for i, c in enumerate(codigos))
+    respuesta = importar(client, 'stock', 'codigo,tipo,descripcion\n' + filas)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['creados'] == 5
+    guardados = {item.get('codigo') for item in main.read_data(main.STOCK_FILE)}
+    assert set(codigos) <= guardados
+
+
+def test_una_fila_que_falla_al_aplicarse_conserva_las_tandas_anteriores(main, client, tandas_chicas):
+    codigos = [f'FALLA-{uuid.uuid4().hex[:6]}-{i}' for i in range(4)]
+    texto = ('codigo,tipo,descripcion,padre_id\n'
+             f'{codigos[0]},titulo,Uno,\n{codigos[1]},titulo,Dos,\n'
+             f'{codigos[2]},titulo,Tres,\n{codigos[3]},producto,Cuatro,no-existe\n')
+    respuesta = importar(client, 'stock', texto)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['filas_importadas'] == 2
+    guardados = {item.get('codigo') for item in main.read_data(main.STOCK_FILE)}
+    assert codigos[0] in guardados and codigos[1] in guardados
+    assert codigos[2] not in guardados and codigos[3] not in guardados
+
+
+def test_una_fila_invalida_no_importa_nada(main, client):
+    codigo = f'INVALIDA-{uuid.uuid4().hex[:6]}'
+    respuesta = importar(client, 'stock', f'codigo,tipo,descripcion\n{codigo},titulo,Uno\nOTRO,otro,Dos\n')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['errores'][0]['fila'] == 3
+    assert codigo not in {item.get('codigo') for item in main.read_data(main.STOCK_FILE)}
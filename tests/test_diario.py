@@ -0,0 +1,39 @@
+import json
+
+from conftest import ejecutar, iniciar_proceso
+
+ESCRITOR = """
+import main
+c = main.app.test_client()
+for i in range(40):
+    r = c.post('/api/data/ingresos', json={'tipo': 'ingreso', 'importe': i, 'descripcion': 'WORKER-%d' % i})
+    assert r.status_code == 201, r.data
+print('ok')
+"""
+
+CONTAR = """
+import json, main
+ingresos = main.read_data(main.INGRESOS_FILE)
+print(json.dumps(sorted(m['descripcion'] for m in ingresos)))
+"""
+
+
+def test_compactacion_con_varios_workers_no_pierde_registros(carpeta):
+    # Un diario chico obliga a compactar muchas veces mientras los otros
+    # procesos siguen agregando líneas
+    env = {'STORE_MULTIPROCESS': '1', 'JOURNAL_COMPACT_BYTES': '512'}
+    procesos = [iniciar_proceso(carpeta, ESCRITOR.replace('WORKER', f'w{w}'), **env) for w in range(4)]
+    for proceso in procesos:
+        salida, errores = proceso.communicate(timeout=120)
+        assert proceso.returncode == 0, errores
+
+    descripciones = json.loads(ejecutar(carpeta, CONTAR, **env))
+    assert descripciones == sorted(f'w{w}-{i}' for w in range(4) for i in range(40))
+    assert len(list((carpeta / 'datos' / 'diario').iterdir())) > 1  # hubo compactaciones
+
+
+def test_diario_se_reconstruye_al_reiniciar(carpeta):
+    ejecutar(carpeta, ESCRITOR.replace('WORKER', 'w0'))
+    descripciones = json.loads(ejecutar(carpeta, CONTAR))
+    assert descripciones == sorted(f'w0-{i}' for i in range(40))
+    assert (carpeta / 'datos' / 'diario' / 'ingresos.jsonl').exists()
@@ -0,0 +1,46 @@
+import os
+
+from conftest import RAIZ
+
+
+def test_evento_sse_usa_el_serializador_compartido(main):
+    datos = {'descripcion': 'Hamburguesa doble ñandú', 'importe': 1.5}
+    texto = main.evento_sse('pedido', datos, 'a.1')
+    assert texto == 'id: a.1\nevent: pedido\ndata: ' + main.serializar_texto(datos) + '\n\n'
+
+
+def test_un_cursor_desconocido_recibe_resync(main, client):
+    respuesta = client.get('/api/events', query_string={'since': 'no-es-un-cursor'})
+    try:
+        partes = (parte.decode('utf-8') for parte in respuesta.response)
+        assert next(partes).startswith('retry:')
+        resync = next(partes)
+    finally:
+        respuesta.close()
+    assert resync.startswith('event: resync\ndata: ')
+    assert main.deserializar(resync.split('data: ', 1)[1])['revision'] == main.store.revision_token()
+
+
+def test_al_llegar_al_limite_de_suscriptores_responde_503(main, client, monkeypatch):
+    antes = main.event_bus.subscribers
+    monkeypatch.setattr(main, 'EVENTS_MAX_SUBSCRIBERS', antes + 2)
+    abiertas = [client.get('/api/events') for _ in range(2)]
+    try:
+        assert [r.status_code for r in abiertas] == [200, 200]
+        rechazada = client.get('/api/events')
+        assert rechazada.status_code == 503
+        assert 'error' in rechazada.get_json()
+        # Cerrar una conexión, aunque no haya leído nada, libera su lugar
+        abiertas.pop().close()
+        abiertas.append(client.get('/api/events'))
+        assert abiertas[-1].status_code == 200
+    finally:
+        for respuesta in abiertas:
+            respuesta.close()
+    assert main.event_bus.subscribers == antes
+
+
+def test_el_procfile_deja_hilos_libres_ademas_de_los_suscriptores(main):
+    with open(os.path.join(RAIZ, 'procfile')) as f:
+        hilos = int(f.read().split('--threads')[1].split()[0])
+    assert hilos - main.EVENTS_MAX_SUBSCRIBERS >= 32
@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from conftest import RAIZ, ejecutar
+
+# Lo que devuelve la API para cada mes guardado en gastos.json
+MESES_GUARDADOS = '''
+import json, main
+c = main.app.test_client()
+meses = json.load(open('datos/gastos.json'))
+print(json.dumps({f'{anio}/{mes}': c.get(f'/api/data/gastos/month/{mes}/year/{anio}').get_json()
+                  for anio, por_mes in meses.items() for mes in por_mes}, sort_keys=True))
+'''
+
+
+def test_compactar_gastos_no_cambia_lo_que_devuelve_la_api(carpeta):
+    shutil.copytree(os.path.join(RAIZ, 'datos'), carpeta / 'datos', dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('.locks', '*.db', '*.db-wal', '*.db-shm'))
+    archivo = carpeta / 'datos' / 'gastos.json'
+    gastos = json.loads(archivo.read_text())
+    # Un concepto agregado a mano en un solo mes
+    gastos['2027']['Marzo'].append({'concepto': 'AGREGADO A MANO', 'monto': '5', 'fecha': '', 'pagado': 'no'})
+    archivo.write_text(json.dumps(gastos))
+
+    antes = json.loads(ejecutar(carpeta, MESES_GUARDADOS))
+    compactacion = subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'compactar-gastos'], cwd=str(carpeta),
+                                  env=dict(os.environ, PYTHONPATH=RAIZ), capture_output=True, text=True, timeout=120)
+    assert compactacion.returncode == 0, compactacion.stderr
+
+    compactado = json.loads(archivo.read_text())
+    assert sum(map(len, compactado.values())) < sum(map(len, gastos.values()))
+    guardados = {f'{anio}/{mes}' for anio, por_mes in gastos.items() for mes in por_mes}
+    despues = json.loads(ejecutar(carpeta, MESES_GUARDADOS.replace("json.load(open('datos/gastos.json'))", repr(
+        {anio: list(por_mes) for anio, por_mes in gastos.items()}))))
+    assert set(despues) == guardados
+    assert despues == antes
+    assert {'concepto': 'AGREGADO A MANO', 'monto': '5', 'fecha': '', 'pagado': 'no'} in despues['2027/Marzo']
+    assert 'AGREGADO A MANO' not in [g['concepto'] for g in despues['2027/Abril']]
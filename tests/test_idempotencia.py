@@ -0,0 +1,67 @@
+import threading
+import time
+import uuid
+
+
+def clave():
+    return {'Idempotency-Key': uuid.uuid4().hex}
+
+
+def movimiento(descripcion):
+    return {'tipo': 'ingreso', 'importe': 1, 'descripcion': descripcion}
+
+
+def cuantos(main, descripcion):
+    return sum(1 for item in main.read_data(main.INGRESOS_FILE) if item.get('descripcion') == descripcion)
+
+
+def test_un_reintento_recibe_la_respuesta_guardada(main, client):
+    descripcion, cabeceras = 'idempotencia ' + uuid.uuid4().hex, clave()
+    primera = client.post('/api/data/ingresos', json=movimiento(descripcion), headers=cabeceras)
+    segunda = client.post('/api/data/ingresos', json=movimiento(descripcion), headers=cabeceras)
+    assert primera.status_code == segunda.status_code == 201
+    assert segunda.headers['Idempotent-Replayed'] == 'true'
+    assert segunda.get_json() == primera.get_json()
+    assert cuantos(main, descripcion) == 1
+
+
+def test_la_misma_clave_con_otro_cuerpo_es_422(main, client):
+    cabeceras = clave()
+    assert client.post('/api/data/ingresos', json=movimiento('a ' + uuid.uuid4().hex), headers=cabeceras).status_code == 201
+    otra = 'b ' + uuid.uuid4().hex
+    assert client.post('/api/data/ingresos', json=movimiento(otra), headers=cabeceras).status_code == 422
+    assert cuantos(main, otra) == 0
+
+
+def test_la_misma_clave_en_curso_es_409(main, client, monkeypatch):
+    adentro, soltar = threading.Event(), threading.Event()
+    leer = main.filas_subidas
+
+    def lento():
+        adentro.set()
+        soltar.wait(10)
+        return leer()
+    monkeypatch.setattr(main, 'filas_subidas', lento)
+
+    cabeceras, texto = clave(), 'codigo,tipo,descripcion\nIDEM-%s,titulo,Uno\n' % uuid.uuid4().hex[:6]
+    importar = lambda c: c.post('/api/data/stock/importar', data=texto, content_type='text/csv', headers=cabeceras)
+    resultado = {}
+    hilo = threading.Thread(target=lambda: resultado.setdefault('status', importar(main.app.test_client()).status_code))
+    hilo.start()
+    assert adentro.wait(5)
+    assert importar(client).status_code == 409
+    soltar.set()
+    hilo.join(10)
+    assert resultado['status'] == 200
+    repetida = importar(client)
+    assert repetida.status_code == 200 and repetida.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_la_clave_vence_despues_del_ttl(main, client, monkeypatch):
+    monkeypatch.setattr(main, 'idempotency_cache', main.TTLCache(100, 0.05))
+    descripcion, cabeceras = 'ttl ' + uuid.uuid4().hex, clave()
+    assert client.post('/api/data/ingresos', json=movimiento(descripcion), headers=cabeceras).status_code == 201
+    time.sleep(0.1)
+    otra = client.post('/api/data/ingresos', json=movimiento(descripcion), headers=cabeceras)
+    assert otra.status_code == 201 and 'Idempotent-Replayed' not in otra.headers
+    assert cuantos(main, descripcion) == 2
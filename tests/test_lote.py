@@ -0,0 +1,51 @@
+import json
+import os
+import uuid
+
+from conftest import ejecutar
+
+# Lo que hay en disco, leído por otro proceso
+EN_DISCO = '''
+import json, main
+print(json.dumps({
+    'stock': {s['id']: s.get('descripcion') for s in main.read_data(main.STOCK_FILE)},
+    'ingresos': [i['id'] for i in main.read_data(main.INGRESOS_FILE)],
+}))
+'''
+
+
+def test_un_lote_que_falla_deshace_las_operaciones_anteriores(main, client):
+    existente = main.read_data(main.STOCK_FILE)[0]
+    descripcion = existente.get('descripcion')
+    marca = uuid.uuid4().hex
+    antes = json.loads(ejecutar(os.getcwd(), EN_DISCO))
+    respuesta = client.post('/api/data/batch', json={'operaciones': [
+        {'coleccion': 'stock', 'accion': 'crear', 'datos': {'id': 'lote-' + marca, 'tipo': 'titulo', 'descripcion': marca}},
+        {'coleccion': 'ingresos', 'accion': 'crear', 'datos': {'tipo': 'ingreso', 'importe': 1, 'descripcion': marca}},
+        {'coleccion': 'stock', 'accion': 'actualizar', 'id': existente['id'], 'datos': {'descripcion': marca}},
+        {'coleccion': 'vencimientos', 'accion': 'eliminar', 'id': 'no-existe-' + marca},
+    ]})
+    assert respuesta.status_code == 404
+
+    # En memoria
+    assert main.store.get_item(main.STOCK_FILE, 'lote-' + marca) is None
+    assert main.store.get_item(main.STOCK_FILE, existente['id']).get('descripcion') == descripcion
+    assert not [i for i in main.read_data(main.INGRESOS_FILE) if i.get('descripcion') == marca]
+    # En disco
+    assert json.loads(ejecutar(os.getcwd(), EN_DISCO)) == antes
+
+
+def test_un_lote_correcto_aplica_todo(main, client):
+    existente = main.read_data(main.STOCK_FILE)[0]
+    descripcion = existente.get('descripcion')
+    marca = uuid.uuid4().hex
+    respuesta = client.post('/api/data/batch', json={'operaciones': [
+        {'coleccion': 'stock', 'accion': 'crear', 'datos': {'tipo': 'titulo', 'descripcion': marca}},
+        {'coleccion': 'stock', 'accion': 'actualizar', 'id': existente['id'], 'datos': {'descripcion': marca}},
+    ]})
+    assert respuesta.status_code == 200
+    creado = respuesta.get_json()['resultados'][0]['resultado']['id']
+    en_disco = json.loads(ejecutar(os.getcwd(), EN_DISCO))['stock']
+    assert en_disco[creado] == en_disco[existente['id']] == marca
+    client.delete(f'/api/data/stock/{creado}')
+    client.put(f"/api/data/stock/{existente['id']}", json={'descripcion': descripcion})
@@ -0,0 +1,80 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def ingresos(main):
+    """Inserta ingresos de prueba con un 'tipo' propio y los quita al final."""
+    tipo = 'prueba-' + uuid.uuid4().hex[:8]
+    creados = []
+
+    def crear(fechas):
+        with main.store.exclusive():
+            for fecha in fechas:
+                item = {'id': str(uuid.uuid4()), 'tipo': tipo, 'fecha': fecha, 'importe': 1}
+                creados.append(main.store.insert_item(main.INGRESOS_FILE, item))
+        return creados
+
+    crear.tipo = tipo
+    yield crear
+    with main.store.exclusive():
+        main.store.delete_items(main.INGRESOS_FILE, [item['id'] for item in creados])
+
+
+def paginas(client, consulta):
+    """Todos los registros de una consulta paginada, siguiendo X-Next-Cursor."""
+    registros, cursor = [], None
+    while True:
+        respuesta = client.get('/api/data/ingresos', query_string=dict(consulta, **({'after': cursor} if cursor else {})))
+        assert respuesta.status_code == 200
+        registros.extend(respuesta.get_json())
+        cursor = respuesta.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return registros
+
+
+def test_las_paginas_recorren_cada_registro_una_vez(client, ingresos):
+    creados = ingresos([f'2030-0{1 + i % 9}-1{i % 10}' for i in range(25)])
+    vistos = paginas(client, {'tipo': ingresos.tipo, 'limit': 7})
+    assert [r['id'] for r in vistos] == [r['id'] for r in sorted(creados, key=lambda r: (r['fecha'], r['id']))]
+
+
+def test_el_cursor_sigue_valiendo_si_se_borra_su_registro(main, client, ingresos):
+    creados = ingresos([f'2031-01-{d:02d}' for d in range(1, 7)])
+    respuesta = client.get('/api/data/ingresos', query_string={'tipo': ingresos.tipo, 'limit': 3})
+    cursor = respuesta.headers['X-Next-Cursor']
+    with main.store.exclusive():
+        main.store.delete_items(main.INGRESOS_FILE, [respuesta.get_json()[-1]['id']])
+    siguiente = client.get('/api/data/ingresos', query_string={'tipo': ingresos.tipo, 'limit': 3, 'after': cursor})
+    assert [r['id'] for r in siguiente.get_json()] == [r['id'] for r in creados[3:]]
+
+
+def test_una_fecha_modificada_mueve_el_registro_en_el_orden(main, client, ingresos):
+    creados = ingresos(['2032-01-01', '2032-01-02', '2032-01-03'])
+    with main.store.exclusive():
+        main.store.update_item(main.INGRESOS_FILE, creados[0]['id'], {'fecha': '2032-01-04'})
+    vistos = paginas(client, {'tipo': ingresos.tipo, 'limit': 2})
+    assert [r['id'] for r in vistos] == [creados[1]['id'], creados[2]['id'], creados[0]['id']]
+
+
+def test_sin_limit_ni_after_devuelve_todos_los_que_coinciden(main, client, ingresos):
+    ingresos(['2033-05-01'] * (main.MAX_PAGE_LIMIT + 50))
+    respuesta = client.get('/api/data/ingresos', query_string={'tipo': ingresos.tipo})
+    assert len(respuesta.get_json()) == main.MAX_PAGE_LIMIT + 50
+    assert 'X-Next-Cursor' not in respuesta.headers
+
+
+def test_un_cursor_invalido_es_un_error(client):
+    respuesta = client.get('/api/data/ingresos', query_string={'limit': 2, 'after': 'no-existe'})
+    assert respuesta.status_code == 400
+
+
+def test_el_rango_de_fechas_incluye_los_meses_archivados(main, client, ingresos):
+    activos = ingresos(['2001-03-15', '2001-01-20'])
+    archivados = [{'id': str(uuid.uuid4()), 'tipo': ingresos.tipo, 'fecha': f'2001-0{m}-10', 'importe': 1} for m in (1, 2)]
+    with main.store.exclusive():
+        for item in archivados:
+            main.archivo_mensual.agregar(main.INGRESOS_FILE, item['fecha'][:7], [item])
+    vistos = paginas(client, {'tipo': ingresos.tipo, 'desde': '2001-01-01', 'hasta': '2001-02-28', 'limit': 1})
+    assert [r['id'] for r in vistos] == [archivados[0]['id'], activos[1]['id'], archivados[1]['id']]
@@ -0,0 +1,143 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def producto(main):
+    """Un ítem de stock con 10 unidades, que se vende con su descripción."""
+    item = {'id': str(uuid.uuid4()), 'tipo': 'producto', 'descripcion': 'prueba-' + uuid.uuid4().hex[:8], 'cantidad': 10.0}
+    with main.store.exclusive():
+        main.store.insert_item(main.STOCK_FILE, item)
+        main.invalidar_plan_stock()
+    yield item
+    with main.store.exclusive():
+        main.store.delete_items(main.STOCK_FILE, [item['id']])
+        main.invalidar_plan_stock()
+
+
+@pytest.fixture
+def receta(main, producto):
+    """Una hamburguesa que lleva medio `producto` por unidad."""
+    nombre = 'receta-' + uuid.uuid4().hex[:8]
+    ingrediente = {'id': 'ing-' + nombre, 'nombre': producto['descripcion'], 'usoPorHamburguesa': 0.5}
+    hamburguesa = {'id': 'ham-' + nombre, 'nombre': nombre, 'ingredientes': [{'id': ingrediente['id'], 'nombre': ingrediente['nombre'], 'cantidad': 1}]}
+    with main.store.exclusive():
+        costos = main.read_data(main.COSTOS_FILE)
+        costos['ingredientes'].append(ingrediente)
+        costos['hamburguesas'].append(hamburguesa)
+        main.write_data(main.COSTOS_FILE, costos)
+    yield nombre
+    with main.store.exclusive():
+        costos = main.read_data(main.COSTOS_FILE)
+        costos['ingredientes'].remove(ingrediente)
+        costos['hamburguesas'].remove(hamburguesa)
+        main.write_data(main.COSTOS_FILE, costos)
+
+
+@pytest.fixture
+def pedidos(client):
+    """Crea pedidos por la API y borra al final los que sigan existiendo."""
+    creados = []
+
+    def crear(**pedido):
+        respuesta = client.post('/api/data/pedidos', json=pedido)
+        assert respuesta.status_code == 201
+        creados.append(respuesta.get_json()['id'])
+        return respuesta.get_json()
+
+    yield crear
+    for pedido_id in creados:
+        client.delete(f'/api/data/pedidos/{pedido_id}')
+
+
+def stock(main, item):
+    return main.store.get_item(main.STOCK_FILE, item['id'])['cantidad']
+
+
+def escrituras_de_stock(main):
+    return main.store.version(main.STOCK_FILE)
+
+
+def test_editar_un_pedido_mueve_el_stock_por_diferencia(main, client, producto, pedidos):
+    pedido = pedidos(items=[{'descripcion': producto['descripcion'], 'cantidad': 2}])
+    assert stock(main, producto) == 8
+
+    # Mismos items: la reposición y el descuento se anulan y no se escribe nada
+    antes = escrituras_de_stock(main)
+    assert client.put(f"/api/data/pedidos/{pedido['id']}", json={'nota': 'sin cambios de items'}).status_code == 200
+    assert escrituras_de_stock(main) == antes
+    assert stock(main, producto) == 8
+
+    # Dos líneas del mismo ítem: una sola escritura con el neto (10 - 3 - 4)
+    items = [{'descripcion': producto['descripcion'], 'cantidad': 3}, {'descripcion': producto['descripcion'].upper(), 'cantidad': 4}]
+    client.put(f"/api/data/pedidos/{pedido['id']}", json={'items': items})
+    assert escrituras_de_stock(main) == antes + 1
+    assert stock(main, producto) == 3
+
+    client.delete(f"/api/data/pedidos/{pedido['id']}")
+    assert stock(main, producto) == 10
+
+
+def test_receta_e_item_directo_se_netean_en_un_solo_cambio(main, client, producto, receta, pedidos):
+    antes = escrituras_de_stock(main)
+    # 2 hamburguesas * 0.5 + 1 unidad suelta = 2 unidades del mismo ítem
+    pedido = pedidos(items=[{'descripcion': receta, 'cantidad': 2}, {'descripcion': producto['descripcion'], 'cantidad': 1}])
+    assert stock(main, producto) == 8
+    assert escrituras_de_stock(main) == antes + 1
+
+    # Una hamburguesa menos (-0.5) y media unidad suelta más (+0.5): neto cero
+    items = [{'descripcion': receta, 'cantidad': 1}, {'descripcion': producto['descripcion'], 'cantidad': 1.5}]
+    client.put(f"/api/data/pedidos/{pedido['id']}", json={'items': items})
+    assert escrituras_de_stock(main) == antes + 1
+    assert stock(main, producto) == 8
+
+
+@pytest.fixture
+def direcciones(main):
+    """Direcciones nuevas; sus clientes se borran al final."""
+    creadas = []
+
+    def nueva():
+        creadas.append(f'Calle Prueba {uuid.uuid4().hex[:8]} 123')
+        return creadas[-1]
+
+    yield nueva
+    with main.store.exclusive():
+        for direccion in creadas:
+            clientes = main.store.find_items(main.CLIENTES_FILE, 'direccion', main.normalizar_direccion(direccion))
+            main.store.delete_items(main.CLIENTES_FILE, [c['id'] for c in clientes])
+
+
+def assert_contadores_al_dia(main, *direcciones):
+    """Los contadores guardados de cada cliente coinciden con un recálculo completo."""
+    with main.store.shared():
+        calculado = main.calcular_estadisticas_clientes()
+        for direccion in direcciones:
+            clave = main.normalizar_direccion(direccion)
+            cliente, = main.store.find_items(main.CLIENTES_FILE, 'direccion', clave)
+            assert (cliente['cantidad_pedidos'], cliente['ultimo_pedido_fecha']) == calculado.get(clave, (0, None))
+
+
+def test_los_contadores_de_clientes_siguen_al_recalculo_completo(main, client, pedidos, direcciones):
+    casa, trabajo = direcciones(), direcciones()
+    primero = pedidos(direccion=casa, items=[])
+    segundo = pedidos(direccion=casa, items=[])
+    assert_contadores_al_dia(main, casa)
+
+    # Pendiente deja de contar; volver a entregado cuenta otra vez
+    client.put(f"/api/data/pedidos/{segundo['id']}", json={'estado': 'pendiente'})
+    assert_contadores_al_dia(main, casa)
+    client.put(f"/api/data/pedidos/{segundo['id']}", json={'estado': 'entregado'})
+    assert_contadores_al_dia(main, casa)
+
+    # Cambiar la dirección pasa el pedido de un cliente al otro
+    client.put(f"/api/data/pedidos/{segundo['id']}", json={'direccion': trabajo})
+    assert_contadores_al_dia(main, casa, trabajo)
+
+    # Borrar el más reciente de un cliente recupera la fecha del anterior
+    tercero = pedidos(direccion=trabajo, items=[])
+    client.delete(f"/api/data/pedidos/{tercero['id']}")
+    assert_contadores_al_dia(main, casa, trabajo)
+    client.delete(f"/api/data/pedidos/{primero['id']}")
+    assert_contadores_al_dia(main, casa, trabajo)
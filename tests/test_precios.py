@@ -0,0 +1,62 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def item_con_precio(main):
+    item = {'id': str(uuid.uuid4()), 'tipo': 'item', 'descripcion': 'Prueba de ajuste'}
+    with main.store.exclusive():
+        main.store.insert_item(main.PRECIOS_FILE, item)
+        main.registrar_precio(item['id'], '2020-01-01', 100)
+    yield item
+    with main.store.exclusive():
+        main.store.delete_items(main.PRECIOS_FILE, [item['id']])
+
+
+@pytest.mark.parametrize('ids', ['abc', {'id': 'x'}, [['x']], [None]])
+def test_ajuste_rechaza_ids_que_no_son_una_lista_de_ids(client, ids):
+    respuesta = client.post('/api/data/precios/ajuste', json={'ids': ids, 'porcentaje': 10})
+    assert respuesta.status_code == 400
+
+
+def test_ajuste_marca_el_item_como_modificado(main, client, item_con_precio):
+    revision = main.store.revision
+    respuesta = client.post('/api/data/precios/ajuste', json={'ids': [item_con_precio['id']], 'porcentaje': 10, 'fecha': '2030-01-01'})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['actualizados'][0]['nuevo'] == 110
+    cambios = main.store.changes_since(revision, {main.PRECIOS_FILE})
+    assert item_con_precio['id'] in cambios[main.PRECIOS_FILE]['upserts']
+
+
+def test_touch_item_no_cambia_el_registro(main, item_con_precio):
+    antes = dict(item_con_precio)
+    with main.store.exclusive():
+        assert main.store.touch_item(main.PRECIOS_FILE, item_con_precio['id']) is item_con_precio
+        assert main.store.touch_item(main.PRECIOS_FILE, 'no-existe') is None
+    assert item_con_precio == antes
+
+
+def test_un_ajuste_que_falla_a_mitad_no_deja_precios_cambiados(main, client, item_con_precio, monkeypatch):
+    otro = {'id': str(uuid.uuid4()), 'tipo': 'item', 'descripcion': 'Prueba de ajuste 2'}
+    with main.store.exclusive():
+        main.store.insert_item(main.PRECIOS_FILE, otro)
+        main.registrar_precio(otro['id'], '2020-01-01', 50)
+    tocar = main.store.touch_item
+    llamadas = []
+
+    def fallar_en_la_segunda(filepath, key):
+        llamadas.append(key)
+        if len(llamadas) == 2:
+            raise RuntimeError('falla a mitad del reajuste')
+        return tocar(filepath, key)
+    monkeypatch.setattr(main.store, 'touch_item', fallar_en_la_segunda)
+
+    ids = [item_con_precio['id'], otro['id']]
+    respuesta = client.post('/api/data/precios/ajuste', json={'ids': ids, 'porcentaje': 10, 'fecha': '2030-01-01'})
+    assert respuesta.status_code == 500
+    assert len(llamadas) == 2
+    assert main.historial_de(item_con_precio['id']) == {'2020-01-01': 100}
+    assert main.historial_de(otro['id']) == {'2020-01-01': 50}
+    with main.store.exclusive():
+        main.store.delete_items(main.PRECIOS_FILE, [otro['id']])
@@ -0,0 +1,81 @@
+import json
+import uuid
+
+import pytest
+
+from conftest import ejecutar
+
+
+@pytest.fixture
+def producto(main):
+    """Un ítem de stock de prueba que se quita al final."""
+    creados = []
+
+    def crear():
+        item = {'id': str(uuid.uuid4()), 'nombre': 'prueba-' + uuid.uuid4().hex[:8], 'cantidad': 1}
+        with main.store.exclusive():
+            creados.append(main.store.insert_item(main.STOCK_FILE, item))
+        return item
+
+    yield crear
+    with main.store.exclusive():
+        main.store.delete_items(main.STOCK_FILE, [item['id'] for item in creados])
+
+
+def test_since_devuelve_solo_lo_que_cambio(main, client, producto):
+    revision = client.get('/api/data').get_etag()[0]
+    item = producto()
+    delta = client.get('/api/data', query_string={'since': revision}).get_json()
+    assert list(delta['colecciones']) == ['stock']
+    assert [r['id'] for r in delta['colecciones']['stock']['cambios']] == [item['id']]
+
+    with main.store.exclusive():
+        main.store.delete_items(main.STOCK_FILE, [item['id']])
+    delta = client.get('/api/data', query_string={'since': delta['revision']}).get_json()
+    assert delta['colecciones'] == {'stock': {'cambios': [], 'eliminados': [item['id']]}}
+
+
+def test_una_revision_desconocida_devuelve_todo_completo(main, client):
+    delta = client.get('/api/data', query_string={'since': 'otra.5'}).get_json()
+    assert set(delta['colecciones']) == set(main.BOOTSTRAP_COLLECTIONS)
+    assert all(list(c) == ['completa'] for c in delta['colecciones'].values())
+
+
+def test_if_none_match_sin_cambios_responde_304(client, producto):
+    etag = client.get('/api/data').headers['ETag']
+    assert client.get('/api/data', headers={'If-None-Match': etag}).status_code == 304
+    producto()
+    assert client.get('/api/data', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_los_procesos_comparten_la_epoca(carpeta):
+    codigo = "import main; print(main.store.revision_token().split('_')[1].split('.')[0])"
+    assert ejecutar(carpeta, codigo, STORE_MULTIPROCESS='1') == ejecutar(carpeta, codigo, STORE_MULTIPROCESS='1')
+
+
+# Dos workers en un mismo proceso de prueba: la app con su almacén y un
+# segundo DataStore multiproceso sobre la misma carpeta de datos
+DOS_WORKERS = """
+import json, main
+cliente = main.app.test_client()
+cliente.get('/api/data')
+otro = main.DataStore(main.make_backend('json'), 0, multiprocess=True, default_factory=main.default_for)
+token = otro.revision_token()
+for filepath in main.BOOTSTRAP_COLLECTIONS.values():
+    otro.read(filepath)
+resultado = {'sin_cambios': cliente.get('/api/data', query_string={'since': token}).get_json()['colecciones'],
+             'estado': cliente.get('/api/data', headers={'If-None-Match': f'"{token}"'}).status_code}
+otro.insert_item(main.STOCK_FILE, {'id': 'nuevo', 'nombre': 'nuevo', 'cantidad': 1})
+resultado['delta'] = cliente.get('/api/data', query_string={'since': token}).get_json()['colecciones']
+resultado['estado_despues'] = cliente.get('/api/data', headers={'If-None-Match': f'"{token}"'}).status_code
+print(json.dumps(resultado))
+"""
+
+
+def test_la_revision_de_otro_worker_sirve_para_el_delta_y_el_304(carpeta):
+    resultado = json.loads(ejecutar(carpeta, DOS_WORKERS, STORE_MULTIPROCESS='1'))
+    assert resultado['sin_cambios'] == {}
+    assert resultado['estado'] == 304
+    assert list(resultado['delta']) == ['stock']
+    assert [r['id'] for r in resultado['delta']['stock']['completa']] == ['nuevo']
+    assert resultado['estado_despues'] == 200
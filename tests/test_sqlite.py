@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import RAIZ, ejecutar
+
+# Todo /api/data, para comparar lo que sirve cada backend
+VOLCAR = '''
+import json, main
+print(json.dumps(main.app.test_client().get('/api/data').get_json(), sort_keys=True))
+'''
+
+CAMBIOS = '''
+import json, main
+c = main.app.test_client()
+nuevo = c.post('/api/data/ingresos', json={'tipo': 'ingreso', 'importe': 123, 'descripcion': 'sqlite', 'fecha': '2030-01-01'}).get_json()
+borrado = main.read_data(main.INGRESOS_FILE)[0]['id']
+assert c.delete(f'/api/data/ingresos/{borrado}').status_code == 200
+titulo = c.post('/api/data/stock', json={'tipo': 'titulo', 'descripcion': 'SQLITE'}).get_json()
+assert c.put(f"/api/data/stock/{titulo['id']}", json={'descripcion': 'SQLITE EDITADO'}).status_code == 200
+gastos = [{'concepto': 'LUZ SQLITE', 'monto': '10', 'fecha': '', 'pagado': 'no'}]
+assert c.put('/api/data/gastos/month/Marzo/year/2030', json=gastos).status_code == 200
+print(json.dumps({'nuevo': nuevo['id'], 'borrado': borrado, 'titulo': titulo['id']}))
+'''
+
+
+@pytest.fixture
+def datos_migrados(carpeta):
+    """Copia de los datos del repositorio migrada a SQLite con migrar-sqlite."""
+    shutil.copytree(os.path.join(RAIZ, 'datos'), carpeta / 'datos', dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('.locks', '*.db', '*.db-wal', '*.db-shm'))
+    migracion = subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'migrar-sqlite'], cwd=str(carpeta),
+                               env=dict(os.environ, PYTHONPATH=RAIZ), capture_output=True, text=True, timeout=120)
+    assert migracion.returncode == 0, migracion.stderr
+    assert 'Migración completada' in migracion.stdout
+    return carpeta
+
+
+def test_migrar_sqlite_conserva_todas_las_colecciones(datos_migrados):
+    en_json = json.loads(ejecutar(datos_migrados, VOLCAR))
+    en_sqlite = json.loads(ejecutar(datos_migrados, VOLCAR, STORE_BACKEND='sqlite'))
+    assert en_sqlite == en_json
+
+
+def test_los_cambios_en_sqlite_sobreviven_al_reinicio(datos_migrados):
+    ids = json.loads(ejecutar(datos_migrados, CAMBIOS, STORE_BACKEND='sqlite'))
+    datos = json.loads(ejecutar(datos_migrados, VOLCAR, STORE_BACKEND='sqlite'))
+    ingresos = {i['id'] for i in datos['ingresos']}
+    assert ids['nuevo'] in ingresos and ids['borrado'] not in ingresos
+    titulo = next(s for s in datos['stock'] if s['id'] == ids['titulo'])
+    assert titulo['descripcion'] == 'SQLITE EDITADO'
+    assert datos['gastos']['2030']['Marzo'] == [{'concepto': 'LUZ SQLITE', 'monto': '10', 'fecha': '', 'pagado': 'no'}]
+    # Los archivos JSON no se tocan: siguen como antes de la migración
+    en_json = json.loads(ejecutar(datos_migrados, VOLCAR))
+    assert ids['nuevo'] not in {i['id'] for i in en_json['ingresos']}
@@ -0,0 +1,118 @@
+import json
+import threading
+import uuid
+
+import pytest
+
+from conftest import ejecutar
+
+
+@pytest.fixture
+def usuario(main):
+    """Un usuario con contraseña en texto plano, como los de antes del hash."""
+    datos = {'usuario': 'prueba-' + uuid.uuid4().hex[:8], 'contrasena': 'secreta', 'rol': 'admin'}
+    with main.store.exclusive():
+        main.store.insert_item(main.USERS_FILE, dict(datos))
+    yield datos
+    with main.store.exclusive():
+        main.revocar_sesiones(datos['usuario'])
+        main.store.delete_items(main.USERS_FILE, [datos['usuario']])
+
+
+def login(client, usuario, **kwargs):
+    return client.post('/api/data/users/authenticate',
+                       json={'username': usuario['usuario'], 'password': usuario['contrasena']}, **kwargs)
+
+
+def test_el_login_pasa_la_contrasena_a_hash(main, client, usuario):
+    assert login(client, usuario).status_code == 200
+    guardado = main.store.get_item(main.USERS_FILE, usuario['usuario'])
+    assert 'contrasena' not in guardado and guardado['contrasena_hash'].startswith(('scrypt:', 'pbkdf2:'))
+    assert login(client, usuario).status_code == 200
+
+
+def test_el_hash_se_verifica_sin_retener_el_almacen(main, client, usuario, monkeypatch):
+    assert login(client, usuario).status_code == 200
+    main.credenciales_verificadas._items.clear()
+    adentro, soltar = threading.Event(), threading.Event()
+    verificar = main.check_password_hash
+
+    def lento(hash_guardado, password):
+        adentro.set()
+        soltar.wait(10)
+        return verificar(hash_guardado, password)
+    monkeypatch.setattr(main, 'check_password_hash', lento)
+
+    resultado = {}
+    hilo = threading.Thread(target=lambda: resultado.setdefault('status', login(main.app.test_client(), usuario).status_code))
+    hilo.start()
+    assert adentro.wait(5)
+    # Mientras el hash se verifica, una escritura no espera
+    escritura = client.post('/api/data/ingresos', json={'tipo': 'ingreso', 'importe': 1, 'descripcion': 'durante el login'})
+    assert escritura.status_code == 201
+    soltar.set()
+    hilo.join(10)
+    assert resultado['status'] == 200
+
+
+def test_el_login_no_queda_en_el_cache_de_idempotencia(client, usuario):
+    cabeceras = {'Idempotency-Key': 'login-' + uuid.uuid4().hex}
+    primera = login(client, usuario, headers=cabeceras)
+    segunda = login(client, usuario, headers=cabeceras)
+    assert primera.status_code == segunda.status_code == 200
+    assert 'Idempotent-Replayed' not in segunda.headers
+    assert primera.get_json()['token'] != segunda.get_json()['token']
+
+
+def test_las_sesiones_vencidas_se_borran_al_iniciar_otra(main, client, usuario, monkeypatch):
+    monkeypatch.setattr(main, 'SESSION_TTL', 0.0)
+    login(client, usuario)
+    vencidas = main.store.find_items(main.SESIONES_FILE, 'usuario', usuario['usuario'])
+    assert vencidas
+    login(client, usuario)
+    for sesion in vencidas:
+        assert main.store.get_item(main.SESIONES_FILE, sesion['id']) is None
+
+
+def test_el_admin_inicial_se_crea_con_hash(carpeta):
+    codigo = '''
+import json, main
+cliente = main.app.test_client()
+respuesta = cliente.post('/api/data/users/authenticate', json={'username': 'admin', 'password': 'admin'})
+print(json.dumps({'status': respuesta.status_code, 'users': json.load(open('datos/users.json'))}))
+'''
+    salida = json.loads(ejecutar(carpeta, codigo))
+    assert salida['status'] == 200
+    [admin] = salida['users']
+    assert 'contrasena' not in admin and admin['contrasena_hash']
+
+
+@pytest.mark.parametrize('cuerpo', [{'username': ['a'], 'password': 'x'}, {'username': 'admin', 'password': 1}, ['admin']])
+def test_credenciales_que_no_son_texto_son_400(client, cuerpo):
+    assert client.post('/api/data/users/authenticate', json=cuerpo).status_code == 400
+
+
+@pytest.mark.parametrize('cambios', [{'contrasena': 'otra'}, {'usuario': 'renombrado'}])
+def test_cambiar_contrasena_o_nombre_cierra_las_sesiones(main, client, usuario, cambios):
+    token = login(client, usuario).get_json()['token']
+    sesion = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/data/users/session', headers=sesion).status_code == 200
+    nuevo = dict(cambios)
+    if 'usuario' in nuevo:
+        nuevo['usuario'] = usuario['usuario'] + '-renombrado'
+    assert client.put(f"/api/data/users/{usuario['usuario']}", json=nuevo).status_code == 200
+    assert client.get('/api/data/users/session', headers=sesion).status_code == 401
+    assert main.store.find_items(main.SESIONES_FILE, 'usuario', usuario['usuario']) == []
+    if 'usuario' in nuevo:
+        with main.store.exclusive():
+            main.store.delete_items(main.USERS_FILE, [nuevo['usuario']])
+
+
+def test_las_sesiones_revocadas_salen_del_heap(main, client, usuario, monkeypatch):
+    monkeypatch.setattr(main, 'vencimiento_sesiones', main.VencimientoSesiones())
+    for _ in range(4):
+        login(client, usuario)
+    with main.store.exclusive():
+        main.revocar_sesiones(usuario['usuario'])
+    vigentes = {s['id'] for s in main.read_data(main.SESIONES_FILE)}
+    assert {sid for _, sid in main.vencimiento_sesiones._heap} <= vigentes
@@ -0,0 +1,90 @@
+import datetime
+import uuid
+
+import pytest
+
+
+def dia(dias):
+    return (datetime.date.today() + datetime.timedelta(days=dias)).isoformat()
+
+
+@pytest.fixture
+def vencimiento(client):
+    respuesta = client.post('/api/data/vencimientos', json={'descripcion': 'Prueba ' + uuid.uuid4().hex[:6], 'vencimiento': dia(3)})
+    assert respuesta.status_code == 201
+    item = respuesta.get_json()
+    yield item
+    client.delete(f"/api/data/vencimientos/{item['id']}")
+
+
+def fechas_de(client, item_id, **consulta):
+    respuesta = client.get('/api/data/vencimientos/upcoming', query_string=consulta)
+    assert respuesta.status_code == 200
+    return [r['fecha'] for r in respuesta.get_json() if r['tipo'] == 'vencimiento' and r['item']['id'] == item_id]
+
+
+def test_cambiar_la_fecha_mueve_el_vencimiento(client, vencimiento):
+    assert fechas_de(client, vencimiento['id'], days=7) == [dia(3)]
+    client.put(f"/api/data/vencimientos/{vencimiento['id']}", json={'vencimiento': dia(20)})
+    assert fechas_de(client, vencimiento['id'], days=7) == []
+    assert fechas_de(client, vencimiento['id'], days=30) == [dia(20)]
+    client.put(f"/api/data/vencimientos/{vencimiento['id']}", json={'vencimiento': dia(-10)})
+    assert fechas_de(client, vencimiento['id'], days=30) == []
+    assert fechas_de(client, vencimiento['id'], days=30, desde=dia(-15)) == [dia(-10)]
+
+
+def test_un_vencimiento_eliminado_deja_de_aparecer(client, vencimiento):
+    assert fechas_de(client, vencimiento['id'], days=7) == [dia(3)]
+    client.delete(f"/api/data/vencimientos/{vencimiento['id']}")
+    assert fechas_de(client, vencimiento['id'], days=7) == []
+
+
+def test_muchos_cambios_no_duplican_entradas(main, client, vencimiento):
+    for i in range(200):
+        client.put(f"/api/data/vencimientos/{vencimiento['id']}", json={'vencimiento': dia(i % 30)})
+    assert fechas_de(client, vencimiento['id'], days=60) == [dia(199 % 30)]
+    agenda = main.agenda_vencimientos
+    assert agenda._obsoletas <= len(agenda._vigentes)
+
+
+@pytest.fixture
+def arbol(client):
+    """raiz → hijo → nieto, y otra raíz aparte. Borra al final lo que quede."""
+    ids = {}
+    for nombre, padre in (('raiz', None), ('hijo', 'raiz'), ('nieto', 'hijo'), ('otra', None)):
+        datos = {'descripcion': f'Árbol {nombre}', 'vencimiento': dia(40)}
+        if padre:
+            datos['padre_id'] = ids[padre]
+        ids[nombre] = client.post('/api/data/vencimientos', json=datos).get_json()['id']
+    yield ids
+    for item_id in ids.values():
+        client.delete(f'/api/data/vencimientos/{item_id}')
+
+
+def test_no_se_puede_mover_un_item_dentro_de_su_rama(client, arbol):
+    for destino in ('raiz', 'hijo', 'nieto'):
+        respuesta = client.put(f"/api/data/vencimientos/{arbol['raiz']}/mover", json={'padre_id': arbol[destino]})
+        assert respuesta.status_code == 400
+    assert client.get(f"/api/data/vencimientos/{arbol['nieto']}/arbol").get_json()['padre_id'] == arbol['hijo']
+
+    assert client.put(f"/api/data/vencimientos/{arbol['hijo']}/mover", json={'padre_id': arbol['otra']}).status_code == 200
+    otra = client.get(f"/api/data/vencimientos/{arbol['otra']}/arbol").get_json()
+    assert [h['id'] for h in otra['children']] == [arbol['hijo']]
+    assert [n['id'] for n in otra['children'][0]['children']] == [arbol['nieto']]
+    assert client.get(f"/api/data/vencimientos/{arbol['raiz']}/arbol").get_json()['children'] == []
+
+
+def test_borrar_un_item_borra_su_rama(main, client, arbol):
+    assert client.delete(f"/api/data/vencimientos/{arbol['raiz']}").status_code == 200
+    for nombre in ('raiz', 'hijo', 'nieto'):
+        assert main.store.get_item(main.VENCIMIENTOS_FILE, arbol[nombre]) is None
+    assert main.store.get_item(main.VENCIMIENTOS_FILE, arbol['otra']) is not None
+
+
+def test_una_rama_profunda_se_borra_sin_recursion(main, client):
+    ids = [str(uuid.uuid4()) for _ in range(3000)]
+    with main.store.exclusive(), main.store.atomic():
+        for padre, item_id in zip([None] + ids, ids):
+            main.store.insert_item(main.VENCIMIENTOS_FILE, {'id': item_id, 'descripcion': 'Cadena', 'padre_id': padre})
+    assert client.delete(f'/api/data/vencimientos/{ids[0]}').status_code == 200
+    assert all(main.store.get_item(main.VENCIMIENTOS_FILE, item_id) is None for item_id in ids)